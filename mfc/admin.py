@@ -1,12 +1,31 @@
-from django.contrib import admin
+import os
+import re
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import FieldError, PermissionDenied
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.urls import path, reverse
+from django.utils.html import format_html
+from django.template.response import TemplateResponse
 from django.utils import timezone
 from django.utils.timesince import timesince
 from import_export.admin import ExportMixin 
+from import_export.signals import post_export
 from .resources import BranchResource, ServiceResource 
+from .counters import defer_counters, edited_fields
+from .counts import EXACT_COUNT_PARAM, ApproximatePaginator
+from .exports import export_rows, stream_csv, xlsx_file
+from .export_jobs import ExportLimitReached, cancel_export, enqueue_export
+from .photo_jobs import retry_job
+from .uploads import cancel_upload
+from .search import search_branches, search_services
 from simple_history.admin import SimpleHistoryAdmin
 from import_export.formats.base_formats import XLSX, CSV
 
-from .models import Branch, Service, BranchService, UserProfile, Employee, Appointment
+from .models import Branch, Service, BranchService, UserProfile, Employee, Appointment, SlotCapacity, AppointmentSlot, ExportJob, SlowQuery, PhotoJob, ChunkedUpload
 
 class BranchServiceInline(admin.TabularInline):
     model = BranchService
@@ -22,12 +41,169 @@ class ServiceBranchInline(admin.TabularInline):
     fields = ['branch', 'is_available', 'updated_at']
     readonly_fields = ['updated_at']
 
-class BranchAdmin(ExportMixin, SimpleHistoryAdmin):
+class FullTextSearchMixin:
+    # поиск в админке через полнотекстовый индекс вместо icontains по всем полям
+    full_text_search = None
+
+    def get_search_results(self, request, queryset, search_term):
+        # телефон и email в индекс не входят, их ищем обычным способом
+        contact_search = '@' in search_term or re.fullmatch(r'[\d\s()+-]+', search_term)
+        if not search_term or contact_search or self.full_text_search is None:
+            return super().get_search_results(request, queryset, search_term)
+        return self.full_text_search(queryset, search_term), False
+
+class AutocompleteFilter(admin.FieldListFilter):
+    # фильтр по внешнему ключу без списка всех объектов в боковой панели:
+    # варианты подгружаются через admin autocomplete по мере ввода
+    template = 'admin/mfc/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        self.lookup_val = params.get(self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.app_label = model._meta.app_label
+        self.model_name = model._meta.model_name
+        self.field_name = field.name
+        self.remote_model = field.remote_field.model
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        # выбранный объект — один запрос по первичному ключу
+        selected = None
+        if self.lookup_val:
+            selected = self.remote_model._default_manager.filter(pk=self.lookup_val).first()
+        yield {
+            'value': self.lookup_val if selected else None,
+            'label': str(selected) if selected else '',
+            'url_template': changelist.get_query_string({self.lookup_kwarg: '__value__'}),
+            'clear_url': changelist.get_query_string(remove=[self.lookup_kwarg]),
+        }
+
+
+class AutocompleteFilterMixin:
+    # скрипты select2 для AutocompleteFilter в списке объектов
+    @property
+    def media(self):
+        field = next(
+            self.model._meta.get_field(spec[0]) for spec in self.list_filter
+            if isinstance(spec, tuple) and spec[1] is AutocompleteFilter
+        )
+        return (
+            super().media
+            + AutocompleteSelect(field, self.admin_site).media
+            + forms.Media(js=['mfc/admin/autocomplete_filter.js'])
+        )
+
+class ApproximateCountMixin:
+    # в списке приблизительное число строк вместо COUNT(*) по всей таблице;
+    # ?exact_count=1 считает точно
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        if EXACT_COUNT_PARAM in request.GET:
+            # параметр не фильтр: убираем его до того, как ChangeList разберет GET
+            request.GET = request.GET.copy()
+            del request.GET[EXACT_COUNT_PARAM]
+            request.exact_count = True
+        return super().changelist_view(request, extra_context)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return ApproximatePaginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            exact=getattr(request, 'exact_count', False),
+        )
+
+class StreamingExportMixin(ExportMixin):
+    # CSV отдается потоком, XLSX пишется во временный файл на диске: память
+    # не растет вместе с числом строк
+    def export_action(self, request):
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+
+        formats = self.get_export_formats()
+        form = self.get_export_form_class()(
+            formats,
+            self.get_export_resource_classes(request),
+            data=request.POST or None,
+        )
+        if request.POST and 'export_items' in request.POST:
+            # экспорт выбранных строк через действие в списке
+            form.fields['export_items'] = forms.MultipleChoiceField(
+                widget=forms.MultipleHiddenInput,
+                required=False,
+                choices=[(pk, pk) for pk in self.get_valid_export_item_pks(request)],
+            )
+        if form.is_valid():
+            file_format = formats[int(form.cleaned_data['format'])]()
+            if 'export_items' in form.changed_data:
+                queryset = self.model.objects.filter(pk__in=form.cleaned_data['export_items'])
+            else:
+                queryset = self.get_export_queryset(request)
+            export_fields = self.get_export_resource_fields_from_form(form)
+            if queryset.count() > getattr(settings, 'MFC_EXPORT_BACKGROUND_ROWS', 20000):
+                return self.enqueue_export(request, form, file_format, export_fields)
+            resource_class = self.choose_export_resource_class(form, request)
+            resource = resource_class(**self.get_export_resource_kwargs(request))
+            filename = self.get_export_filename(request, queryset, file_format)
+            try:
+                rows = export_rows(resource, queryset, export_fields)
+                if file_format.get_extension() == 'csv':
+                    response = StreamingHttpResponse(
+                        stream_csv(rows, self.to_encoding or 'utf-8'),
+                        content_type=file_format.get_content_type(),
+                    )
+                    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+                else:
+                    response = FileResponse(
+                        xlsx_file(rows),
+                        as_attachment=True,
+                        filename=filename,
+                        content_type=file_format.get_content_type(),
+                    )
+                post_export.send(sender=None, model=self.model)
+                return response
+            except FieldError as e:
+                messages.error(request, str(e))
+
+        context = self.init_request_context_data(request, form)
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, [self.export_template_name], context=context)
+
+    def enqueue_export(self, request, form, file_format, export_fields):
+        # большие выгрузки не держат запрос: файл готовит фоновый воркер
+        item_ids = form.cleaned_data['export_items'] if 'export_items' in form.changed_data else None
+        try:
+            job = enqueue_export(
+                request.user, self.export_job_resource, file_format.get_extension(), export_fields, item_ids
+            )
+        except ExportLimitReached as e:
+            messages.error(request, str(e))
+            return redirect('admin:mfc_exportjob_changelist')
+        messages.success(request, f'Выгрузка #{job.pk} поставлена в очередь, файл появится в списке выгрузок')
+        return redirect('admin:mfc_exportjob_changelist')
+
+class EditedFieldsAdminMixin:
+    # при изменении пишем только поля, измененные в форме: счетчики услуг обновляют
+    # сигналы, и значения, загруженные вместе с формой, их не затирают
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        obj._history_user = request.user  # как в SimpleHistoryAdmin.save_model
+        obj.save(update_fields=edited_fields(form.changed_data))
+
+class BranchAdmin(EditedFieldsAdminMixin, FullTextSearchMixin, StreamingExportMixin, SimpleHistoryAdmin):
     resource_class = BranchResource 
+    export_job_resource = 'branch'
     export_formats = [XLSX, CSV]
-    list_display = ['id', 'name', 'phone', 'is_active', 'created_at', 'time_since_update']
+    list_display = ['id', 'name', 'phone', 'is_active', 'services_count', 'created_at', 'time_since_update']
     list_filter = ['is_active', 'updated_at']
     search_fields = ['name', 'address', 'phone', 'email']
+    full_text_search = staticmethod(search_branches)
     fieldsets = [
         ('Основная информация', {
             'fields': ['name', 'address', 'phone', 'email', 'photo']
@@ -54,12 +230,19 @@ class BranchAdmin(ExportMixin, SimpleHistoryAdmin):
     def get_export_queryset(self, request):
         return self.resource_class().get_export_queryset()
 
-class ServiceAdmin(ExportMixin, SimpleHistoryAdmin):
+    def save_related(self, request, form, formsets, change):
+        # счетчики пересчитываются один раз на весь инлайн, а не на каждую строку
+        with defer_counters():
+            super().save_related(request, form, formsets, change)
+
+class ServiceAdmin(EditedFieldsAdminMixin, FullTextSearchMixin, StreamingExportMixin, SimpleHistoryAdmin):
     resource_class = ServiceResource 
+    export_job_resource = 'service'
     export_formats = [XLSX, CSV]
-    list_display = ['id', 'name', 'category', 'duration_days', 'created_at', 'time_since_update']
+    list_display = ['id', 'name', 'category', 'duration_days', 'available_branches_count', 'created_at', 'time_since_update']
     list_filter = ['category', 'updated_at']
     search_fields = ['name']
+    full_text_search = staticmethod(search_services)
     fieldsets = [
         ('Основная информация', {
             'fields': ['name', 'category', 'duration_days']
@@ -83,8 +266,14 @@ class ServiceAdmin(ExportMixin, SimpleHistoryAdmin):
     def get_export_queryset(self, request):
         return self.resource_class().get_export_queryset()
 
+    def save_related(self, request, form, formsets, change):
+        # счетчики пересчитываются один раз на весь инлайн, а не на каждую строку
+        with defer_counters():
+            super().save_related(request, form, formsets, change)
+
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'full_name', 'email', 'role', 'created_at', 'time_since_update']
+    list_select_related = ['user']
     list_filter = ['role', 'updated_at']
     search_fields = ['full_name', 'email', 'phone', 'user__username']
     fieldsets = [
@@ -109,9 +298,12 @@ class UserProfileAdmin(admin.ModelAdmin):
     list_display_links = ['id', 'user', 'full_name']
     ordering = ['full_name']
 
-class EmployeeAdmin(admin.ModelAdmin):
+class EmployeeAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ['id', 'user_profile', 'office', 'position', 'created_at', 'time_since_update']
-    list_filter = ['position', 'office', 'updated_at']
+    # __str__ профиля берет username, поэтому тянем и user
+    list_select_related = ['user_profile__user', 'office']
+    list_filter = ['position', ('office', AutocompleteFilter), 'updated_at']
+    autocomplete_fields = ['user_profile', 'office']
     search_fields = ['user_profile__full_name']
     fieldsets = [
         ('Сотрудник', {
@@ -135,9 +327,13 @@ class EmployeeAdmin(admin.ModelAdmin):
     list_display_links = ['id', 'user_profile']
     ordering = ['updated_at']
 
-class AppointmentAdmin(SimpleHistoryAdmin):
+class AppointmentAdmin(ApproximateCountMixin, AutocompleteFilterMixin, SimpleHistoryAdmin):
     list_display = ['id', 'user_profile', 'service', 'branch', 'date', 'time', 'status', 'created_at', 'time_since_update']
-    list_filter = ['status', 'branch', 'service', 'updated_at']
+    list_select_related = ['user_profile__user', 'service', 'branch']
+    list_filter = ['status', ('branch', AutocompleteFilter), ('service', AutocompleteFilter), 'updated_at']
+    autocomplete_fields = ['user_profile', 'service', 'branch']
+    # годы и месяцы в date_hierarchy по MIN/MAX, без DISTINCT по всей таблице
+    change_list_template = 'admin/mfc/change_list_index_dates.html'
     search_fields = ['user_profile__full_name', 'date']
     fieldsets = [
         ('Клиент и услуга', {
@@ -165,9 +361,28 @@ class AppointmentAdmin(SimpleHistoryAdmin):
     list_display_links = ['id', 'user_profile']
     ordering = ['-date', '-time']
 
-class BranchServiceAdmin(admin.ModelAdmin):
+class HistoricalAppointmentAdmin(ApproximateCountMixin, admin.ModelAdmin):
+    # общий журнал изменений записей на прием, только для чтения
+    list_display = ['history_id', 'id', 'status', 'date', 'time', 'history_type', 'history_user', 'history_date']
+    list_select_related = ['history_user']
+    list_filter = ['history_type', 'status']
+    search_fields = ['=id']
+    ordering = ['-history_date', '-history_id']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+class BranchServiceAdmin(ApproximateCountMixin, AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ['id', 'branch', 'service', 'is_available', 'time_since_update']
-    list_filter = ['is_available', 'branch', 'service', 'updated_at']
+    list_select_related = ['branch', 'service']
+    list_filter = ['is_available', ('branch', AutocompleteFilter), ('service', AutocompleteFilter), 'updated_at']
+    autocomplete_fields = ['branch', 'service']
     fieldsets = [
         ('Связь отделения и услуги', {
             'fields': ['branch', 'service']
@@ -190,9 +405,201 @@ class BranchServiceAdmin(admin.ModelAdmin):
     list_display_links = ['id', 'is_available']
     ordering = ['-updated_at']
 
+class SlotCapacityAdmin(admin.ModelAdmin):
+    list_display = ['id', 'branch', 'service', 'time', 'capacity', 'time_since_update']
+    list_select_related = ['branch', 'service']
+    list_filter = ['branch']
+    fields = ['branch', 'service', 'time', 'capacity']
+    @admin.display(description='Обновлено')
+    def time_since_update(self, obj):
+        if obj.updated_at:
+            time_diff = timesince(obj.updated_at, timezone.now())
+            return f"{time_diff} назад"
+        return "—"
+    list_display_links = ['id', 'branch']
+    ordering = ['branch__name', 'time']
+
+class AppointmentSlotAdmin(admin.ModelAdmin):
+    # счетчики меняются только через запись на прием, руками их не правим
+    list_display = ['id', 'branch', 'service', 'date', 'time', 'booked', 'capacity']
+    list_select_related = ['branch', 'service']
+    list_filter = ['date']
+    date_hierarchy = 'date'
+    change_list_template = 'admin/mfc/change_list_index_dates.html'
+    readonly_fields = ['branch', 'service', 'date', 'time', 'capacity', 'booked']
+    ordering = ['-date', 'time']
+
+    def has_add_permission(self, request):
+        return False
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'resource', 'file_format', 'status', 'progress', 'download', 'created_at', 'finished_at']
+    list_select_related = ['user']
+    list_filter = ['status', 'resource']
+    readonly_fields = [field.name for field in ExportJob._meta.fields]
+    actions = ['cancel_jobs']
+    ordering = ['-created_at']
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.user.is_superuser:
+            return queryset
+        return queryset.filter(user=request.user)
+
+    @admin.display(description='Прогресс')
+    def progress(self, obj):
+        if not obj.rows_total:
+            return "—"
+        return f"{obj.rows_done}/{obj.rows_total} ({obj.rows_done * 100 // obj.rows_total}%)"
+
+    @admin.display(description='Файл')
+    def download(self, obj):
+        if obj.status != ExportJob.Status.DONE or not obj.file:
+            return "—"
+        return format_html('<a href="{}">Скачать</a>', reverse('admin:mfc_exportjob_download', args=[obj.pk]))
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:object_id>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='mfc_exportjob_download',
+            ),
+            *super().get_urls(),
+        ]
+
+    def download_view(self, request, object_id):
+        # файл лежит вне MEDIA_ROOT; get_queryset оставляет только свои выгрузки
+        job = self.get_queryset(request).filter(pk=object_id, status=ExportJob.Status.DONE).exclude(file='').first()
+        if job is None or not job.file.storage.exists(job.file.name):
+            raise Http404('Выгрузка не найдена')
+        return FileResponse(job.file.open('rb'), as_attachment=True, filename=os.path.basename(job.file.name))
+
+    @admin.action(description='Отменить выбранные выгрузки')
+    def cancel_jobs(self, request, queryset):
+        cancelled = sum(cancel_export(job) for job in queryset)
+        messages.success(request, f'Отменено выгрузок: {cancelled}')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+class SlowQueryAdmin(admin.ModelAdmin):
+    # журнал SlowQueryMiddleware: сверху запросы с наибольшим суммарным временем
+    list_display = ['id', 'view', 'short_sql', 'calls', 'total_time', 'average_time', 'max_time', 'time_since_update']
+    search_fields = ['view', 'sql']
+    fields = ['view', 'sql', 'example', 'formatted_plan', 'calls', 'total_time', 'max_time', 'first_seen', 'last_seen']
+    readonly_fields = fields
+    ordering = ['-total_time']
+
+    @admin.display(description='SQL')
+    def short_sql(self, obj):
+        return obj.sql[:120]
+
+    @admin.display(description='В среднем, мс')
+    def average_time(self, obj):
+        return f"{obj.total_time / obj.calls:.1f}" if obj.calls else "—"
+
+    @admin.display(description='План запроса')
+    def formatted_plan(self, obj):
+        return format_html('<pre>{}</pre>', obj.plan or '—')
+
+    @admin.display(description='Обновлено')
+    def time_since_update(self, obj):
+        if obj.last_seen:
+            time_diff = timesince(obj.last_seen, timezone.now())
+            return f"{time_diff} назад"
+        return "—"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+class PhotoJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'branch', 'photo', 'status', 'attempts', 'wait_time', 'duration', 'created_at', 'time_since_update']
+    list_select_related = ['branch']
+    list_filter = ['status']
+    search_fields = ['photo', 'old_photo', 'branch__name']
+    readonly_fields = [field.name for field in PhotoJob._meta.fields]
+    actions = ['retry_jobs']
+    ordering = ['-created_at']
+
+    @admin.display(description='Ожидание')
+    def wait_time(self, obj):
+        if not obj.started_at:
+            return "—"
+        return f"{(obj.started_at - obj.created_at).total_seconds():.1f} с"
+
+    @admin.display(description='Выполнение')
+    def duration(self, obj):
+        if not obj.started_at or not obj.finished_at:
+            return "—"
+        return f"{(obj.finished_at - obj.started_at).total_seconds():.1f} с"
+
+    @admin.display(description='Обновлено')
+    def time_since_update(self, obj):
+        updated = obj.finished_at or obj.started_at or obj.created_at
+        if updated:
+            time_diff = timesince(updated, timezone.now())
+            return f"{time_diff} назад"
+        return "—"
+
+    @admin.action(description='Повторить выбранные задачи с ошибкой')
+    def retry_jobs(self, request, queryset):
+        retried = sum(retry_job(job) for job in queryset)
+        messages.success(request, f'Поставлено в очередь повторно: {retried}')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'filename', 'purpose', 'status', 'progress', 'created_at', 'time_since_update']
+    list_select_related = ['user']
+    list_filter = ['status', 'purpose']
+    search_fields = ['filename', 'user__username']
+    readonly_fields = [field.name for field in ChunkedUpload._meta.fields]
+    actions = ['cancel_uploads']
+    ordering = ['-created_at']
+
+    @admin.display(description='Получено')
+    def progress(self, obj):
+        return f"{obj.offset}/{obj.size} ({obj.offset * 100 // obj.size}%)" if obj.size else "—"
+
+    @admin.display(description='Обновлено')
+    def time_since_update(self, obj):
+        if obj.updated_at:
+            time_diff = timesince(obj.updated_at, timezone.now())
+            return f"{time_diff} назад"
+        return "—"
+
+    @admin.action(description='Отменить выбранные загрузки')
+    def cancel_uploads(self, request, queryset):
+        cancelled = sum(cancel_upload(upload) for upload in queryset)
+        messages.success(request, f'Отменено загрузок: {cancelled}')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 admin.site.register(Branch, BranchAdmin)
 admin.site.register(Service, ServiceAdmin)
 admin.site.register(UserProfile, UserProfileAdmin)
 admin.site.register(Employee, EmployeeAdmin)
 admin.site.register(Appointment, AppointmentAdmin)
-admin.site.register(BranchService, BranchServiceAdmin)
\ No newline at end of file
+admin.site.register(Appointment.history.model, HistoricalAppointmentAdmin)
+admin.site.register(BranchService, BranchServiceAdmin)
+admin.site.register(SlotCapacity, SlotCapacityAdmin)
+admin.site.register(AppointmentSlot, AppointmentSlotAdmin)
+admin.site.register(ExportJob, ExportJobAdmin)
+admin.site.register(SlowQuery, SlowQueryAdmin)
+admin.site.register(PhotoJob, PhotoJobAdmin)
+admin.site.register(ChunkedUpload, ChunkedUploadAdmin)
\ No newline at end of file
@@ -1,22 +1,83 @@
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from django_filters import rest_framework as django_filters
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q, Count
-from .models import Branch, Service
-from .serializers import BranchSerializer, ServiceSerializer
+from django.db import transaction
+from django.db.models import Q
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from datetime import datetime, timedelta
+from simple_history.utils import bulk_update_with_history
+from .models import Appointment, Branch, BranchService, ChunkedUpload, Employee, Service
+from .serializers import (
+    AppointmentSerializer, BranchSerializer, ChunkedUploadSerializer, ServiceSerializer,
+    BulkAvailabilitySerializer, BulkBranchActiveSerializer, BulkServiceDurationSerializer,
+)
+from .booking import get_open_slots
+from .cache import bump_catalogue_version
+from .counters import refresh_branch_counters, refresh_service_counters
+from .daily_stats import get_branch_stats
+from .pagination import AppointmentCursorPagination
+from .search import FullTextSearchFilter, search_branches
+from .uploads import OffsetMismatch, UploadRejected, cancel_upload, complete_upload, start_upload, write_chunk
+
+MAX_BULK_ITEMS = 1000
+
+
+def validate_bulk_items(data, serializer_class, key):
+    # проверяет форму каждого элемента и повторы ключа; возвращает данные и ошибки по индексам
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return None, {'error': 'Ожидается непустой список items'}
+    if len(items) > MAX_BULK_ITEMS:
+        return None, {'error': f'За один запрос можно передать не больше {MAX_BULK_ITEMS} элементов'}
+    cleaned = []
+    errors = []
+    seen = set()
+    for item in items:
+        serializer = serializer_class(data=item)
+        if not serializer.is_valid():
+            cleaned.append(None)
+            errors.append(serializer.errors)
+            continue
+        item_key = key(serializer.validated_data)
+        if item_key in seen:
+            cleaned.append(None)
+            errors.append({'non_field_errors': ['Элемент повторяется в запросе']})
+            continue
+        seen.add(item_key)
+        cleaned.append(serializer.validated_data)
+        errors.append(None)
+    return cleaned, errors
+
+
+def bulk_response(errors, results):
+    # все или ничего: при любой ошибке изменения не применяются
+    if any(errors):
+        return Response({
+            'error': 'Изменения не применены, исправьте ошибки',
+            'results': [
+                {'index': index, 'status': 'error', 'errors': item_errors} if item_errors
+                else {'index': index, 'status': 'ok'}
+                for index, item_errors in enumerate(errors)
+            ],
+        }, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        'updated': len(results),
+        'results': [{'index': index, 'status': 'updated', **result} for index, result in enumerate(results)],
+    }, status=status.HTTP_200_OK)
+
+
+def history_user(request):
+    return request.user if request.user.is_authenticated else None
 
 class BranchViewSet(viewsets.ModelViewSet):
-    queryset = Branch.objects.all().annotate(
-        active_services_count=Count(
-            'branch_services',
-            filter=Q(branch_services__is_available=True),
-            distinct=True
-        )
-    ).order_by('name')
+    # счетчики услуг хранятся в колонках отделения (mfc.counters)
+    queryset = Branch.objects.all().order_by('name')
     serializer_class = BranchSerializer
-    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
     filterset_fields = ['is_active']
     permission_classes = [AllowAny]
 
@@ -42,7 +103,8 @@ class BranchViewSet(viewsets.ModelViewSet):
     def toggle_active(self, request, pk=None):
         branch = self.get_object()
         branch.is_active = not branch.is_active
-        branch.save()
+        # счетчики услуг пишут сигналы BranchService, их не перезаписываем
+        branch.save(update_fields=['is_active', 'updated_at'])
         serializer = self.get_serializer(branch)
         
         return Response({
@@ -50,22 +112,86 @@ class BranchViewSet(viewsets.ModelViewSet):
             'branch': serializer.data
         }, status=status.HTTP_200_OK)
     
+    @action(detail=False, methods=['POST'], permission_classes=[IsAdminUser]) # массовое включение/выключение отделений
+    def bulk_toggle_active(self, request):
+        items, errors = validate_bulk_items(request.data, BulkBranchActiveSerializer, lambda item: item['id'])
+        if items is None:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        branches = Branch.objects.in_bulk([item['id'] for item in items if item])
+        for index, item in enumerate(items):
+            if item and item['id'] not in branches:
+                errors[index] = {'id': ['Отделение не найдено']}
+        if any(errors):
+            return bulk_response(errors, [])
+
+        now = timezone.now()
+        changed = []
+        for item in items:
+            branch = branches[item['id']]
+            branch.is_active = item.get('is_active', not branch.is_active)
+            branch.updated_at = now
+            changed.append(branch)
+        with transaction.atomic():
+            bulk_update_with_history(
+                changed, Branch, ['is_active', 'updated_at'], default_user=history_user(request)
+            )
+        bump_catalogue_version()
+        return bulk_response(errors, [{'id': branch.pk, 'is_active': branch.is_active} for branch in changed])
+
+    @action(detail=False, methods=['POST'], permission_classes=[IsAdminUser]) # массовая установка доступности услуг в отделениях
+    def bulk_availability(self, request):
+        items, errors = validate_bulk_items(
+            request.data, BulkAvailabilitySerializer, lambda item: (item['branch'], item['service'])
+        )
+        if items is None:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # все связи одним запросом по отделениям из списка
+        pairs = {(item['branch'], item['service']) for item in items if item}
+        links = {
+            (link.branch_id, link.service_id): link
+            for link in BranchService.objects.filter(branch_id__in={branch for branch, _ in pairs})
+            if (link.branch_id, link.service_id) in pairs
+        }
+        for index, item in enumerate(items):
+            if item and (item['branch'], item['service']) not in links:
+                errors[index] = {'non_field_errors': ['Услуга не предоставляется в этом отделении']}
+        if any(errors):
+            return bulk_response(errors, [])
+
+        now = timezone.now()
+        changed = []
+        for item in items:
+            link = links[(item['branch'], item['service'])]
+            link.is_available = item['is_available']
+            link.updated_at = now
+            changed.append(link)
+        with transaction.atomic():
+            BranchService.objects.bulk_update(changed, ['is_available', 'updated_at'])
+            # bulk_update не вызывает сигналы, счетчики пересчитываем сами
+            refresh_branch_counters({link.branch_id for link in changed})
+            refresh_service_counters({link.service_id for link in changed})
+        bump_catalogue_version()
+        return bulk_response(errors, [
+            {'branch': link.branch_id, 'service': link.service_id, 'is_available': link.is_available}
+            for link in changed
+        ])
+
     @action(detail=False, methods=['GET']) # сложный поиск с Q объектами
     def complex_search(self, request):
         query = request.query_params.get('query', '')
         active_only = request.query_params.get('active', 'false').lower() == 'true'
         q_objects = Q()
         
-        if query:
-            q_objects |= Q(name__icontains=query)
-            q_objects |= Q(address__icontains=query)
-        
         if active_only:
             q_objects &= Q(is_active=True)
         
         q_objects &= ~Q(email__icontains='test')
         
-        branches = Branch.objects.filter(q_objects).order_by('name')
+        # название, адрес и услуги ищутся по полнотекстовому индексу, а исключение
+        # тестовых email проверяется уже только на найденных строках
+        branches = search_branches(Branch.objects.all(), query).filter(q_objects).order_by('name')
         
         page = self.paginate_queryset(branches)
         if page is not None:
@@ -75,10 +201,98 @@ class BranchViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(branches, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['GET']) # свободные слоты записи на период
+    def availability(self, request, pk=None):
+        branch = get_object_or_404(Branch.objects.only('id', 'is_active'), pk=pk)
+        today = timezone.localdate()
+        try:
+            date_from = datetime.strptime(request.query_params.get('date_from', today.isoformat()), '%Y-%m-%d').date()
+            date_to = request.query_params.get('date_to')
+            date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else date_from + timedelta(days=6)
+        except ValueError:
+            return Response(
+                {'error': 'Даты должны быть в формате ГГГГ-ММ-ДД'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        service_id = request.query_params.get('service')
+        if service_id:
+            try:
+                service_id = int(service_id)
+            except ValueError:
+                return Response(
+                    {'error': 'Услуга должна быть указана числом'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            service_id = None
+
+        date_from = max(date_from, today)
+        if date_to < date_from or (date_to - date_from).days > 31:
+            return Response(
+                {'error': 'Период должен быть не длиннее 31 дня и не в прошлом'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        slots = []
+        if branch.is_active:
+            slots = [
+                {
+                    'date': day.isoformat(),
+                    'time': slot_time.strftime('%H:%M'),
+                    'service': slot_service_id,
+                    'free': capacity - booked,
+                }
+                for day, slot_time, slot_service_id, capacity, booked
+                in get_open_slots(branch.pk, date_from, date_to, service_id)
+            ]
+        
+        return Response({
+            'branch': branch.pk,
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'slots': slots,
+        })
+
+    @action(detail=True, methods=['GET']) # загрузка отделения по дням из готовой сводки
+    def daily_stats(self, request, pk=None):
+        branch = get_object_or_404(Branch.objects.only('id'), pk=pk)
+        user = request.user
+        if not user.is_staff and not Employee.objects.filter(user_profile__user_id=user.pk, office=branch).exists():
+            return Response(
+                {'error': 'Статистика доступна только сотрудникам отделения'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        today = timezone.localdate()
+        try:
+            date_from = datetime.strptime(request.query_params.get('date_from', today.isoformat()), '%Y-%m-%d').date()
+            date_to = request.query_params.get('date_to')
+            date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else date_from
+        except ValueError:
+            return Response(
+                {'error': 'Даты должны быть в формате ГГГГ-ММ-ДД'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if date_to < date_from or (date_to - date_from).days > 31:
+            return Response(
+                {'error': 'Период должен быть не длиннее 31 дня'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        days = get_branch_stats(branch.pk, date_from, date_to)
+        for day in days:
+            day['date'] = day['date'].isoformat()
+        return Response({
+            'branch': branch.pk,
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'days': days,
+        })
+    
 class ServiceViewSet(viewsets.ModelViewSet):
     queryset = Service.objects.all().order_by('name')
     serializer_class = ServiceSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
     filterset_fields = ['category']
     permission_classes = [AllowAny]
     
@@ -112,6 +326,39 @@ class ServiceViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(services, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['POST'], permission_classes=[IsAdminUser]) # массовое изменение сроков выполнения
+    def bulk_update_duration(self, request):
+        items, errors = validate_bulk_items(request.data, BulkServiceDurationSerializer, lambda item: item['id'])
+        if items is None:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        services = Service.objects.in_bulk([item['id'] for item in items if item])
+        for index, item in enumerate(items):
+            if item and item['id'] not in services:
+                errors[index] = {'id': ['Услуга не найдена']}
+        if any(errors):
+            return bulk_response(errors, [])
+
+        now = timezone.now()
+        changed = []
+        for item in items:
+            service = services[item['id']]
+            service.duration_days = item['duration_days']
+            service.updated_at = now
+            changed.append(service)
+        with transaction.atomic():
+            bulk_update_with_history(
+                changed, Service, ['duration_days', 'updated_at'], default_user=history_user(request)
+            )
+            # срок услуг входит в средний срок отделений
+            refresh_branch_counters(
+                BranchService.objects.filter(service__in=changed).values_list('branch_id', flat=True)
+            )
+        bump_catalogue_version()
+        return bulk_response(errors, [
+            {'id': service.pk, 'duration_days': service.duration_days} for service in changed
+        ])
+
     @action(detail=True, methods=['POST']) # изменение срока выполнения услуги
     def update_duration(self, request, pk=None): 
         service = self.get_object()
@@ -137,10 +384,98 @@ class ServiceViewSet(viewsets.ModelViewSet):
             )
         
         service.duration_days = new_duration
-        service.save()
+        service.save(update_fields=['duration_days', 'updated_at'])
         
         serializer = self.get_serializer(service)
         return Response({
             'message': f'Срок выполнения услуги изменен на {new_duration} дней',
             'service': serializer.data
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }, status=status.HTTP_200_OK)
+
+class AppointmentFilter(django_filters.FilterSet):
+    date_from = django_filters.DateFilter(field_name='date', lookup_expr='gte')
+    date_to = django_filters.DateFilter(field_name='date', lookup_expr='lte')
+    status = django_filters.MultipleChoiceFilter(choices=Appointment.Status.choices)
+
+    class Meta:
+        model = Appointment
+        fields = ['date_from', 'date_to', 'status', 'service']
+
+
+class AppointmentViewSet(viewsets.ReadOnlyModelViewSet):
+    # клиент видит свои записи, сотрудник — записи своего отделения
+    serializer_class = AppointmentSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = AppointmentFilter
+    pagination_class = AppointmentCursorPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        appointments = Appointment.objects.select_related('service', 'branch', 'user_profile')
+        office_id = Employee.objects.filter(user_profile__user=user).values_list('office_id', flat=True).first()
+        if office_id is not None:
+            # фильтр по отделению и дате идет по индексу (branch, date)
+            return appointments.filter(branch_id=office_id)
+        return appointments.filter(user_profile__user=user)
+
+
+def upload_response(upload, status_code=status.HTTP_200_OK):
+    # Upload-Offset — с какого байта слать следующую часть
+    return Response(
+        ChunkedUploadSerializer(upload).data,
+        status=status_code,
+        headers={'Upload-Offset': str(upload.offset)}
+    )
+
+
+class ChunkedUploadViewSet(viewsets.GenericViewSet):
+    # загрузка больших файлов частями с докачкой (mfc.uploads):
+    # POST создает загрузку, PUT с заголовком Upload-Offset дописывает часть,
+    # GET показывает, сколько уже получено (а для импорта — сколько строк уже
+    # разобрано в фоне), DELETE отменяет
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAdminUser]
+    lookup_field = 'token'
+
+    def get_queryset(self):
+        return ChunkedUpload.objects.filter(user=self.request.user)
+
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            upload = start_upload(request.user, **serializer.validated_data)
+        except UploadRejected as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        return upload_response(upload, status.HTTP_201_CREATED)
+
+    def retrieve(self, request, token=None):
+        return upload_response(self.get_object())
+
+    def update(self, request, token=None):
+        upload = self.get_object()
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            return Response(
+                {'error': 'Нужны заголовки Upload-Offset и Content-Length'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            # тело читается потоком из запроса, request.data не трогаем
+            upload = write_chunk(upload, offset, request, length)
+            if upload.offset == upload.size:
+                upload = complete_upload(upload)
+        except OffsetMismatch:
+            upload.refresh_from_db()
+            return upload_response(upload, status.HTTP_409_CONFLICT)
+        except UploadRejected as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        return upload_response(upload)
+
+    def destroy(self, request, token=None):
+        if not cancel_upload(self.get_object()):
+            return Response({'error': 'Загрузка уже завершена'}, status=status.HTTP_409_CONFLICT)
+        return Response(status=status.HTTP_204_NO_CONTENT)
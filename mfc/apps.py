@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class MfcConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mfc'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import metrics, signals, slow_queries  # noqa: F401
+        metrics.instrument_templates()
+        connection_created.connect(metrics.install_execute_wrapper)
+        connection_created.connect(slow_queries.install_execute_wrapper)
@@ -0,0 +1,164 @@
+from math import ceil
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.http import Http404, HttpResponse
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .api import BranchViewSet, ServiceViewSet
+from .cache import aget_catalogue_version, aget_or_build
+from .models import Branch, BranchService
+from .views import can_cache_branch_list
+
+# async-версии публичных страниц и чтения API: под ASGI запросы к базе идут через
+# async ORM, а не через поток на весь view; под WSGI Django сам запускает их через async_to_sync
+
+PAGE_PARAM = 'page'
+
+
+def load_session(request):
+    # шаблон берет из сессии пользователя и сообщения; сессия лежит в базе,
+    # поэтому в async view ее загружаем заранее в потоке
+    request.user.is_authenticated
+    len(messages.get_messages(request))
+
+
+async def get_branch_rows():
+    return [branch async for branch in Branch.objects.order_by('name').aiterator()]
+
+
+async def branch_list(request):
+    await sync_to_async(load_session)(request)
+    if not can_cache_branch_list(request):
+        branches = await aget_or_build('branch_rows', get_branch_rows)
+        response = render(request, 'mfc/branch_list.html', {'branches': branches})
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    # то же, что condition(etag_func=branch_list_etag) у синхронной версии
+    version = await aget_catalogue_version()
+    etag = quote_etag(f'branch-list-{version}')
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        async def build_html():
+            branches = await aget_or_build('branch_rows', get_branch_rows, version)
+            return render(request, 'mfc/branch_list.html', {'branches': branches}).content.decode()
+
+        response = HttpResponse(await aget_or_build('branch_list_html', build_html, version))
+    response.headers['ETag'] = etag
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+async def branch_detail(request, pk):
+    try:
+        branch = await Branch.objects.aget(pk=pk)
+    except Branch.DoesNotExist:
+        raise Http404('Отделение не найдено')
+    services = [
+        branch_service async for branch_service in
+        BranchService.objects.filter(branch=branch).select_related('service').aiterator()
+    ]
+    await sync_to_async(load_session)(request)
+    return render(request, 'mfc/branch_detail.html', {
+        'branch': branch,
+        'services': services,
+    })
+
+
+def json_response(data):
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json')
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def can_serve(request, allowed_params):
+    # браузерный API, поиск, сортировка и другие режимы пагинации остаются за DRF
+    if request.method != 'GET' or 'text/html' in request.headers.get('Accept', ''):
+        return False
+    return set(request.GET) <= allowed_params
+
+
+async def api_list(request, viewset, sync_view, context):
+    if not can_serve(request, {PAGE_PARAM, *viewset.filterset_fields}):
+        return await sync_to_async(sync_view)(request)
+    queryset = viewset.queryset
+    filterset = DjangoFilterBackend().get_filterset_class(viewset, queryset)(request.GET, queryset=queryset)
+    if not filterset.is_valid():
+        return await sync_to_async(sync_view)(request)
+    queryset = filterset.qs
+
+    # как PageNumberPagination: count, next, previous, results
+    page_size = api_settings.PAGE_SIZE
+    count = await queryset.acount()
+    try:
+        number = int(request.GET.get(PAGE_PARAM, 1))
+    except ValueError:
+        number = 0
+    if not 1 <= number <= max(1, ceil(count / page_size)):
+        # 404 с текстом DRF
+        return await sync_to_async(sync_view)(request)
+    start = (number - 1) * page_size
+    objects = [obj async for obj in queryset[start:start + page_size].aiterator()]
+
+    url = request.build_absolute_uri()
+    if number == 1:
+        previous = None
+    elif number == 2:
+        previous = remove_query_param(url, PAGE_PARAM)
+    else:
+        previous = replace_query_param(url, PAGE_PARAM, number - 1)
+    return json_response({
+        'count': count,
+        'next': replace_query_param(url, PAGE_PARAM, number + 1) if start + page_size < count else None,
+        'previous': previous,
+        'results': viewset.serializer_class(objects, many=True, context=dict(context, request=request)).data,
+    })
+
+
+async def api_detail(request, pk, viewset, sync_view, context):
+    if not can_serve(request, set()):
+        return await sync_to_async(sync_view)(request, pk=pk)
+    try:
+        obj = await viewset.queryset.aget(pk=pk)
+    except viewset.queryset.model.DoesNotExist:
+        return await sync_to_async(sync_view)(request, pk=pk)
+    return json_response(viewset.serializer_class(obj, context=dict(context, request=request)).data)
+
+
+# запись и все, что async-версия не повторяет, уходит в синхронный viewset
+branch_sync_list = BranchViewSet.as_view({'get': 'list', 'post': 'create'})
+branch_sync_detail = BranchViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+})
+service_sync_list = ServiceViewSet.as_view({'get': 'list', 'post': 'create'})
+service_sync_detail = ServiceViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+})
+
+
+async def branch_api_list(request):
+    return await api_list(request, BranchViewSet, branch_sync_list, {'include_services': True})
+
+
+async def branch_api_detail(request, pk):
+    return await api_detail(request, pk, BranchViewSet, branch_sync_detail, {'include_services': True})
+
+
+async def service_api_list(request):
+    return await api_list(request, ServiceViewSet, service_sync_list, {})
+
+
+async def service_api_detail(request, pk):
+    return await api_detail(request, pk, ServiceViewSet, service_sync_detail, {})
+
+
+# CSRF для записи проверяет сам DRF, как и у синхронных viewset
+for view in (branch_api_list, branch_api_detail, service_api_list, service_api_detail):
+    view.csrf_exempt = True
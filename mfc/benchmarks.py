@@ -0,0 +1,305 @@
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import timedelta
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import Branch, Service, UserProfile
+
+
+class Endpoint:
+    def __init__(self, name, url, method='GET', user=None, data=None):
+        self.name = name
+        self.url = url          # строка или функция от контекста
+        self.method = method
+        self.user = user        # None — гость, 'client' или 'staff'
+        self.data = data
+
+    def build(self, context):
+        url = self.url(context) if callable(self.url) else self.url
+        data = self.data(context) if callable(self.data) else self.data
+        return url, data
+
+
+def next_slot(context):
+    # каждая запись на свое время, чтобы не упираться во вместимость слота
+    context['slot'] += 1
+    day = timezone.localdate() + timedelta(days=1 + context['slot'] // 19 % 25)
+    minutes = 9 * 60 + (context['slot'] % 19) * 30
+    return {
+        'service': context['service'],
+        'date': day.isoformat(),
+        'time': f'{minutes // 60:02d}:{minutes % 60:02d}',
+    }
+
+
+ENDPOINTS = [
+    Endpoint('branch_list', '/'),
+    Endpoint('branch_list_staff', '/', user='staff'),
+    Endpoint('branch_detail', lambda context: f"/branches/{context['branch']}/"),
+    Endpoint('appointment_form', lambda context: f"/branches/{context['branch']}/appointment/", user='client'),
+    Endpoint(
+        'appointment_create',
+        lambda context: f"/branches/{context['branch']}/appointment/",
+        method='POST', user='client', data=next_slot,
+    ),
+    Endpoint('api_branches', '/api/branches/'),
+    Endpoint('api_branches_cursor', '/api/branches/?pagination=cursor'),
+    Endpoint('api_branches_active', '/api/branches/active/'),
+    Endpoint('api_branches_complex_search', '/api/branches/complex_search/?query=МФЦ&active=true'),
+    Endpoint('api_branch_detail', lambda context: f"/api/branches/{context['branch']}/"),
+    Endpoint('api_branch_availability', lambda context: f"/api/branches/{context['branch']}/availability/"),
+    Endpoint('api_services', '/api/services/'),
+    Endpoint('api_services_fast', '/api/services/fast_services/?max_days=10'),
+    Endpoint('api_service_detail', lambda context: f"/api/services/{context['service']}/"),
+    Endpoint('api_appointments', '/api/appointments/', user='client'),
+]
+
+
+def percentile(values, share):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(share * (len(values) - 1))))
+    return values[index]
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_context():
+    # отделение с наибольшим числом доступных услуг и одна из этих услуг
+    branch = Branch.objects.filter(is_active=True, available_services_count__gt=0).order_by(
+        '-available_services_count', 'pk'
+    ).first()
+    service = Service.objects.filter(
+        branch_services__branch=branch, branch_services__is_available=True
+    ).order_by('pk').first()
+    client_profile = UserProfile.objects.filter(role='client').order_by('pk').first()
+    if branch is None or service is None or client_profile is None:
+        raise CommandError(
+            'В базе нет активного отделения с услугами или клиента: '
+            'сначала выполните python manage.py generate_load_data'
+        )
+    staff, _ = User.objects.get_or_create(
+        username='benchmark-staff', defaults={'is_staff': True, 'is_superuser': True}
+    )
+    return {
+        'branch': branch.pk,
+        'service': service.pk,
+        'client': client_profile.user,
+        'staff': staff,
+        'slot': 0,
+    }
+
+
+def measure(endpoint, context, repeat, warmup):
+    client = Client()
+    if endpoint.user:
+        client.force_login(context[endpoint.user])
+    send = client.post if endpoint.method == 'POST' else client.get
+
+    for _ in range(warmup):
+        url, data = endpoint.build(context)
+        send(url, data)
+
+    timings = []
+    queries = []
+    statuses = set()
+    for _ in range(repeat):
+        url, data = endpoint.build(context)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = send(url, data)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured.captured_queries))
+        statuses.add(response.status_code)
+
+    # память меряем отдельным запросом: tracemalloc заметно замедляет код
+    url, data = endpoint.build(context)
+    tracemalloc.start()
+    send(url, data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'method': endpoint.method,
+        'url': url,
+        'status': sorted(statuses),
+        'requests': repeat,
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p90_ms': round(percentile(timings, 0.9), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'queries': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(repeat=50, warmup=5, only=None, progress=None):
+    progress = progress or (lambda message: None)
+    cache.clear()
+    context = build_context()
+    results = {}
+    for endpoint in ENDPOINTS:
+        if only and endpoint.name not in only:
+            continue
+        results[endpoint.name] = measure(endpoint, context, repeat, warmup)
+        result = results[endpoint.name]
+        progress(
+            f"{endpoint.name:<30} p50 {result['p50_ms']:>8.2f} мс  p99 {result['p99_ms']:>8.2f} мс  "
+            f"запросов {result['queries']:>3}  память {result['peak_memory_kb']:>8.1f} КБ"
+        )
+    return results
+
+
+def build_report(results, dataset):
+    return {
+        'meta': {
+            'commit': get_commit(),
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'dataset': dataset,
+        },
+        'results': results,
+    }
+
+
+def compare_reports(baseline, current, threshold=0.2):
+    # регрессия: p50 вырос больше чем на threshold или стало больше запросов к БД
+    rows = []
+    regressions = []
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            continue
+        change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] if old['p50_ms'] else 0
+        rows.append((name, old['p50_ms'], result['p50_ms'], change, old['queries'], result['queries']))
+        if change > threshold or result['queries'] > old['queries']:
+            regressions.append(name)
+    return rows, regressions
+
+
+def load_report(path):
+    with open(path, encoding='utf-8') as report:
+        return json.load(report)
+
+
+def save_report(report, path):
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(report, output, ensure_ascii=False, indent=2)
+
+
+# пары для manage.py benchmark_async: синхронный адрес и его async-версия под /async/
+ASYNC_ENDPOINTS = [
+    Endpoint('branch_list', '/'),
+    Endpoint('branch_detail', lambda context: f"/branches/{context['branch']}/"),
+    Endpoint('api_branches', '/api/branches/?page=2'),
+    Endpoint('api_branch_detail', lambda context: f"/api/branches/{context['branch']}/"),
+    Endpoint('api_services', '/api/services/'),
+    Endpoint('api_service_detail', lambda context: f"/api/services/{context['service']}/"),
+]
+
+
+async def asgi_get(application, url):
+    # запрос прямо в ASGI-приложение, как его вызывает uvicorn, без сокета и разбора HTTP
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'accept', b'application/json')],
+        'client': ('127.0.0.1', 50000),
+        'server': ('testserver', 80),
+    }
+    received = False
+    status = None
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # клиент не отключается, пока ответ не отправлен
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+async def measure_concurrent(application, url, concurrency, total):
+    timings = []
+    statuses = set()
+    remaining = total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            statuses.add(await asgi_get(application, url))
+            timings.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'url': url,
+        'status': sorted(statuses),
+        'concurrency': concurrency,
+        'requests': total,
+        'rps': round(total / elapsed, 1),
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+    }
+
+
+def run_async_benchmarks(application, concurrency_levels, total, warmup=10, only=None, progress=None):
+    # одинаковая нагрузка на синхронный view и его async-версию через один ASGI-обработчик
+    progress = progress or (lambda message: None)
+    cache.clear()
+    context = build_context()
+    results = {}
+    for endpoint in ASYNC_ENDPOINTS:
+        if only and endpoint.name not in only:
+            continue
+        url, _ = endpoint.build(context)
+        for mode, mode_url in (('sync', url), ('async', f'/async{url}')):
+            asyncio.run(measure_concurrent(application, mode_url, 1, warmup))
+            for concurrency in concurrency_levels:
+                result = asyncio.run(measure_concurrent(application, mode_url, concurrency, total))
+                results[f'{endpoint.name}:{mode}:{concurrency}'] = result
+                progress(
+                    f"{endpoint.name:<20} {mode:<6} x{concurrency:<4} {result['rps']:>9.1f} запр/с  "
+                    f"p50 {result['p50_ms']:>8.2f} мс  p99 {result['p99_ms']:>8.2f} мс  {result['status']}"
+                )
+    return results
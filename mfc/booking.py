@@ -0,0 +1,248 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import Appointment, AppointmentSlot, BranchService, SlotCapacity
+
+WORKDAY_START = time(9, 0)
+WORKDAY_END = time(18, 0)
+
+# статусы, при которых запись больше не занимает место в слоте
+RELEASED_STATUSES = (Appointment.Status.CANCELLED, Appointment.Status.NO_SHOW)
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+def get_slot_minutes():
+    return getattr(settings, 'MFC_SLOT_MINUTES', 30)
+
+
+def get_default_capacity():
+    return getattr(settings, 'MFC_DEFAULT_SLOT_CAPACITY', 1)
+
+
+def slot_start(value):
+    # время записи приводим к началу слота: 10:47 -> 10:30
+    minutes = value.hour * 60 + value.minute
+    minutes -= minutes % get_slot_minutes()
+    return time(minutes // 60, minutes % 60)
+
+
+def slot_times():
+    # все слоты рабочего дня, 18:00 включительно, как и в проверке формы записи
+    step = timedelta(minutes=get_slot_minutes())
+    current = datetime.combine(datetime.min, WORKDAY_START)
+    end = datetime.combine(datetime.min, WORKDAY_END)
+    times = []
+    while current <= end:
+        times.append(current.time())
+        current += step
+    return times
+
+
+def holds_seat(status):
+    return status not in RELEASED_STATUSES
+
+
+def get_slot_capacity(branch_id, service_id, slot_time, capacities=None):
+    # самое точное правило выигрывает: услуга+слот, услуга, слот, все отделение
+    if capacities is None:
+        capacities = SlotCapacity.objects.filter(
+            Q(service_id=service_id) | Q(service__isnull=True),
+            Q(time=slot_time) | Q(time__isnull=True),
+            branch_id=branch_id,
+        ).values_list('service_id', 'time', 'capacity')
+    rules = {(rule_service, rule_time): capacity for rule_service, rule_time, capacity in capacities}
+    for key in ((service_id, slot_time), (service_id, None), (None, slot_time), (None, None)):
+        if key in rules:
+            return rules[key]
+    return get_default_capacity()
+
+
+def get_or_create_slot(branch_id, service_id, date, slot_time):
+    # get_or_create сам переживает гонку за вставку строки через savepoint
+    slot, _ = AppointmentSlot.objects.get_or_create(
+        branch_id=branch_id,
+        service_id=service_id,
+        date=date,
+        time=slot_time,
+        defaults={'capacity': lambda: get_slot_capacity(branch_id, service_id, slot_time)},
+    )
+    return slot
+
+
+def take_seat(branch_id, service_id, date, value, check_capacity=True):
+    slot_time = slot_start(value)
+    slots = AppointmentSlot.objects.filter(
+        branch_id=branch_id, service_id=service_id, date=date, time=slot_time
+    )
+    if check_capacity:
+        # условие в WHERE проверяется под блокировкой строки, поэтому последнее место
+        # достанется только одному из конкурирующих запросов
+        slots = slots.filter(booked__lt=F('capacity'))
+    # UPDATE идет первым, чтобы транзакция сразу стала пишущей (важно для SQLite)
+    if slots.update(booked=F('booked') + 1):
+        return True
+    # строки слота еще нет (или мест нет) — создаем ее при необходимости и пробуем еще раз
+    get_or_create_slot(branch_id, service_id, date, slot_time)
+    return slots.update(booked=F('booked') + 1) == 1
+
+
+def release_seat(branch_id, service_id, date, value):
+    AppointmentSlot.objects.filter(
+        branch_id=branch_id,
+        service_id=service_id,
+        date=date,
+        time=slot_start(value),
+        booked__gt=0,
+    ).update(booked=F('booked') - 1)
+
+
+def reserve_appointment(user_profile, service, branch, date, value):
+    with transaction.atomic():
+        if not take_seat(branch.pk, service.pk, date, value):
+            raise SlotUnavailable(
+                f'На {date:%d.%m.%Y} в {slot_start(value):%H:%M} свободных мест нет'
+            )
+        appointment = Appointment(
+            user_profile=user_profile,
+            service=service,
+            branch=branch,
+            date=date,
+            time=value,
+            status=Appointment.Status.PENDING,
+        )
+        # место уже занято выше, сигнал не должен занимать его второй раз
+        appointment._slot_reserved = True
+        appointment.save()
+    return appointment
+
+
+def refresh_slot_capacities(branch_id, from_date=None):
+    # после изменения правил пересчитываем вместимость будущих слотов отделения
+    from_date = from_date or timezone.localdate()
+    capacities = list(
+        SlotCapacity.objects.filter(branch_id=branch_id).values_list('service_id', 'time', 'capacity')
+    )
+    slots = list(AppointmentSlot.objects.filter(branch_id=branch_id, date__gte=from_date))
+    for slot in slots:
+        slot.capacity = get_slot_capacity(branch_id, slot.service_id, slot.time, capacities)
+    AppointmentSlot.objects.bulk_update(slots, ['capacity'], batch_size=500)
+
+
+def build_slots(branch_id, date_from, date_to):
+    # материализуем сетку слотов на период: строки, которых еще нет, создаются
+    # с нулевым счетчиком, т.к. все занятые места уже лежат в существующих строках
+    service_ids = list(
+        BranchService.objects.filter(branch_id=branch_id, is_available=True)
+        .values_list('service_id', flat=True)
+    )
+    times = slot_times()
+    expected = len(service_ids) * len(times)
+    built = dict(
+        AppointmentSlot.objects.filter(
+            branch_id=branch_id, date__range=(date_from, date_to), service_id__in=service_ids
+        ).values('date').annotate(count=Count('id')).values_list('date', 'count')
+    )
+    days = [
+        date_from + timedelta(days=offset)
+        for offset in range((date_to - date_from).days + 1)
+        if built.get(date_from + timedelta(days=offset), 0) < expected
+    ]
+    if days:
+        capacities = list(
+            SlotCapacity.objects.filter(branch_id=branch_id).values_list('service_id', 'time', 'capacity')
+        )
+        AppointmentSlot.objects.bulk_create([
+            AppointmentSlot(
+                branch_id=branch_id, service_id=service_id, date=day, time=slot_time,
+                capacity=get_slot_capacity(branch_id, service_id, slot_time, capacities),
+            )
+            for day in days for service_id in service_ids for slot_time in times
+        ], batch_size=500, ignore_conflicts=True)
+    return service_ids
+
+
+def get_open_slots(branch_id, date_from, date_to, service_id=None):
+    # только чтение: сетка считается в памяти из существующих строк слотов и правил
+    # вместимости, строки создают запись (take_seat) и rebuild_availability
+    services = BranchService.objects.filter(branch_id=branch_id, is_available=True)
+    if service_id is not None:
+        services = services.filter(service_id=service_id)
+    service_ids = sorted(services.values_list('service_id', flat=True))
+    if not service_ids:
+        return []
+    rows = {
+        (day, slot_time, slot_service_id): (capacity, booked)
+        for day, slot_time, slot_service_id, capacity, booked in AppointmentSlot.objects.filter(
+            branch_id=branch_id, date__range=(date_from, date_to), service_id__in=service_ids
+        ).values_list('date', 'time', 'service_id', 'capacity', 'booked')
+    }
+    capacities = list(
+        SlotCapacity.objects.filter(branch_id=branch_id).values_list('service_id', 'time', 'capacity')
+    )
+    default = {
+        (slot_service_id, slot_time): (get_slot_capacity(branch_id, slot_service_id, slot_time, capacities), 0)
+        for slot_service_id in service_ids for slot_time in slot_times()
+    }
+
+    now = timezone.localtime()
+    slots = []
+    for offset in range((date_to - date_from).days + 1):
+        day = date_from + timedelta(days=offset)
+        for slot_time in slot_times():
+            # на сегодня прошедшие слоты уже не предлагаем
+            if day == now.date() and slot_time < now.time():
+                continue
+            for slot_service_id in service_ids:
+                capacity, booked = rows.get(
+                    (day, slot_time, slot_service_id), default[slot_service_id, slot_time]
+                )
+                if booked < capacity:
+                    slots.append((day, slot_time, slot_service_id, capacity, booked))
+    return slots
+
+
+def rebuild_slots(date_from, date_to, branch_ids=None):
+    # пересчет счетчиков слотов по самим записям (после импорта или ручных правок в БД)
+    appointments = Appointment.objects.filter(date__range=(date_from, date_to)).exclude(
+        status__in=RELEASED_STATUSES
+    )
+    slots = AppointmentSlot.objects.filter(date__range=(date_from, date_to))
+    if branch_ids is not None:
+        appointments = appointments.filter(branch_id__in=branch_ids)
+        slots = slots.filter(branch_id__in=branch_ids)
+    booked = {}
+    rows = appointments.values_list('branch_id', 'service_id', 'date', 'time')
+    for branch_id, service_id, day, value in rows.iterator(chunk_size=2000):
+        key = (branch_id, service_id, day, slot_start(value))
+        booked[key] = booked.get(key, 0) + 1
+
+    changed = []
+    for slot in slots.iterator(chunk_size=2000):
+        count = booked.pop((slot.branch_id, slot.service_id, slot.date, slot.time), 0)
+        if slot.booked != count:
+            slot.booked = count
+            changed.append(slot)
+    with transaction.atomic():
+        AppointmentSlot.objects.bulk_update(changed, ['booked'], batch_size=500)
+        capacities = {}
+        created = []
+        for (branch_id, service_id, day, slot_time), count in booked.items():
+            if branch_id not in capacities:
+                capacities[branch_id] = list(
+                    SlotCapacity.objects.filter(branch_id=branch_id)
+                    .values_list('service_id', 'time', 'capacity')
+                )
+            capacity = get_slot_capacity(branch_id, service_id, slot_time, capacities[branch_id])
+            created.append(AppointmentSlot(
+                branch_id=branch_id, service_id=service_id, date=day, time=slot_time,
+                booked=count, capacity=max(capacity, count),
+            ))
+        AppointmentSlot.objects.bulk_create(created, batch_size=500)
+    return len(changed) + len(created)
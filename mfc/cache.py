@@ -0,0 +1,59 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+CATALOGUE_VERSION_KEY = 'mfc:catalogue:version'
+
+
+def get_cache_timeout():
+    return getattr(settings, 'MFC_CATALOGUE_CACHE_TIMEOUT', 60 * 60)
+
+
+def get_catalogue_version():
+    # версия каталога живет в кэше бессрочно и меняется при любом изменении
+    # отделений, услуг или их доступности
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(CATALOGUE_VERSION_KEY, version, None):
+            version = cache.get(CATALOGUE_VERSION_KEY, version)
+    return version
+
+
+def bump_catalogue_version():
+    # старые ключи не удаляем: они больше не будут запрошены и истекут сами
+    cache.set(CATALOGUE_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def catalogue_key(name, version=None):
+    return f'mfc:catalogue:{version or get_catalogue_version()}:{name}'
+
+
+def get_or_build(name, build, version=None):
+    key = catalogue_key(name, version)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, get_cache_timeout())
+    return value
+
+
+async def aget_catalogue_version():
+    # то же для async view: aget/aadd не блокируют цикл событий на сетевых кэшах
+    version = await cache.aget(CATALOGUE_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not await cache.aadd(CATALOGUE_VERSION_KEY, version, None):
+            version = await cache.aget(CATALOGUE_VERSION_KEY, version)
+    return version
+
+
+async def aget_or_build(name, build, version=None):
+    # build — корутинная функция
+    key = catalogue_key(name, version or await aget_catalogue_version())
+    value = await cache.aget(key)
+    if value is None:
+        value = await build()
+        await cache.aset(key, value, get_cache_timeout())
+    return value
@@ -0,0 +1,123 @@
+import threading
+from contextlib import contextmanager
+
+from django.db.models import Avg, Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Cast, Ceil, Coalesce
+
+from .models import Branch, BranchService, Service
+
+_deferred = threading.local()
+
+COUNTER_FIELDS = {'services_count', 'available_services_count', 'avg_duration_days', 'available_branches_count'}
+
+
+def edited_fields(names):
+    # update_fields для сохранения из формы или API: только то, что меняли, без
+    # счетчиков — их пишут refresh_*_counters, а в загруженном экземпляре они могли устареть
+    fields = set(names) - COUNTER_FIELDS
+    if 'photo' in fields:
+        fields.add('photo_pending')  # его выставляет сигнал pre_save при смене фото
+    return sorted(fields | {'updated_at'})
+
+
+def branch_counter_values():
+    # одно выражение на колонку: UPDATE считает все по индексу branch_services
+    links = BranchService.objects.filter(branch=OuterRef('pk')).order_by().values('branch')
+    return {
+        'services_count': Coalesce(Subquery(links.annotate(total=Count('pk')).values('total')), 0),
+        'available_services_count': Coalesce(
+            Subquery(links.filter(is_available=True).annotate(total=Count('pk')).values('total')), 0
+        ),
+        'avg_duration_days': Subquery(
+            links.annotate(
+                avg=Cast(Ceil(Avg('service__duration_days')), IntegerField())
+            ).values('avg')
+        ),
+    }
+
+
+def service_counter_values():
+    links = BranchService.objects.filter(
+        service=OuterRef('pk'), is_available=True
+    ).order_by().values('service')
+    return {
+        'available_branches_count': Coalesce(
+            Subquery(links.annotate(total=Count('pk')).values('total')), 0
+        ),
+    }
+
+
+def refresh_branch_counters(branch_ids=None):
+    # branch_ids=None — пересчитать все отделения
+    if branch_ids is not None:
+        branch_ids = set(branch_ids)
+        pending = getattr(_deferred, 'branches', None)
+        if pending is not None:
+            pending.update(branch_ids)
+            return
+        if not branch_ids:
+            return
+    branches = Branch.objects.all()
+    if branch_ids is not None:
+        branches = branches.filter(pk__in=branch_ids)
+    branches.update(**branch_counter_values())
+
+
+def refresh_service_counters(service_ids=None):
+    if service_ids is not None:
+        service_ids = set(service_ids)
+        pending = getattr(_deferred, 'services', None)
+        if pending is not None:
+            pending.update(service_ids)
+            return
+        if not service_ids:
+            return
+    services = Service.objects.all()
+    if service_ids is not None:
+        services = services.filter(pk__in=service_ids)
+    services.update(**service_counter_values())
+
+
+@contextmanager
+def defer_counters():
+    # копим затронутые id и пересчитываем один раз (инлайны админки, массовые правки)
+    if getattr(_deferred, 'branches', None) is not None:
+        yield
+        return
+    _deferred.branches = set()
+    _deferred.services = set()
+    try:
+        yield
+    finally:
+        branch_ids, service_ids = _deferred.branches, _deferred.services
+        _deferred.branches = None
+        _deferred.services = None
+    refresh_branch_counters(branch_ids)
+    refresh_service_counters(service_ids)
+
+
+def find_counter_mismatches():
+    # сравнение колонок с честным пересчетом, для команды rebuild_counters --check
+    mismatches = []
+    branches = Branch.objects.annotate(
+        expected_services=Count('branch_services', distinct=True),
+        expected_available=Count(
+            'branch_services', filter=Q(branch_services__is_available=True), distinct=True
+        ),
+        expected_avg=Cast(Ceil(Avg('services__duration_days')), IntegerField()),
+    ).order_by('pk')
+    for branch in branches.iterator(chunk_size=2000):
+        actual = (branch.services_count, branch.available_services_count, branch.avg_duration_days)
+        expected = (branch.expected_services, branch.expected_available, branch.expected_avg)
+        if actual != expected:
+            mismatches.append(('branch', branch.pk, actual, expected))
+
+    services = Service.objects.annotate(
+        expected_branches=Count('branch_services', filter=Q(branch_services__is_available=True))
+    ).order_by('pk')
+    for service in services.iterator(chunk_size=2000):
+        if service.available_branches_count != service.expected_branches:
+            mismatches.append((
+                'service', service.pk, service.available_branches_count, service.expected_branches
+            ))
+    return mismatches
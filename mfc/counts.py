@@ -0,0 +1,147 @@
+import hashlib
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .models import Appointment, BranchService
+
+# таблицы, для которых refresh_counts обновляет статистику базы
+APPROXIMATE_COUNT_MODELS = [Appointment, Appointment.history.model, BranchService]
+EXACT_COUNT_PARAM = 'exact_count'
+# какие запросы стоят за закэшированными подсчетами: ключ кэша -> (база, модель, query)
+COUNT_QUERIES_KEY = 'mfc:count:queries'
+
+
+def get_threshold():
+    # меньше стольких строк считаем точно: такой COUNT(*) дешевый
+    return getattr(settings, 'MFC_APPROXIMATE_COUNT_THRESHOLD', 10000)
+
+
+def get_cache_timeout():
+    return getattr(settings, 'MFC_APPROXIMATE_COUNT_TIMEOUT', 5 * 60)
+
+
+def table_estimate(model, using='default'):
+    # число строк по статистике планировщика; None, если статистики нет
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 появляется после первого ANALYZE
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            # первое число в stat — строк в таблице на момент ANALYZE
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    # -1 в PostgreSQL: таблицу еще ни разу не анализировали
+    return estimate if estimate >= 0 else None
+
+
+def count_cache_key(queryset):
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(f'{queryset.db}:{sql}:{params}'.encode()).hexdigest()
+    return f'mfc:count:{digest}'
+
+
+def approximate_count(queryset):
+    # (число, приблизительное ли): без фильтров — статистика базы,
+    # иначе COUNT(*), закэшированный на MFC_APPROXIMATE_COUNT_TIMEOUT секунд
+    threshold = get_threshold()
+    if not queryset.query.where:
+        estimate = table_estimate(queryset.model, queryset.db)
+        if estimate is not None and estimate >= threshold:
+            return estimate, True
+
+    key = count_cache_key(queryset)
+    count = cache.get(key)
+    if count is not None:
+        return count, True
+    count = queryset.count()
+    if count >= threshold:
+        cache.set(key, count, get_cache_timeout())
+        remember_count_query(key, queryset)
+    return count, False
+
+
+def remember_count_query(key, queryset):
+    # запрос запоминаем, чтобы refresh_counts мог пересчитать закэшированное число
+    queries = cache.get(COUNT_QUERIES_KEY, {})
+    queries[key] = (queryset.db, queryset.model._meta.label, queryset.query)
+    cache.set(COUNT_QUERIES_KEY, queries, None)
+
+
+def refresh_cached_counts():
+    # пересчитывает COUNT(*) с фильтрами, которые сейчас лежат в кэше, и продлевает их;
+    # подсчеты, выпавшие из кэша, давно не запрашивали — их просто забываем
+    queries = cache.get(COUNT_QUERIES_KEY, {})
+    in_use = {}
+    for key, (using, label, query) in queries.items():
+        if cache.get(key) is None:
+            continue
+        queryset = apps.get_model(label).objects.using(using).all()
+        queryset.query = query
+        cache.set(key, queryset.count(), get_cache_timeout())
+        in_use[key] = queries[key]
+    cache.set(COUNT_QUERIES_KEY, in_use, None)
+    return len(in_use)
+
+
+def refresh_statistics(models=APPROXIMATE_COUNT_MODELS, using='default'):
+    connection = connections[using]
+    statement = 'ANALYZE TABLE' if connection.vendor == 'mysql' else 'ANALYZE'
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f'{statement} {connection.ops.quote_name(model._meta.db_table)}')
+
+
+class ApproximatePaginator(Paginator):
+    def __init__(self, *args, exact=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exact = exact
+        self.approximate = False
+
+    @cached_property
+    def count(self):
+        if self.exact:
+            return super().count
+        count, self.approximate = approximate_count(self.object_list)
+        return count
+
+    def validate_number(self, number):
+        self.count  # approximate известен только после подсчета
+        if not self.approximate:
+            return super().validate_number(number)
+        # оценка может быть меньше реального числа строк: дальние страницы не отбрасываем
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы должен быть целым числом')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.approximate:
+            return super().page(number)
+        # и последнюю страницу не обрезаем по приблизительному count
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import ExtractHour
+
+from .models import Appointment, AppointmentDailyStat, Service
+
+
+def stat_key(branch_id, service_id, date, value, status):
+    # строка сводки, в которую попадает запись на прием
+    date = Appointment._meta.get_field('date').to_python(date)
+    value = Appointment._meta.get_field('time').to_python(value)
+    return (branch_id, service_id, date, status, value.hour)
+
+
+def add_to_stats(key, delta):
+    branch_id, service_id, date, status, hour = key
+    rows = AppointmentDailyStat.objects.filter(
+        branch_id=branch_id, service_id=service_id, date=date, status=status, hour=hour
+    )
+    if delta < 0:
+        rows.filter(count__gte=-delta).update(count=F('count') + delta)
+        return
+    # как со слотами: сначала UPDATE, строку создаем только если ее еще нет
+    if rows.update(count=F('count') + delta):
+        return
+    AppointmentDailyStat.objects.get_or_create(
+        branch_id=branch_id, service_id=service_id, date=date, status=status, hour=hour
+    )
+    rows.update(count=F('count') + delta)
+
+
+def rebuild_daily_stats(date_from=None, date_to=None, branch_ids=None):
+    # пересчет сводки по самим записям одним GROUP BY (после bulk_create или правок в БД)
+    appointments = Appointment.objects.all()
+    stats = AppointmentDailyStat.objects.all()
+    if date_from is not None:
+        appointments = appointments.filter(date__gte=date_from)
+        stats = stats.filter(date__gte=date_from)
+    if date_to is not None:
+        appointments = appointments.filter(date__lte=date_to)
+        stats = stats.filter(date__lte=date_to)
+    if branch_ids is not None:
+        appointments = appointments.filter(branch_id__in=branch_ids)
+        stats = stats.filter(branch_id__in=branch_ids)
+    rows = appointments.annotate(hour=ExtractHour('time')).values(
+        'branch_id', 'service_id', 'date', 'status', 'hour'
+    ).annotate(count=Count('id')).order_by()
+    with transaction.atomic():
+        stats.delete()
+        created = AppointmentDailyStat.objects.bulk_create(
+            [AppointmentDailyStat(**row) for row in rows.iterator(chunk_size=2000)], batch_size=2000
+        )
+    return len(created)
+
+
+def get_branch_stats(branch_id, date_from, date_to):
+    # дни периода со сводкой по статусам, услугам и часам; только строки сводки, без Appointment
+    rows = AppointmentDailyStat.objects.filter(
+        branch_id=branch_id, date__range=(date_from, date_to), count__gt=0
+    ).values_list('date', 'service_id', 'status', 'hour', 'count')
+    labels = dict(Appointment.Status.choices)
+    days = {}
+    for date, service_id, status, hour, count in rows:
+        day = days.setdefault(date, {'total': 0, 'by_status': {}, 'by_service': {}, 'by_hour': {}})
+        day['total'] += count
+        day['by_status'][status] = day['by_status'].get(status, 0) + count
+        day['by_service'][service_id] = day['by_service'].get(service_id, 0) + count
+        day['by_hour'][hour] = day['by_hour'].get(hour, 0) + count
+
+    service_ids = {service_id for day in days.values() for service_id in day['by_service']}
+    names = dict(Service.objects.filter(pk__in=service_ids).values_list('pk', 'name'))
+    return [
+        {
+            'date': date,
+            'total': day['total'],
+            'by_status': [
+                {'status': status, 'label': labels.get(status, status), 'count': count}
+                for status, count in sorted(day['by_status'].items())
+            ],
+            'by_service': [
+                {'service': service_id, 'name': names.get(service_id, ''), 'count': count}
+                for service_id, count in sorted(day['by_service'].items(), key=lambda item: -item[1])
+            ],
+            'by_hour': [
+                {'hour': hour, 'count': count}
+                for hour, count in sorted(day['by_hour'].items())
+            ],
+        }
+        for date, day in sorted(days.items())
+    ]
@@ -0,0 +1,168 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .exports import export_rows, stream_csv, write_xlsx
+from .models import ExportJob
+from .resources import BranchResource, ServiceResource
+
+EXPORT_RESOURCES = {
+    'branch': BranchResource,
+    'service': ServiceResource,
+}
+ACTIVE_STATUSES = [ExportJob.Status.PENDING, ExportJob.Status.RUNNING]
+PROGRESS_EVERY = 1000
+# задача без движения дольше этого считается брошенной (процесс перезапустили
+# или он упал): в лимит пользователя она не входит, run_due_jobs ее разбирает
+STALE_AFTER = timedelta(minutes=10)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ExportLimitReached(Exception):
+    pass
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def get_executor():
+    # пул создается при первой выгрузке, отдельный брокер не нужен
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'MFC_EXPORT_WORKERS', 2),
+                thread_name_prefix='mfc-export',
+            )
+        return _executor
+
+
+def enqueue_export(user, resource, file_format, export_fields=None, item_ids=None):
+    limit = getattr(settings, 'MFC_EXPORT_JOBS_PER_USER', 2)
+    with transaction.atomic():
+        # блокируем строку пользователя, чтобы два запроса не обошли лимит одновременно
+        User.objects.select_for_update().get(pk=user.pk)
+        active = ExportJob.objects.filter(
+            user=user, status__in=ACTIVE_STATUSES, updated_at__gte=timezone.now() - STALE_AFTER
+        )
+        if active.count() >= limit:
+            raise ExportLimitReached(f'Уже выполняется {limit} выгрузки, дождитесь их окончания')
+        job = ExportJob.objects.create(
+            user=user,
+            resource=resource,
+            file_format=file_format,
+            export_fields=export_fields,
+            item_ids=item_ids,
+        )
+        # воркер видит задачу только после коммита
+        transaction.on_commit(lambda: get_executor().submit(run_in_worker, job.pk))
+    return job
+
+
+def cancel_export(job):
+    # выполняющаяся задача заметит отмену при следующем обновлении прогресса
+    return ExportJob.objects.filter(pk=job.pk, status__in=ACTIVE_STATUSES).update(
+        status=ExportJob.Status.CANCELLED, updated_at=timezone.now(), finished_at=timezone.now()
+    )
+
+
+def run_in_worker(job_id):
+    close_old_connections()
+    try:
+        run_export_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def get_job_queryset(job):
+    resource = EXPORT_RESOURCES[job.resource]()
+    if job.item_ids is not None:
+        return resource, resource._meta.model.objects.filter(pk__in=job.item_ids).order_by('pk')
+    return resource, resource.get_export_queryset()
+
+
+def tracked(rows, job):
+    # считает строки и раз в PROGRESS_EVERY пишет прогресс, заодно проверяя отмену
+    for done, row in enumerate(rows):
+        if done and done % PROGRESS_EVERY == 0:
+            updated = ExportJob.objects.filter(pk=job.pk, status=ExportJob.Status.RUNNING).update(
+                rows_done=done - 1, updated_at=timezone.now()
+            )
+            if not updated:
+                raise ExportCancelled
+        yield row
+
+
+def run_export_job(job_id):
+    started = ExportJob.objects.filter(pk=job_id, status=ExportJob.Status.PENDING).update(
+        status=ExportJob.Status.RUNNING, updated_at=timezone.now()
+    )
+    if not started:
+        return  # отменена до запуска
+    job = ExportJob.objects.get(pk=job_id)
+    resource, queryset = get_job_queryset(job)
+    ExportJob.objects.filter(pk=job.pk).update(rows_total=queryset.count())
+
+    storage = ExportJob._meta.get_field('file').storage
+    name = storage.generate_filename(f'{job.resource}-{timezone.localdate():%Y-%m-%d}-{job.pk}.{job.file_format}')
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f'{path}.part'
+    try:
+        rows = tracked(export_rows(resource, queryset, job.export_fields), job)
+        with open(partial, 'wb') as output:
+            if job.file_format == 'csv':
+                for chunk in stream_csv(rows):
+                    output.write(chunk)
+            else:
+                write_xlsx(rows, output)
+        # файл появляется под своим именем только целиком
+        os.replace(partial, path)
+    except ExportCancelled:
+        os.remove(partial)
+        return
+    except Exception as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        ExportJob.objects.filter(pk=job.pk).update(
+            status=ExportJob.Status.FAILED, error=str(e), updated_at=timezone.now(), finished_at=timezone.now()
+        )
+        return
+
+    finished = ExportJob.objects.filter(pk=job.pk, status=ExportJob.Status.RUNNING).update(
+        status=ExportJob.Status.DONE,
+        file=name,
+        rows_done=F('rows_total'),
+        updated_at=timezone.now(),
+        finished_at=timezone.now(),
+    )
+    if not finished:
+        os.remove(path)  # отменили на последних строках
+
+
+def run_due_jobs():
+    # для manage.py process_export_jobs: выполнение, которое давно не писало прогресс,
+    # прервалось вместе с процессом; задачи, пропавшие из очереди пула, выполняются здесь
+    stale = timezone.now() - STALE_AFTER
+    failed = ExportJob.objects.filter(status=ExportJob.Status.RUNNING, updated_at__lt=stale).update(
+        status=ExportJob.Status.FAILED,
+        error='Выгрузка прервалась: процесс остановился',
+        updated_at=timezone.now(),
+        finished_at=timezone.now(),
+    )
+    done = 0
+    due = ExportJob.objects.filter(status=ExportJob.Status.PENDING, updated_at__lt=stale).order_by('pk')
+    for job_id in due.values_list('pk', flat=True):
+        run_export_job(job_id)
+        done += 1
+    return failed, done
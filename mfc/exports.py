@@ -0,0 +1,68 @@
+import csv
+import tempfile
+from datetime import datetime
+
+from django.core.exceptions import FieldError
+from django.utils import timezone
+from openpyxl import Workbook
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    # csv.writer пишет строку сюда и сразу получает ее обратно, без буфера на весь файл
+    def write(self, value):
+        return value
+
+
+def check_export_fields(resource, export_fields):
+    # import-export молча пропускает неизвестные поля; CSV отдается потоком, и ошибку
+    # посреди ответа уже не показать на странице экспорта, поэтому проверяем заранее
+    known = {name for field in resource.get_export_fields() for name in (field.attribute, field.column_name)}
+    unknown = [name for name in export_fields or [] if name not in known]
+    if unknown:
+        raise FieldError(f'Неизвестные поля экспорта: {", ".join(unknown)}')
+
+
+def export_rows(resource, queryset, export_fields=None):
+    # поля проверяются сразу при вызове, сами строки — лениво
+    check_export_fields(resource, export_fields)
+    return iter_export_rows(resource, queryset, export_fields)
+
+
+def iter_export_rows(resource, queryset, export_fields):
+    # заголовок и строки по одной: те же dehydrate_* что и в обычном экспорте,
+    # но без tablib.Dataset со всеми строками в памяти
+    queryset = resource.filter_export(queryset)
+    yield resource.get_export_headers(fields=export_fields)
+    for obj in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield resource.export_resource(obj, fields=export_fields)
+
+
+def stream_csv(rows, encoding='utf-8'):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row).encode(encoding)
+
+
+def excel_value(value):
+    # openpyxl не принимает даты с часовым поясом
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.localtime(value).replace(tzinfo=None)
+    return value
+
+
+def write_xlsx(rows, fileobj):
+    # write_only режим openpyxl сбрасывает строки на диск по мере добавления
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in rows:
+        sheet.append([excel_value(value) for value in row])
+    workbook.save(fileobj)
+
+
+def xlsx_file(rows):
+    fileobj = tempfile.TemporaryFile()
+    write_xlsx(rows, fileobj)
+    fileobj.seek(0)
+    return fileobj
@@ -0,0 +1,35 @@
+# справочник услуг для тестовых данных: generate_test_services и генератор нагрузки
+
+TEST_SERVICES = [
+    {'name': 'Загранпаспорт', 'category': 'DOC', 'duration': 30},
+    {'name': 'Свидетельство о рождении', 'category': 'DOC', 'duration': 7},
+    {'name': 'Справка о несудимости', 'category': 'DOC', 'duration': 10},
+    
+    {'name': 'Водительское удостоверение', 'category': 'TRANS', 'duration': 15},
+    {'name': 'Регистрация транспортного средства', 'category': 'TRANS', 'duration': 5},
+    {'name': 'Международные права', 'category': 'TRANS', 'duration': 20},
+    
+    {'name': 'Пенсионное удостоверение', 'category': 'SOC', 'duration': 7},
+    {'name': 'Социальная карта', 'category': 'SOC', 'duration': 21},
+    {'name': 'Пособие по безработице', 'category': 'SOC', 'duration': 10},
+    
+    {'name': 'Свидетельство о собственности', 'category': 'PROP', 'duration': 30},
+    {'name': 'Дарственная на квартиру', 'category': 'PROP', 'duration': 45},
+    {'name': 'Ипотечная регистрация', 'category': 'PROP', 'duration': 20},
+
+    {'name': 'Регистрация ИП', 'category': 'BUS', 'duration': 5},
+    {'name': 'Открытие расчетного счета', 'category': 'BUS', 'duration': 3},
+    {'name': 'Лицензия на торговлю', 'category': 'BUS', 'duration': 30},
+
+    {'name': 'Медицинская справка', 'category': 'HLTH', 'duration': 1},
+    {'name': 'Больничный лист', 'category': 'HLTH', 'duration': 3},
+    {'name': 'Справка для бассейна', 'category': 'HLTH', 'duration': 2},
+    
+    {'name': 'Аттестат о среднем образовании', 'category': 'EDU', 'duration': 30},
+    {'name': 'Академическая справка', 'category': 'EDU', 'duration': 15},
+    {'name': 'Справка об обучении', 'category': 'EDU', 'duration': 5},
+    
+    {'name': 'Консультация юриста', 'category': 'OTHER', 'duration': 1},
+    {'name': 'Нотариальное заверение', 'category': 'OTHER', 'duration': 1},
+    {'name': 'Перевод документов', 'category': 'OTHER', 'duration': 3},
+]
@@ -0,0 +1,252 @@
+import random
+import time as clock
+from bisect import bisect
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .booking import rebuild_slots, slot_times
+from .cache import bump_catalogue_version
+from .counters import refresh_branch_counters, refresh_service_counters
+from .daily_stats import rebuild_daily_stats
+from .fixtures import TEST_SERVICES
+from .models import Appointment, Branch, BranchService, Employee, Service, UserProfile
+from .search import rebuild_index
+
+STREETS = [
+    'Тверская', 'Ленина', 'Мира', 'Садовая', 'Советская', 'Гагарина', 'Пушкина',
+    'Лесная', 'Центральная', 'Новая', 'Молодежная', 'Школьная', 'Набережная',
+]
+CITIES = ['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Самара', 'Томск']
+LAST_NAMES = ['Иванов', 'Петров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов']
+FIRST_NAMES = ['Анна', 'Мария', 'Елена', 'Ольга', 'Иван', 'Петр', 'Сергей', 'Алексей', 'Дмитрий']
+
+# запись по часам: утренний и послеобеденный пик
+HOUR_WEIGHTS = {9: 4, 10: 9, 11: 10, 12: 7, 13: 3, 14: 5, 15: 7, 16: 9, 17: 6, 18: 1}
+
+
+def zipf_weights(count, exponent=1.1):
+    # немногие популярные отделения и услуги получают большую часть записей
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+class WeightedChoice:
+    def __init__(self, items, weights):
+        self.items = list(items)
+        self.cumulative = list(accumulate(weights))
+
+    def pick(self, rng):
+        return self.items[bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+class LoadDataGenerator:
+    # детерминированный по seed генератор больших наборов данных, пишет пачками
+    # через bulk_create в отдельных транзакциях на каждую пачку
+
+    def __init__(self, seed=42, batch_size=5000, prefix='load', progress=None):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.progress = progress or (lambda message: None)
+
+    def exists(self):
+        return Branch.objects.filter(email__startswith=f'{self.prefix}-').exists()
+
+    def write(self, model, objects, total, label):
+        started = clock.monotonic()
+        batch = []
+        done = 0
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == self.batch_size:
+                done += self.flush(model, batch)
+                batch = []
+                rate = done / max(clock.monotonic() - started, 1e-6)
+                self.progress(f'{label}: {done}/{total} ({rate:.0f} строк/с)')
+        done += self.flush(model, batch)
+        self.progress(f'{label}: {done}/{total} готово за {clock.monotonic() - started:.1f} с')
+
+    def flush(self, model, batch):
+        if not batch:
+            return 0
+        with transaction.atomic():
+            model.objects.bulk_create(batch, batch_size=self.batch_size)
+        return len(batch)
+
+    def ids(self, queryset):
+        return list(queryset.order_by('pk').values_list('pk', flat=True))
+
+    # ---------- отдельные таблицы ----------
+
+    def branches(self, count):
+        prefix = self.prefix
+        rng = self.rng
+
+        def build():
+            for i in range(count):
+                city = rng.choice(CITIES)
+                yield Branch(
+                    name=f'МФЦ {city} №{i + 1}',
+                    address=f'г. {city}, ул. {rng.choice(STREETS)}, д. {rng.randint(1, 150)}',
+                    phone=f'8{rng.randint(900, 999)}{rng.randint(1000000, 9999999)}',
+                    email=f'{prefix}-office{i + 1}@mfc.ru',
+                    work_schedule='Пн-Пт 9:00-18:00, Сб 10:00-15:00',
+                    is_active=rng.random() > 0.05,
+                )
+
+        self.write(Branch, build(), count, 'Отделения')
+        return self.ids(Branch.objects.filter(email__startswith=f'{prefix}-'))
+
+    def services(self, count):
+        prefix = self.prefix
+        rng = self.rng
+
+        def build():
+            for i in range(count):
+                base = TEST_SERVICES[i % len(TEST_SERVICES)]
+                variant = i // len(TEST_SERVICES)
+                name = base['name'] if not variant else f"{base['name']} (вариант {variant + 1})"
+                yield Service(
+                    name=f'{name} [{prefix}]',
+                    category=base['category'],
+                    duration_days=max(1, base['duration'] + rng.randint(-2, 5)),
+                )
+
+        self.write(Service, build(), count, 'Услуги')
+        return self.ids(Service.objects.filter(name__endswith=f'[{prefix}]'))
+
+    def branch_services(self, branch_ids, service_ids):
+        rng = self.rng
+        offered = {}
+
+        def build():
+            for branch_id in branch_ids:
+                share = rng.uniform(0.3, 0.8)
+                chosen = [service_id for service_id in service_ids if rng.random() < share] or service_ids[:1]
+                offered[branch_id] = chosen
+                for service_id in chosen:
+                    yield BranchService(
+                        branch_id=branch_id, service_id=service_id, is_available=rng.random() > 0.1
+                    )
+
+        self.write(BranchService, build(), '~', 'Услуги в отделениях')
+        return offered
+
+    def users(self, count):
+        prefix = self.prefix
+        rng = self.rng
+        password = make_password(None)
+
+        def build_users():
+            for i in range(count):
+                yield User(username=f'{prefix}-user{i + 1}', password=password)
+
+        self.write(User, build_users(), count, 'Пользователи')
+        user_ids = self.ids(User.objects.filter(username__startswith=f'{prefix}-user'))
+
+        def build_profiles():
+            for i, user_id in enumerate(user_ids):
+                yield UserProfile(
+                    user_id=user_id,
+                    full_name=f'{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}',
+                    email=f'{prefix}-client{i + 1}@example.com',
+                    phone=f'8{rng.randint(900, 999)}{rng.randint(1000000, 9999999)}',
+                )
+
+        self.write(UserProfile, build_profiles(), count, 'Профили')
+        return self.ids(UserProfile.objects.filter(email__startswith=f'{prefix}-client'))
+
+    def employees(self, profile_ids, branch_ids, per_branch):
+        rng = self.rng
+        count = min(len(profile_ids), per_branch * len(branch_ids))
+        staff_ids = profile_ids[-count:] if count else []
+        if staff_ids:
+            # id отсортированы, поэтому сотрудники — это хвост диапазона профилей
+            UserProfile.objects.filter(
+                pk__gte=staff_ids[0], email__startswith=f'{self.prefix}-client'
+            ).update(role='employee')
+        positions = ['specialist', 'specialist', 'consultant', 'admin']
+
+        def build():
+            for i, profile_id in enumerate(staff_ids):
+                yield Employee(
+                    user_profile_id=profile_id,
+                    office_id=branch_ids[i % len(branch_ids)],
+                    position=rng.choice(positions),
+                )
+
+        self.write(Employee, build(), count, 'Сотрудники')
+        return profile_ids[:len(profile_ids) - count]
+
+    def appointments(self, count, client_ids, offered, days_back, days_ahead):
+        rng = self.rng
+        today = timezone.localdate()
+        branch_ids = [branch_id for branch_id, services in offered.items() if services]
+        rng.shuffle(branch_ids)
+        branches = WeightedChoice(branch_ids, zipf_weights(len(branch_ids)))
+        services = {
+            branch_id: WeightedChoice(service_ids, zipf_weights(len(service_ids), 0.8))
+            for branch_id, service_ids in offered.items() if service_ids
+        }
+        times = [value for value in slot_times() if value.hour in HOUR_WEIGHTS]
+        hours = WeightedChoice(times, [HOUR_WEIGHTS[value.hour] for value in times])
+        past_statuses = WeightedChoice(
+            [Appointment.Status.COMPLETED, Appointment.Status.CANCELLED, Appointment.Status.NO_SHOW],
+            [75, 12, 13],
+        )
+        future_statuses = WeightedChoice(
+            [Appointment.Status.PENDING, Appointment.Status.CONFIRMED, Appointment.Status.CANCELLED],
+            [55, 35, 10],
+        )
+
+        # в воскресенье отделения закрыты; дни берутся только рабочие и только из
+        # возвращаемого диапазона, по которому потом пересчитываются слоты и статистика
+        days = [today + timedelta(days=offset) for offset in range(-days_back, days_ahead + 1)]
+        days = [day for day in days if day.weekday() != 6] or days
+
+        def build():
+            for _ in range(count):
+                branch_id = branches.pick(rng)
+                day = rng.choice(days)
+                statuses = past_statuses if day < today else future_statuses
+                yield Appointment(
+                    user_profile_id=rng.choice(client_ids),
+                    service_id=services[branch_id].pick(rng),
+                    branch_id=branch_id,
+                    date=day,
+                    time=hours.pick(rng),
+                    status=statuses.pick(rng),
+                )
+
+        self.write(Appointment, build(), count, 'Записи на прием')
+        return today - timedelta(days=days_back), today + timedelta(days=days_ahead)
+
+    # ---------- все вместе ----------
+
+    def generate(self, branches, services, users, employees_per_branch, appointments,
+                 days_back=90, days_ahead=30, derived=True):
+        branch_ids = self.branches(branches)
+        service_ids = self.services(services)
+        offered = self.branch_services(branch_ids, service_ids)
+        profile_ids = self.users(users)
+        client_ids = self.employees(profile_ids, branch_ids, employees_per_branch)
+        if appointments and client_ids:
+            date_from, date_to = self.appointments(appointments, client_ids, offered, days_back, days_ahead)
+        if derived:
+            # bulk_create не вызывает сигналы, поэтому производные данные пересчитываем целиком
+            self.progress('Пересчет счетчиков услуг...')
+            refresh_branch_counters()
+            refresh_service_counters()
+            self.progress('Перестроение поискового индекса...')
+            rebuild_index()
+            if appointments and client_ids:
+                self.progress('Пересчет слотов записи...')
+                rebuild_slots(date_from, date_to, branch_ids)
+                self.progress('Пересчет дневной статистики...')
+                rebuild_daily_stats(date_from, date_to, branch_ids)
+            bump_catalogue_version()
+        return branch_ids, service_ids
@@ -0,0 +1,137 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+from simple_history.models import HistoricalRecords
+from simple_history.signals import post_create_historical_record, pre_create_historical_record
+
+_batch = threading.local()
+
+
+def comparable(value):
+    # файл в модели — FieldFile, в исторической таблице — строка с путем
+    if isinstance(value, FieldFile):
+        return value.name or ''
+    return value
+
+
+class HistoryBatch:
+    def __init__(self, depth):
+        self.depth = depth   # уровень вложенности atomic, на котором открыта пачка
+        self.records = []
+        self.latest = {}     # последняя версия объекта в пачке, для diff_only
+
+    def add(self, record):
+        history_instance = record['history_instance']
+        self.latest[(type(history_instance), record['instance'].pk)] = history_instance
+        using = record['using']
+        if len(transaction.get_connection(using).atomic_blocks) > self.depth:
+            # запись из вложенного atomic попадает в пачку при коммите внешней транзакции;
+            # если вложенный блок откатится, Django выбросит и этот callback
+            transaction.on_commit(lambda: self.records.append(record), using=using)
+        else:
+            self.records.append(record)
+
+    def flush(self):
+        if not self.records:
+            return
+        # одна вставка на каждую историческую таблицу
+        by_model = {}
+        for record in self.records:
+            by_model.setdefault(type(record['history_instance']), []).append(record['history_instance'])
+        for model, history_instances in by_model.items():
+            model.objects.bulk_create(history_instances)
+        for record in self.records:
+            post_create_historical_record.send(sender=type(record['history_instance']), **record)
+        self.records = []
+        self.latest = {}
+
+
+def current_batch():
+    return getattr(_batch, 'current', None)
+
+
+@contextmanager
+def history_batch(using=None):
+    # копит исторические записи и пишет их одним bulk_create: вне транзакции — при
+    # выходе, внутри transaction.atomic() — после коммита внешней транзакции, так что
+    # откат (в том числе вложенного блока) не оставляет лишних версий
+    if getattr(_batch, 'current', None) is not None:
+        yield _batch.current
+        return
+    connection = transaction.get_connection(using)
+    batch = HistoryBatch(len(connection.atomic_blocks))
+    _batch.current = batch
+    try:
+        yield batch
+    finally:
+        _batch.current = None
+        # вне atomic on_commit выполняет flush сразу
+        transaction.on_commit(batch.flush, using=using)
+
+
+class BufferedHistoricalRecords(HistoricalRecords):
+    # HistoricalRecords, который умеет писать пачкой (history_batch) и
+    # пропускать сохранения без изменений (diff_only)
+
+    def __init__(self, *args, diff_only=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.diff_only = diff_only
+
+    def is_diff_only(self):
+        if self.diff_only is not None:
+            return self.diff_only
+        return getattr(settings, 'MFC_HISTORY_DIFF_ONLY', False)
+
+    def compared_fields(self, instance):
+        # updated_at меняется при каждом save, по нему изменения не считаем
+        return [
+            field.attname for field in self.fields_included(instance)
+            if not getattr(field, 'auto_now', False)
+        ]
+
+    def has_changes(self, instance, batch):
+        fields = self.compared_fields(instance)
+        manager = getattr(instance, self.manager_name)
+        previous = batch.latest.get((manager.model, instance.pk)) if batch else None
+        if previous is not None:
+            old = {name: getattr(previous, name) for name in fields}
+        else:
+            old = manager.values(*fields).first()
+            if old is None:
+                return True
+        return any(comparable(getattr(instance, name)) != comparable(old[name]) for name in fields)
+
+    def create_historical_record(self, instance, history_type, using=None):
+        using = using if self.use_base_model_db else None
+        batch = current_batch()
+        if history_type == '~' and self.is_diff_only() and not self.has_changes(instance, batch):
+            return
+        if batch is None:
+            return super().create_historical_record(instance, history_type, using=using)
+
+        history_date = getattr(instance, '_history_date', timezone.now())
+        history_user = self.get_history_user(instance)
+        history_change_reason = self.get_change_reason_for_object(instance, history_type, using)
+        manager = getattr(instance, self.manager_name)
+        attrs = {field.attname: getattr(instance, field.attname) for field in self.fields_included(instance)}
+        history_instance = manager.model(
+            history_date=history_date,
+            history_type=history_type,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            **attrs,
+        )
+        record = {
+            'instance': instance,
+            'history_instance': history_instance,
+            'history_date': history_date,
+            'history_user': history_user,
+            'history_change_reason': history_change_reason,
+            'using': using,
+        }
+        pre_create_historical_record.send(sender=manager.model, **record)
+        batch.add(record)
@@ -0,0 +1,140 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# имя -> (размер, обрезать ли до точного размера); thumb — для списка 80x65 с запасом на retina
+VARIANTS = {
+    'thumb': ((160, 130), True),
+    'medium': ((800, 600), False),
+}
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF'}
+MAX_SIDE = 2560  # оригинал после перекодирования не больше этого по длинной стороне
+FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+
+def variant_name(name, variant, extension):
+    # варианты лежат рядом с оригиналом: branches/office.jpg -> branches/office.jpg.thumb.webp;
+    # расширение оригинала остается в имени, иначе office.jpg и office.png делили бы одни копии
+    return f'{name}.{variant}.{extension}'
+
+
+def variant_names(name):
+    return [variant_name(name, variant, extension) for variant in VARIANTS for extension in FORMATS]
+
+
+class PhotoRejected(Exception):
+    pass
+
+
+def get_max_photo_size():
+    return getattr(settings, 'MFC_PHOTO_MAX_SIZE', 5 * 1024 * 1024)
+
+
+def to_rgb(image):
+    # поворот по EXIF применяем к пикселям, сами метаданные дальше не сохраняются
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # прозрачность заливаем белым: JPEG ее не поддерживает
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def resize(image, size, crop):
+    if crop:
+        return ImageOps.fit(image, size, Image.LANCZOS)
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    return image
+
+
+def write_atomic(name, image, file_format, options):
+    # файл появляется под своим именем только целиком
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f'{path}.part'
+    try:
+        with open(partial, 'wb') as output:
+            image.save(output, file_format, **options)
+        os.replace(partial, path)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def generate_variants(name, image=None):
+    if image is None:
+        with default_storage.open(name, 'rb') as original:
+            image = to_rgb(Image.open(original))
+    for variant, (size, crop) in VARIANTS.items():
+        resized = resize(image, size, crop)
+        for extension, (file_format, options) in FORMATS.items():
+            write_atomic(variant_name(name, variant, extension), resized, file_format, options)
+
+
+def delete_variants(name):
+    for variant in variant_names(name):
+        default_storage.delete(variant)
+
+
+def variant_key(variant, extension):
+    return variant if extension == 'jpg' else f'{variant}_{extension}'
+
+
+def variant_urls(photo):
+    # {'thumb': ..., 'thumb_webp': ..., 'medium': ..., 'medium_webp': ...};
+    # пока вариантов нет (старые фото, битый файл), везде отдаем оригинал
+    if not photo:
+        return None
+    ready = default_storage.exists(variant_name(photo.name, 'thumb', 'jpg'))
+    return {
+        variant_key(variant, extension): (
+            default_storage.url(variant_name(photo.name, variant, extension)) if ready else photo.url
+        )
+        for variant in VARIANTS for extension in FORMATS
+    }
+
+
+def read_upload(name):
+    # проверка загруженного файла: размер, формат и что Pillow может его декодировать
+    if default_storage.size(name) > get_max_photo_size():
+        raise PhotoRejected(f'Фото больше {get_max_photo_size() // (1024 * 1024)} МБ')
+    with default_storage.open(name, 'rb') as upload:
+        data = upload.read()
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.format not in ALLOWED_FORMATS:
+            raise PhotoRejected(f'Формат {image.format} не поддерживается')
+        image.load()
+        return to_rgb(image)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise PhotoRejected(f'Файл не является изображением: {e}')
+
+
+def process_upload(name):
+    # перекодирует загрузку в JPEG без метаданных рядом с ней и строит варианты;
+    # возвращает имя нового оригинала, саму загрузку не трогает
+    image = read_upload(name)
+    image.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+    base, _ = os.path.splitext(name)
+    # загрузка еще лежит на месте, поэтому имя всегда получится новым
+    clean_name = default_storage.get_available_name(f'{base}.jpg')
+    file_format, options = FORMATS['jpg']
+    write_atomic(clean_name, image, file_format, dict(options, quality=88))
+    generate_variants(clean_name, image)
+    return clean_name
+
+
+def delete_photo(name):
+    # оригинал вместе с уменьшенными копиями
+    default_storage.delete(name)
+    delete_variants(name)
@@ -0,0 +1,303 @@
+import csv
+import io
+from abc import ABC, abstractmethod
+
+from django.db import transaction
+from openpyxl import load_workbook
+from rest_framework import serializers
+
+from .cache import bump_catalogue_version
+from .counters import refresh_branch_counters, refresh_service_counters
+from .models import Branch, BranchService, Service
+from .search import index_branches, index_services
+from .serializers import BranchSerializer, ServiceSerializer
+
+IMPORT_BATCH_SIZE = 2000
+
+TRUE_VALUES = {'1', 'да', 'yes', 'true', '+'}
+FALSE_VALUES = {'0', 'нет', 'no', 'false', '-'}
+
+
+class RowError(Exception):
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = []  # (номер строки файла, {поле: [сообщения]})
+
+
+def read_table(fileobj, file_format):
+    # строки читаются по одной, файл целиком в память не попадает
+    if file_format == 'csv':
+        rows = csv.reader(io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline=''))
+    else:
+        rows = load_workbook(fileobj, read_only=True).active.iter_rows(values_only=True)
+    header = [str(value or '').strip() for value in next(rows, [])]
+    return header, rows
+
+
+def text(value):
+    return '' if value is None else str(value).strip()
+
+
+def parse_flag(value, default=None):
+    value = text(value).lower()
+    if not value:
+        return default
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise serializers.ValidationError(f'Ожидалось да/нет, получено "{value}"')
+
+
+def run_validation(fields, data, errors, names):
+    # те же правила, что в API: валидаторы полей сериализатора без запросов к базе
+    cleaned = {}
+    for name in names:
+        try:
+            cleaned[name] = fields[name].run_validation(text(data.get(name)))
+        except serializers.ValidationError as e:
+            errors[name] = e.detail
+    return cleaned
+
+
+class ModelImporter(ABC):
+    model = None
+    key = None
+    update_fields = []
+
+    def __init__(self, user=None):
+        self.user = user
+
+    def start(self, header, result):
+        self.header = [name.lower() for name in header]
+        # колонки, которых нет в файле, у существующих записей не трогаем
+        self.update_fields = [
+            name for name in self.update_fields if name == 'updated_at' or name in self.header
+        ]
+
+    @abstractmethod
+    def clean(self, values):
+        # строка файла -> несохраненные объекты модели; ошибки — RowError
+        pass
+
+    def row_key(self, obj):
+        return getattr(obj, self.key)
+
+    def save(self, objects, result):
+        # повторы ключа внутри пачки: побеждает последняя строка
+        objects = list({self.row_key(obj): obj for obj in objects}.values())
+        keys = [self.row_key(obj) for obj in objects]
+        lookup = {f'{self.key}__in': keys}
+        existing = set(self.model.objects.filter(**lookup).values_list(self.key, flat=True))
+        self.model.objects.bulk_create(
+            objects,
+            update_conflicts=True,
+            unique_fields=[self.key],
+            update_fields=self.update_fields,
+        )
+        # bulk_create с update_conflicts не возвращает id на SQLite, перечитываем
+        saved = list(self.model.objects.filter(**lookup))
+        created = [obj for obj in saved if self.row_key(obj) not in existing]
+        updated = [obj for obj in saved if self.row_key(obj) in existing]
+        self.model.history.bulk_history_create(created, default_user=self.user)
+        self.model.history.bulk_history_create(updated, update=True, default_user=self.user)
+        # bulk_create не вызывает сигналы: индекс поиска обновляем пачкой
+        self.reindex([obj.pk for obj in saved])
+        result.created += len(created)
+        result.updated += len(updated)
+
+    def reindex(self, ids):
+        pass
+
+    def finish(self):
+        bump_catalogue_version()
+
+
+class BranchImporter(ModelImporter):
+    model = Branch
+    key = 'email'
+    update_fields = ['name', 'address', 'phone', 'work_schedule', 'is_active', 'updated_at']
+
+    def __init__(self, user=None):
+        super().__init__(user)
+        self.serializer = BranchSerializer()
+
+    def clean(self, values):
+        data = dict(zip(self.header, values))
+        errors = {}
+        cleaned = run_validation(
+            self.serializer.fields, data, errors, ['name', 'address', 'phone', 'email', 'work_schedule']
+        )
+        if 'work_schedule' in cleaned:
+            try:
+                self.serializer.validate_work_schedule(cleaned['work_schedule'])
+            except serializers.ValidationError as e:
+                errors['work_schedule'] = e.detail
+        try:
+            cleaned['is_active'] = parse_flag(data.get('is_active'), default=True)
+        except serializers.ValidationError as e:
+            errors['is_active'] = e.detail
+        if errors:
+            raise RowError(errors)
+        return [Branch(**cleaned)]
+
+    def reindex(self, ids):
+        index_branches(ids)
+
+
+class ServiceImporter(ModelImporter):
+    model = Service
+    key = 'name'
+    update_fields = ['category', 'duration_days', 'updated_at']
+
+    def __init__(self, user=None):
+        super().__init__(user)
+        self.serializer = ServiceSerializer()
+        # категорию можно указать кодом (DOC) или названием
+        self.categories = {label.lower(): value for value, label in Service.Category.choices}
+        self.categories.update({value.lower(): value for value in Service.Category.values})
+        self.branch_ids = set()
+
+    def clean(self, values):
+        data = dict(zip(self.header, values))
+        errors = {}
+        cleaned = run_validation(self.serializer.fields, data, errors, ['name', 'duration_days'])
+        category = text(data.get('category')).lower()
+        if category:
+            if category in self.categories:
+                cleaned['category'] = self.categories[category]
+            else:
+                errors['category'] = [f'Неизвестная категория "{category}"']
+        if errors:
+            raise RowError(errors)
+        return [Service(**cleaned)]
+
+    def reindex(self, ids):
+        index_services(ids)
+        self.branch_ids.update(
+            BranchService.objects.filter(service_id__in=ids).values_list('branch_id', flat=True)
+        )
+
+    def finish(self):
+        # срок услуги входит в средний срок отделений
+        refresh_branch_counters(self.branch_ids)
+        super().finish()
+
+
+class AvailabilityImporter(ModelImporter):
+    # матрица: первая колонка — email отделения, остальные — названия услуг,
+    # в ячейках да/нет; пустая ячейка оставляет связь как есть
+    model = BranchService
+    update_fields = ['is_available', 'updated_at']
+
+    def __init__(self, user=None):
+        super().__init__(user)
+        self.branch_ids = set()
+        self.service_ids = set()
+
+    def start(self, header, result):
+        # отделений немного, поэтому email -> id загружаем один раз на весь импорт
+        self.branches = dict(Branch.objects.values_list('email', 'pk'))
+        names = header[1:]
+        services = dict(Service.objects.filter(name__in=names).values_list('name', 'pk'))
+        missing = [name for name in names if name not in services]
+        if missing:
+            result.errors.append((1, {'service': [f'Услуга "{name}" не найдена' for name in missing]}))
+        self.columns = [services.get(name) for name in names]
+
+    def row_key(self, obj):
+        return obj.branch_id, obj.service_id
+
+    def clean(self, values):
+        values = list(values)
+        email = text(values[0] if values else '')
+        branch_id = self.branches.get(email)
+        if branch_id is None:
+            raise RowError({'branch': [f'Отделение с email "{email}" не найдено']})
+        links = []
+        errors = {}
+        for service_id, value in zip(self.columns, values[1:]):
+            if service_id is None:
+                continue
+            try:
+                is_available = parse_flag(value)
+            except serializers.ValidationError as e:
+                errors[str(service_id)] = e.detail
+                continue
+            if is_available is not None:
+                links.append(BranchService(branch_id=branch_id, service_id=service_id, is_available=is_available))
+        if errors:
+            raise RowError(errors)
+        return links
+
+    def save(self, objects, result):
+        objects = list({self.row_key(obj): obj for obj in objects}.values())
+        branch_ids = {obj.branch_id for obj in objects}
+        existing = set(
+            BranchService.objects.filter(branch_id__in=branch_ids).values_list('branch_id', 'service_id')
+        )
+        BranchService.objects.bulk_create(
+            objects,
+            update_conflicts=True,
+            unique_fields=['branch', 'service'],
+            update_fields=self.update_fields,
+        )
+        created = sum(1 for obj in objects if self.row_key(obj) not in existing)
+        result.created += created
+        result.updated += len(objects) - created
+        self.branch_ids.update(branch_ids)
+        self.service_ids.update(obj.service_id for obj in objects)
+
+    def finish(self):
+        refresh_branch_counters(self.branch_ids)
+        refresh_service_counters(self.service_ids)
+        index_branches(self.branch_ids)
+        super().finish()
+
+
+IMPORTERS = {
+    'branches': BranchImporter,
+    'services': ServiceImporter,
+    'availability': AvailabilityImporter,
+}
+
+
+def run_import(kind, fileobj, file_format='csv', batch_size=IMPORT_BATCH_SIZE, dry_run=False,
+               user=None, progress=None):
+    progress = progress or (lambda result: None)
+    importer = IMPORTERS[kind](user)
+    result = ImportResult()
+    header, rows = read_table(fileobj, file_format)
+    importer.start(header, result)
+
+    def flush(batch):
+        if batch and not dry_run:
+            # одна транзакция на пачку: ошибка базы откатывает только ее
+            with transaction.atomic():
+                importer.save(batch, result)
+        progress(result)
+
+    batch = []
+    for number, values in enumerate(rows, start=2):
+        if not any(text(value) for value in values):
+            continue
+        result.rows += 1
+        try:
+            batch.extend(importer.clean(values))
+        except RowError as e:
+            result.errors.append((number, e.errors))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    flush(batch)
+    if not dry_run:
+        importer.finish()
+    return result
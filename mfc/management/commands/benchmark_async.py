@@ -0,0 +1,91 @@
+# как использовать:
+#     python manage.py benchmark_async
+#     python manage.py benchmark_async --concurrency 1,50,200 --requests 2000
+#     python manage.py benchmark_async --only api_branches,branch_list --output async.json
+#
+# сравнивает пропускную способность синхронных view и их async-версий (/async/...)
+# под ASGI при одновременных запросах; запросы идут прямо в ASGIHandler, как их
+# передает uvicorn, поэтому цифры без учета сети и разбора HTTP.
+# данные создаются во временной тестовой базе, рабочая база не затрагивается
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from mfc.benchmarks import ASYNC_ENDPOINTS, build_report, run_async_benchmarks, save_report
+from mfc.generators import LoadDataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность синхронных и async view под ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branches', type=int, default=200, help='Отделений (по умолчанию: 200)')
+        parser.add_argument('--services', type=int, default=60, help='Услуг (по умолчанию: 60)')
+        parser.add_argument(
+            '--appointments',
+            type=int,
+            default=5000,
+            help='Записей на прием (по умолчанию: 5000)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=str,
+            default='1,50,200',
+            help='Одновременных запросов через запятую (по умолчанию: 1,50,200)'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Запросов на каждую точку и уровень (по умолчанию: 500)'
+        )
+        parser.add_argument('--only', type=str, help='Имена точек через запятую')
+        parser.add_argument('--output', type=str, help='Куда сохранить результат в JSON')
+
+    def handle(self, **options):
+        only = set(options['only'].split(',')) if options['only'] else None
+        if only:
+            unknown = only - {endpoint.name for endpoint in ASYNC_ENDPOINTS}
+            if unknown:
+                raise CommandError(f'Неизвестные точки: {", ".join(sorted(unknown))}')
+        concurrency_levels = [int(value) for value in options['concurrency'].split(',')]
+
+        dataset = {
+            'branches': options['branches'],
+            'services': options['services'],
+            'appointments': options['appointments'],
+        }
+        # как в production: без отладки и без синхронного тулбара в цепочке middleware
+        middleware = [name for name in settings.MIDDLEWARE if not name.startswith('debug_toolbar.')]
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write('Генерация данных...')
+            LoadDataGenerator(seed=42, batch_size=5000).generate(
+                branches=options['branches'],
+                services=options['services'],
+                users=1000,
+                employees_per_branch=2,
+                appointments=options['appointments'],
+            )
+            # журнал медленных запросов выключен: под нагрузкой в него попадает почти
+            # все, и замер превращается в замер записи журнала
+            with override_settings(
+                ALLOWED_HOSTS=['testserver'], DEBUG=False, MIDDLEWARE=middleware, MFC_SLOW_QUERY_MS=None
+            ):
+                results = run_async_benchmarks(
+                    ASGIHandler(),
+                    concurrency_levels,
+                    options['requests'],
+                    only=only,
+                    progress=self.stdout.write,
+                )
+            report = build_report(results, dataset)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            save_report(report, options['output'])
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
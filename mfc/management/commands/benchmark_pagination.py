@@ -0,0 +1,107 @@
+# как использовать:
+#     python manage.py benchmark_pagination
+#     python manage.py benchmark_pagination --rows 200000 --pages 1,1000,10000 --repeat 20
+#
+# данные создаются во временной тестовой базе, рабочая база не затрагивается
+
+import statistics
+import time
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.pagination import Cursor
+from rest_framework.settings import api_settings
+
+from mfc.models import Branch
+from mfc.pagination import CompositeKeysetPagination
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время ответа /api/branches/ для номеров страниц и курсора'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=100000,
+            help='Сколько отделений создать (по умолчанию: 100000)'
+        )
+
+        parser.add_argument(
+            '--pages',
+            type=str,
+            default='1,100,10000',
+            help='Номера страниц через запятую (по умолчанию: 1,100,10000)'
+        )
+
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=10,
+            help='Сколько раз запрашивать каждую страницу (по умолчанию: 10)'
+        )
+
+    def handle(self, **options):
+        rows = options['rows']
+        pages = [int(page) for page in options['pages'].split(',')]
+        page_size = api_settings.PAGE_SIZE
+        if max(pages) * page_size > rows:
+            raise CommandError(f'Для страницы {max(pages)} нужно минимум {max(pages) * page_size} строк')
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.fill(rows)
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                self.run(pages, page_size, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def fill(self, rows):
+        self.stdout.write(f'Создание {rows} отделений...')
+        batch = []
+        for i in range(rows):
+            batch.append(Branch(
+                name=f'Отделение {i // 3:07d}',  # по три одинаковых названия подряд
+                address=f'г. Москва, ул. Тестовая, д. {i}',
+                phone='+7 (495) 123-45-67',
+                email=f'office{i}@mfc.ru',
+                work_schedule='Пн-Пт 9:00-18:00',
+            ))
+            if len(batch) == 5000:
+                Branch.objects.bulk_create(batch)
+                batch = []
+        Branch.objects.bulk_create(batch)
+
+    def cursor_for_page(self, page, page_size):
+        # курсор на начало страницы, как если бы клиент дошел до нее по ссылкам next
+        if page == 1:
+            return {}
+        branch = Branch.objects.order_by('name', 'id')[(page - 1) * page_size - 1]
+        paginator = CompositeKeysetPagination()
+        paginator.base_url = 'http://testserver/api/branches/'
+        position = paginator._get_position_from_instance(branch, ('name', 'id'))
+        url = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+        return {'cursor': parse_qs(urlparse(url).query)['cursor'][0]}
+
+    def measure(self, client, params, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get('/api/branches/', params)
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'Ответ {response.status_code} для {params}')
+        return statistics.median(timings)
+
+    def run(self, pages, page_size, repeat):
+        client = Client()
+        self.stdout.write('')
+        self.stdout.write(f'{"страница":>10} {"номера, мс":>12} {"курсор, мс":>12}')
+        for page in pages:
+            by_number = self.measure(client, {'page': page}, repeat)
+            params = {'pagination': 'cursor', **self.cursor_for_page(page, page_size)}
+            by_cursor = self.measure(client, params, repeat)
+            self.stdout.write(f'{page:>10} {by_number:>12.2f} {by_cursor:>12.2f}')
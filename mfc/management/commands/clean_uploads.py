@@ -0,0 +1,29 @@
+# как использовать:
+#     python manage.py clean_uploads
+#     python manage.py clean_uploads --hours 6
+#
+# отменяет загрузки частями, к которым давно не приходили новые части,
+# и удаляет их недокачанные файлы из MEDIA_ROOT/uploads/; заодно разбирает
+# импорты, брошенные при перезапуске процесса
+
+from django.core.management.base import BaseCommand
+
+from mfc.uploads import delete_stale_uploads, get_expire_hours, run_due_imports
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные загрузки частями'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=float,
+            default=None,
+            help=f'Сколько часов ждать новых частей (по умолчанию: {get_expire_hours()})'
+        )
+
+    def handle(self, **options):
+        removed = delete_stale_uploads(options['hours'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено загрузок: {removed}'))
+        failed, done = run_due_imports()
+        self.stdout.write(self.style.SUCCESS(f'Импортов прервано: {failed}, выполнено: {done}'))
@@ -0,0 +1,92 @@
+# как использовать:
+#     python manage.py compact_history
+#     python manage.py compact_history --days 90 --models appointment --dry-run
+#     python manage.py compact_history --every 24        # по расписанию, раз в сутки
+#     python manage.py compact_history --restore appointment:42
+#
+# у каждого объекта остаются первая и последняя версии, у записей на прием еще и
+# все смены статуса; остальные версии старше --days уходят в gzip архив
+# (MFC_HISTORY_ARCHIVE_DIR) и удаляются из таблиц истории
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from mfc.retention import ARCHIVE_BATCH_SIZE, HISTORY_MODELS, compact_history, restore_history
+
+
+class Command(BaseCommand):
+    help = 'Сжимает старую историю изменений в архив и восстанавливает ее по запросу'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'MFC_HISTORY_RETENTION_DAYS', 365),
+            help='Сжимать версии старше стольких дней (по умолчанию: MFC_HISTORY_RETENTION_DAYS)'
+        )
+        parser.add_argument(
+            '--models',
+            type=str,
+            default=','.join(HISTORY_MODELS),
+            help=f'Модели через запятую (по умолчанию: {",".join(HISTORY_MODELS)})'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=ARCHIVE_BATCH_SIZE,
+            help=f'Строк в одной пачке удаления (по умолчанию: {ARCHIVE_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать, что будет архивировано'
+        )
+        parser.add_argument(
+            '--every',
+            type=float,
+            help='Повторять каждые N часов, пока команду не остановят'
+        )
+        parser.add_argument(
+            '--restore',
+            type=str,
+            help='Восстановить историю одного объекта из архива, например appointment:42'
+        )
+
+    def handle(self, **options):
+        if options['restore']:
+            return self.restore(options['restore'])
+
+        names = [name.strip() for name in options['models'].split(',')]
+        unknown = [name for name in names if name not in HISTORY_MODELS]
+        if unknown:
+            raise CommandError(f'Неизвестные модели: {", ".join(unknown)}')
+
+        while True:
+            self.compact(names, options)
+            if not options['every']:
+                break
+            self.stdout.write(f'Следующий запуск через {options["every"]} ч')
+            time.sleep(options['every'] * 3600)
+            close_old_connections()
+
+    def compact(self, names, options):
+        for name in names:
+            started = time.monotonic()
+            result = compact_history(name, options['days'], options['batch_size'], options['dry_run'])
+            message = (
+                f'{name}: оставлено {result.kept}, в архив {result.archived} '
+                f'({time.monotonic() - started:.1f} с)'
+            )
+            if result.path:
+                message += f' -> {result.path}'
+            self.stdout.write(self.style.SUCCESS(message))
+
+    def restore(self, target):
+        name, _, object_id = target.partition(':')
+        if name not in HISTORY_MODELS or not object_id.isdigit():
+            raise CommandError('Укажите объект в виде модель:id, например appointment:42')
+        restored = restore_history(name, int(object_id))
+        self.stdout.write(self.style.SUCCESS(f'Восстановлено версий: {restored}'))
@@ -0,0 +1,70 @@
+# как использовать:
+#     python manage.py generate_load_data
+#     python manage.py generate_load_data --branches 2000 --users 500000 --appointments 5000000
+#     python manage.py generate_load_data --seed 7 --prefix bench --batch-size 10000
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mfc.generators import LoadDataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Создает большой воспроизводимый набор данных для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branches', type=int, default=500, help='Отделений (по умолчанию: 500)')
+        parser.add_argument('--services', type=int, default=120, help='Услуг (по умолчанию: 120)')
+        parser.add_argument('--users', type=int, default=50000, help='Пользователей (по умолчанию: 50000)')
+        parser.add_argument(
+            '--employees-per-branch',
+            type=int,
+            default=5,
+            help='Сотрудников на отделение (по умолчанию: 5)'
+        )
+        parser.add_argument(
+            '--appointments',
+            type=int,
+            default=1000000,
+            help='Записей на прием (по умолчанию: 1000000)'
+        )
+        parser.add_argument('--days-back', type=int, default=90, help='Дней истории записей (по умолчанию: 90)')
+        parser.add_argument('--days-ahead', type=int, default=30, help='Дней будущих записей (по умолчанию: 30)')
+        parser.add_argument('--seed', type=int, default=42, help='Seed генератора (по умолчанию: 42)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер пачки (по умолчанию: 5000)')
+        parser.add_argument(
+            '--prefix',
+            type=str,
+            default='load',
+            help='Префикс email и логинов, чтобы отличать сгенерированные данные (по умолчанию: load)'
+        )
+        parser.add_argument(
+            '--skip-derived',
+            action='store_true',
+            help='Не пересчитывать счетчики, поисковый индекс и слоты после генерации'
+        )
+
+    def handle(self, **options):
+        generator = LoadDataGenerator(
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            prefix=options['prefix'],
+            progress=self.stdout.write,
+        )
+        if generator.exists():
+            raise CommandError(
+                f'Данные с префиксом "{options["prefix"]}" уже есть, укажите другой --prefix'
+            )
+
+        self.stdout.write('Генерация данных МФЦ')
+        self.stdout.write('=' * 50)
+        generator.generate(
+            branches=options['branches'],
+            services=options['services'],
+            users=options['users'],
+            employees_per_branch=options['employees_per_branch'],
+            appointments=options['appointments'],
+            days_back=options['days_back'],
+            days_ahead=options['days_ahead'],
+            derived=not options['skip_derived'],
+        )
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -4,8 +4,10 @@
 #     python manage.py generate_test_services --categories DOC,TRANS,SOC
 
 from django.core.management.base import BaseCommand
+from mfc.fixtures import TEST_SERVICES
 from mfc.models import Service
 
+
 class Command(BaseCommand):
     help = 'Создает тестовые услуги для системы МФЦ'
     
@@ -29,42 +31,9 @@ class Command(BaseCommand):
         categories_str = options['categories']
         categories = [c.strip() for c in categories_str.split(',')]
     
-        test_services = [
-            {'name': 'Загранпаспорт', 'category': 'DOC', 'duration': 30},
-            {'name': 'Свидетельство о рождении', 'category': 'DOC', 'duration': 7},
-            {'name': 'Справка о несудимости', 'category': 'DOC', 'duration': 10},
-            
-            {'name': 'Водительское удостоверение', 'category': 'TRANS', 'duration': 15},
-            {'name': 'Регистрация транспортного средства', 'category': 'TRANS', 'duration': 5},
-            {'name': 'Международные права', 'category': 'TRANS', 'duration': 20},
-            
-            {'name': 'Пенсионное удостоверение', 'category': 'SOC', 'duration': 7},
-            {'name': 'Социальная карта', 'category': 'SOC', 'duration': 21},
-            {'name': 'Пособие по безработице', 'category': 'SOC', 'duration': 10},
-            
-            {'name': 'Свидетельство о собственности', 'category': 'PROP', 'duration': 30},
-            {'name': 'Дарственная на квартиру', 'category': 'PROP', 'duration': 45},
-            {'name': 'Ипотечная регистрация', 'category': 'PROP', 'duration': 20},
-
-            {'name': 'Регистрация ИП', 'category': 'BUS', 'duration': 5},
-            {'name': 'Открытие расчетного счета', 'category': 'BUS', 'duration': 3},
-            {'name': 'Лицензия на торговлю', 'category': 'BUS', 'duration': 30},
-
-            {'name': 'Медицинская справка', 'category': 'HLTH', 'duration': 1},
-            {'name': 'Больничный лист', 'category': 'HLTH', 'duration': 3},
-            {'name': 'Справка для бассейна', 'category': 'HLTH', 'duration': 2},
-            
-            {'name': 'Аттестат о среднем образовании', 'category': 'EDU', 'duration': 30},
-            {'name': 'Академическая справка', 'category': 'EDU', 'duration': 15},
-            {'name': 'Справка об обучении', 'category': 'EDU', 'duration': 5},
-            
-            {'name': 'Консультация юриста', 'category': 'OTHER', 'duration': 1},
-            {'name': 'Нотариальное заверение', 'category': 'OTHER', 'duration': 1},
-            {'name': 'Перевод документов', 'category': 'OTHER', 'duration': 3},
-        ]
         
         # фильтруем услуги по выбранным категориям
-        filtered_services = [s for s in test_services if s['category'] in categories]
+        filtered_services = [s for s in TEST_SERVICES if s['category'] in categories]
         
         if not filtered_services:
             self.stdout.write(self.style.ERROR('Нет услуг для выбранных категорий'))
@@ -0,0 +1,76 @@
+# как использовать:
+#     python manage.py import_data branches branches.csv
+#     python manage.py import_data services services.xlsx --batch-size 5000
+#     python manage.py import_data availability matrix.csv --dry-run
+#
+# branches: name, address, phone, email, work_schedule, is_active (ключ — email)
+# services: name, category, duration_days (ключ — name)
+# availability: первая колонка — email отделения, остальные — названия услуг, в ячейках да/нет
+
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mfc.imports import IMPORT_BATCH_SIZE, IMPORTERS, run_import
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт отделений, услуг и доступности услуг из CSV или XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help='Что импортировать')
+        parser.add_argument('path', help='Путь к файлу .csv или .xlsx')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help=f'Строк в одной транзакции (по умолчанию: {IMPORT_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только проверить файл, ничего не записывая'
+        )
+        parser.add_argument(
+            '--max-errors',
+            type=int,
+            default=20,
+            help='Сколько ошибок показать (по умолчанию: 20)'
+        )
+
+    def handle(self, **options):
+        path = options['path']
+        file_format = os.path.splitext(path)[1].lower().lstrip('.')
+        if file_format not in ('csv', 'xlsx'):
+            raise CommandError('Поддерживаются только файлы .csv и .xlsx')
+        if not os.path.exists(path):
+            raise CommandError(f'Файл {path} не найден')
+
+        started = time.monotonic()
+        with open(path, 'rb') as source:
+            result = run_import(
+                options['kind'],
+                source,
+                file_format,
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+                progress=lambda result: self.stdout.write(
+                    f'Обработано строк: {result.rows}', ending='\r'
+                ),
+            )
+        self.stdout.write('')
+
+        for number, errors in result.errors[:options['max_errors']]:
+            for field, messages in errors.items():
+                self.stdout.write(self.style.WARNING(f'Строка {number}, {field}: {"; ".join(map(str, messages))}'))
+        if len(result.errors) > options['max_errors']:
+            self.stdout.write(f'... и еще {len(result.errors) - options["max_errors"]} строк с ошибками')
+
+        summary = (
+            f'Строк: {result.rows}, создано: {result.created}, обновлено: {result.updated}, '
+            f'с ошибками: {len(result.errors)} ({time.monotonic() - started:.1f} с)'
+        )
+        if options['dry_run']:
+            summary = f'Проверка без записи. {summary}'
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,33 @@
+# как использовать:
+#     python manage.py process_export_jobs
+#     python manage.py process_export_jobs --every 300    # по расписанию, раз в 5 минут
+#
+# разбирает выгрузки, брошенные при перезапуске процесса: прерванные помечает
+# ошибкой, а те, что так и не начались, выполняет сама
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from mfc.export_jobs import run_due_jobs
+
+
+class Command(BaseCommand):
+    help = 'Завершает брошенные фоновые выгрузки'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every',
+            type=float,
+            help='Повторять каждые N секунд, пока команду не остановят'
+        )
+
+    def handle(self, **options):
+        while True:
+            failed, done = run_due_jobs()
+            self.stdout.write(self.style.SUCCESS(f'Прервано: {failed}, выполнено: {done}'))
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+            close_old_connections()
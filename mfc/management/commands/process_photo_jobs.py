@@ -0,0 +1,33 @@
+# как использовать:
+#     python manage.py process_photo_jobs
+#     python manage.py process_photo_jobs --every 60     # по расписанию, раз в минуту
+#
+# выполняет задачи обработки фото, которые ждут в очереди: после перезапуска
+# процесса и повторы, таймер которых пропал вместе с процессом
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from mfc.photo_jobs import run_due_jobs
+
+
+class Command(BaseCommand):
+    help = 'Выполняет отложенные задачи обработки фото отделений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every',
+            type=float,
+            help='Повторять каждые N секунд, пока команду не остановят'
+        )
+
+    def handle(self, **options):
+        while True:
+            done = run_due_jobs()
+            self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {done}'))
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+            close_old_connections()
@@ -0,0 +1,55 @@
+# как использовать:
+#     python manage.py rebuild_availability
+#     python manage.py rebuild_availability --days 60 --branch 3
+#     python manage.py rebuild_availability --build-only
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mfc.booking import build_slots, rebuild_slots
+from mfc.models import Branch
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики слотов по записям и строит сетку свободных слотов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='На сколько дней вперед строить слоты (по умолчанию: 30)'
+        )
+
+        parser.add_argument(
+            '--branch',
+            type=int,
+            action='append',
+            help='ID отделения (можно указать несколько раз, по умолчанию: все активные)'
+        )
+
+        parser.add_argument(
+            '--build-only',
+            action='store_true',
+            help='Только достроить недостающие слоты без пересчета по записям'
+        )
+
+    def handle(self, **options):
+        date_from = timezone.localdate()
+        date_to = date_from + timedelta(days=options['days'])
+        branches = Branch.objects.filter(is_active=True)
+        if options['branch']:
+            branches = Branch.objects.filter(pk__in=options['branch'])
+        branch_ids = list(branches.values_list('pk', flat=True))
+
+        if not options['build_only']:
+            fixed = rebuild_slots(date_from, date_to, branch_ids)
+            self.stdout.write(f'Исправлено счетчиков слотов: {fixed}')
+
+        for branch_id in branch_ids:
+            build_slots(branch_id, date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(
+            f'Слоты построены для отделений: {len(branch_ids)}, период {date_from} — {date_to}'
+        ))
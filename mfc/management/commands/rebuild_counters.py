@@ -0,0 +1,33 @@
+# как использовать:
+#     python manage.py rebuild_counters
+#     python manage.py rebuild_counters --check
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mfc.cache import bump_catalogue_version
+from mfc.counters import find_counter_mismatches, refresh_branch_counters, refresh_service_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает и проверяет счетчики услуг у отделений и услуг'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить счетчики, ничего не меняя'
+        )
+
+    def handle(self, **options):
+        if not options['check']:
+            refresh_branch_counters()
+            refresh_service_counters()
+            bump_catalogue_version()
+            self.stdout.write('Счетчики пересчитаны')
+
+        mismatches = find_counter_mismatches()
+        for kind, pk, actual, expected in mismatches[:20]:
+            self.stdout.write(f'{kind} #{pk}: в колонках {actual}, должно быть {expected}')
+        if mismatches:
+            raise CommandError(f'Расхождений в счетчиках: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Счетчики совпадают с данными'))
@@ -0,0 +1,49 @@
+# как использовать:
+#     python manage.py rebuild_daily_stats
+#     python manage.py rebuild_daily_stats --from 2025-01-01 --to 2025-03-31 --branch 3
+#
+# пересчитывает сводку записей по дням (AppointmentDailyStat) по самим записям;
+# нужна один раз после появления сводки и после загрузки записей мимо сигналов
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mfc.daily_stats import rebuild_daily_stats
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Дата "{value}" должна быть в формате ГГГГ-ММ-ДД')
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневную статистику записей по отделениям'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            type=str,
+            help='С какой даты приема (по умолчанию: с самой ранней)'
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            type=str,
+            help='По какую дату приема (по умолчанию: до самой поздней)'
+        )
+        parser.add_argument(
+            '--branch',
+            type=int,
+            action='append',
+            help='ID отделения (можно указать несколько раз, по умолчанию: все)'
+        )
+
+    def handle(self, **options):
+        date_from = parse_date(options['date_from']) if options['date_from'] else None
+        date_to = parse_date(options['date_to']) if options['date_to'] else None
+        rows = rebuild_daily_stats(date_from, date_to, options['branch'])
+        self.stdout.write(self.style.SUCCESS(f'Строк статистики: {rows}'))
@@ -0,0 +1,37 @@
+# как использовать:
+#     python manage.py rebuild_photo_variants
+#     python manage.py rebuild_photo_variants --force
+#
+# строит уменьшенные копии фото отделений (JPEG и WebP) для фото, загруженных
+# до их появления; новые фото получают копии при фоновой обработке (process_photo_jobs)
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from mfc.images import generate_variants, variant_name
+from mfc.models import Branch
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии фото отделений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать копии, даже если они уже есть'
+        )
+
+    def handle(self, **options):
+        built = failed = 0
+        names = Branch.objects.exclude(photo='').exclude(photo__isnull=True).filter(photo_pending=False).values_list('photo', flat=True)
+        for name in names.iterator():
+            if not options['force'] and default_storage.exists(variant_name(name, 'thumb', 'jpg')):
+                continue
+            try:
+                generate_variants(name)
+                built += 1
+            except OSError as e:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f'{name}: {e}'))
+        self.stdout.write(self.style.SUCCESS(f'Построено: {built}, с ошибками: {failed}'))
@@ -0,0 +1,17 @@
+# как использовать:
+#     python manage.py rebuild_search_index
+
+from django.core.management.base import BaseCommand
+
+from mfc.search import is_sqlite, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс отделений и услуг'
+
+    def handle(self, **options):
+        if not is_sqlite():
+            self.stdout.write('Индекс ведет сама база данных, перестраивать нечего')
+            return
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен'))
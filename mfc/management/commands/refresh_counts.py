@@ -0,0 +1,37 @@
+# как использовать:
+#     python manage.py refresh_counts
+#     python manage.py refresh_counts --every 1        # по расписанию, раз в час
+#
+# обновляет статистику базы (ANALYZE) по большим таблицам; по ней админка и
+# ?pagination=approximate показывают приблизительное число строк. Заодно
+# пересчитывает закэшированные COUNT(*) с фильтрами, которые еще используются
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from mfc.counts import APPROXIMATE_COUNT_MODELS, refresh_cached_counts, refresh_statistics, table_estimate
+
+
+class Command(BaseCommand):
+    help = 'Обновляет статистику базы и закэшированные подсчеты для приблизительного числа строк'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every',
+            type=float,
+            help='Повторять каждые N часов, пока команду не остановят'
+        )
+
+    def handle(self, **options):
+        while True:
+            refresh_statistics()
+            for model in APPROXIMATE_COUNT_MODELS:
+                self.stdout.write(f'{model._meta.db_table}: ~{table_estimate(model)}')
+            self.stdout.write(f'Пересчитано подсчетов с фильтрами: {refresh_cached_counts()}')
+            self.stdout.write(self.style.SUCCESS('Статистика обновлена'))
+            if not options['every']:
+                break
+            time.sleep(options['every'] * 3600)
+            close_old_connections()
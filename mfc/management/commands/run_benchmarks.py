@@ -0,0 +1,94 @@
+# как использовать:
+#     python manage.py run_benchmarks
+#     python manage.py run_benchmarks --branches 1000 --appointments 500000 --output bench.json
+#     python manage.py run_benchmarks --compare bench.json --threshold 0.15
+#     python manage.py run_benchmarks --only api_branches,branch_list --repeat 200
+#
+# данные создаются во временной тестовой базе, рабочая база не затрагивается
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from mfc.benchmarks import ENDPOINTS, build_report, compare_reports, load_report, run_benchmarks, save_report
+from mfc.generators import LoadDataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержку, число запросов и память для страниц и API МФЦ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branches', type=int, default=200, help='Отделений (по умолчанию: 200)')
+        parser.add_argument('--services', type=int, default=60, help='Услуг (по умолчанию: 60)')
+        parser.add_argument('--users', type=int, default=5000, help='Пользователей (по умолчанию: 5000)')
+        parser.add_argument(
+            '--appointments',
+            type=int,
+            default=50000,
+            help='Записей на прием (по умолчанию: 50000)'
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Seed генератора (по умолчанию: 42)')
+        parser.add_argument('--repeat', type=int, default=50, help='Запросов на точку (по умолчанию: 50)')
+        parser.add_argument('--warmup', type=int, default=5, help='Прогревочных запросов (по умолчанию: 5)')
+        parser.add_argument('--only', type=str, help='Имена точек через запятую')
+        parser.add_argument('--output', type=str, help='Куда сохранить результат в JSON')
+        parser.add_argument('--compare', type=str, help='JSON предыдущего запуска для сравнения')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.2,
+            help='Допустимый рост p50 при сравнении, доля (по умолчанию: 0.2)'
+        )
+
+    def handle(self, **options):
+        only = set(options['only'].split(',')) if options['only'] else None
+        if only:
+            unknown = only - {endpoint.name for endpoint in ENDPOINTS}
+            if unknown:
+                raise CommandError(f'Неизвестные точки: {", ".join(sorted(unknown))}')
+        baseline = load_report(options['compare']) if options['compare'] else None
+
+        dataset = {
+            'branches': options['branches'],
+            'services': options['services'],
+            'users': options['users'],
+            'appointments': options['appointments'],
+            'seed': options['seed'],
+        }
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write('Генерация данных...')
+            LoadDataGenerator(seed=options['seed'], batch_size=5000).generate(
+                branches=options['branches'],
+                services=options['services'],
+                users=options['users'],
+                employees_per_branch=2,
+                appointments=options['appointments'],
+            )
+            with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+                results = run_benchmarks(
+                    repeat=options['repeat'],
+                    warmup=options['warmup'],
+                    only=only,
+                    progress=self.stdout.write,
+                )
+            report = build_report(results, dataset)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            save_report(report, options['output'])
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+        if baseline:
+            rows, regressions = compare_reports(baseline, report, options['threshold'])
+            self.stdout.write('')
+            self.stdout.write(f'Сравнение с {baseline["meta"].get("commit") or options["compare"]}:')
+            for name, old_p50, new_p50, change, old_queries, new_queries in rows:
+                self.stdout.write(
+                    f'{name:<30} {old_p50:>8.2f} -> {new_p50:>8.2f} мс ({change:+.0%})  '
+                    f'запросов {old_queries} -> {new_queries}'
+                )
+            if regressions:
+                raise CommandError(f'Регрессия производительности: {", ".join(regressions)}')
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
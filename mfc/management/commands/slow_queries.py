@@ -0,0 +1,63 @@
+# как использовать:
+#     python manage.py slow_queries
+#     python manage.py slow_queries --top 5 --plan
+#     python manage.py slow_queries --view mfc:branch-complex-search
+#     python manage.py slow_queries --reset
+#
+# самые тяжелые запросы по суммарному времени из журнала SlowQueryMiddleware
+# (порог MFC_SLOW_QUERY_MS)
+
+from django.core.management.base import BaseCommand
+
+from mfc.models import SlowQuery
+
+
+class Command(BaseCommand):
+    help = 'Показывает медленные запросы к базе по суммарному времени'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Сколько запросов показать (по умолчанию: 20)'
+        )
+        parser.add_argument(
+            '--view',
+            type=str,
+            help='Только запросы одного view, например mfc:branch_list'
+        )
+        parser.add_argument(
+            '--plan',
+            action='store_true',
+            help='Показать план выполнения каждого запроса'
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Очистить журнал'
+        )
+
+    def handle(self, **options):
+        if options['reset']:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'Удалено записей журнала: {deleted}'))
+            return
+
+        queries = SlowQuery.objects.order_by('-total_time')
+        if options['view']:
+            queries = queries.filter(view=options['view'])
+        queries = list(queries[:options['top']])
+        if not queries:
+            self.stdout.write('Медленных запросов нет')
+            return
+
+        for number, query in enumerate(queries, start=1):
+            self.stdout.write(self.style.SUCCESS(
+                f'{number}. {query.view}: всего {query.total_time:.0f} мс, вызовов {query.calls}, '
+                f'в среднем {query.total_time / query.calls:.1f} мс, максимум {query.max_time:.1f} мс'
+            ))
+            self.stdout.write(f'   {query.sql}')
+            if options['plan'] and query.plan:
+                for line in query.plan.splitlines():
+                    self.stdout.write(f'     {line}')
@@ -0,0 +1,232 @@
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import Template
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+HISTOGRAMS = {
+    'mfc_request_duration_seconds': ('Время обработки запроса', LATENCY_BUCKETS),
+    'mfc_db_queries': ('Запросов к базе за запрос', QUERY_BUCKETS),
+    'mfc_db_duration_seconds': ('Время запросов к базе за запрос', LATENCY_BUCKETS),
+    'mfc_template_duration_seconds': ('Время рендеринга шаблонов за запрос', LATENCY_BUCKETS),
+    'mfc_response_size_bytes': ('Размер ответа', SIZE_BUCKETS),
+    'mfc_job_wait_seconds': ('Ожидание фоновой задачи в очереди', LATENCY_BUCKETS + (30, 60, 300)),
+    'mfc_job_duration_seconds': ('Время выполнения фоновой задачи', LATENCY_BUCKETS + (30, 60, 300)),
+}
+
+_sample = ContextVar('mfc_metrics_sample', default=None)
+
+
+def get_sample_rate():
+    # доля запросов, по которым собираются гистограммы; 0 выключает сбор
+    return getattr(settings, 'MFC_METRICS_SAMPLE_RATE', 0.1)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    # метрики живут в памяти процесса: у каждого воркера свои, Prometheus их суммирует
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (метрика, метка, значение) -> Histogram
+        self.requests = {}    # view -> число запросов, без выборки
+        self.collectors = []  # функции, которые при выдаче дописывают свои строки (gauge из базы)
+
+    def count_request(self, view):
+        with self.lock:
+            self.requests[view] = self.requests.get(view, 0) + 1
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def observe(self, view, values, label='view'):
+        with self.lock:
+            for name, value in values.items():
+                key = (name, label, view)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+                self.histograms[key].observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.requests = {}
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines.append('# HELP mfc_requests_total Обработано запросов')
+            lines.append('# TYPE mfc_requests_total counter')
+            for view, count in sorted(self.requests.items()):
+                lines.append(f'mfc_requests_total{{view="{escape(view)}"}} {count}')
+            lines.append('# HELP mfc_metrics_sample_rate Доля запросов в гистограммах')
+            lines.append('# TYPE mfc_metrics_sample_rate gauge')
+            lines.append(f'mfc_metrics_sample_rate {get_sample_rate()}')
+            for name, (help_text, buckets) in HISTOGRAMS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, label_name, value), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    label = f'{label_name}="{escape(value)}"'
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{label}}} {histogram.count}')
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+class Sample:
+    # замеры одного запроса, попавшего в выборку
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0
+        self.template_time = 0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # обертка connection.execute_wrapper: считает запросы и их время
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+
+def sampled_execute(execute, sql, params, many, context):
+    sample = _sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    return sample(execute, sql, params, many, context)
+
+
+def install_execute_wrapper(sender, connection, **kwargs):
+    # обертка ставится на соединение один раз (сигнал connection_created), а замер
+    # берется из ContextVar: так считаются и запросы async ORM, которые выполняются
+    # в потоке sync_to_async со своим соединением
+    if sampled_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sampled_execute)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+def observe_request(request, response, sample, duration):
+    values = {
+        'mfc_request_duration_seconds': duration,
+        'mfc_db_queries': sample.queries,
+        'mfc_db_duration_seconds': sample.db_time,
+        'mfc_template_duration_seconds': sample.template_time,
+    }
+    if not response.streaming:
+        values['mfc_response_size_bytes'] = len(response.content)
+    registry.observe(view_name(request), values)
+
+
+_template_render = Template.render
+
+
+def timed_render(self, context=None, request=None):
+    sample = _sample.get()
+    if sample is None:
+        return _template_render(self, context, request)
+    # вложенные шаблоны (render_to_string внутри тега) уже входят во внешний замер
+    sample.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _template_render(self, context, request)
+    finally:
+        sample.template_depth -= 1
+        if not sample.template_depth:
+            sample.template_time += time.perf_counter() - started
+
+
+def instrument_templates():
+    Template.render = timed_render
+
+
+class MetricsMiddleware:
+    # по каждому view: время ответа, число и время запросов к базе, время шаблонов
+    # и размер ответа; гистограммы собираются по доле MFC_METRICS_SAMPLE_RATE запросов
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        rate = get_sample_rate()
+        if not rate or random.random() >= rate:
+            response = self.get_response(request)
+            registry.count_request(view_name(request))
+            return response
+
+        sample = Sample()
+        token = _sample.set(sample)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _sample.reset(token)
+        duration = time.perf_counter() - started
+        registry.count_request(view_name(request))
+        observe_request(request, response, sample, duration)
+        return response
+
+    async def __acall__(self, request):
+        rate = get_sample_rate()
+        if not rate or random.random() >= rate:
+            response = await self.get_response(request)
+            registry.count_request(view_name(request))
+            return response
+
+        sample = Sample()
+        token = _sample.set(sample)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _sample.reset(token)
+        duration = time.perf_counter() - started
+        registry.count_request(view_name(request))
+        observe_request(request, response, sample, duration)
+        return response
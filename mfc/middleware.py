@@ -0,0 +1,37 @@
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from .history import history_batch
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class HistoryBatchMiddleware:
+    # исторические записи, сделанные за запрос, пишутся одной вставкой в конце
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with history_batch():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.method in SAFE_METHODS:
+            # чтение истории не пишет, лишние переходы в поток не нужны
+            return await self.get_response(request)
+        # пачка живет в threading.local, поэтому открывается и закрывается в том же
+        # потоке sync_to_async, где синхронные view пишут в базу
+        stack = ExitStack()
+        await sync_to_async(stack.enter_context)(history_batch())
+        try:
+            return await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
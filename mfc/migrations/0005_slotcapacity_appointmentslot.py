@@ -0,0 +1,89 @@
+# Generated by Django 4.2 on 2026-10-17 17:32
+
+from datetime import time
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def slot_start(value):
+    # копия mfc.booking.slot_start на момент миграции: изменения в booking ее не трогают
+    slot_minutes = getattr(settings, 'MFC_SLOT_MINUTES', 30)
+    minutes = value.hour * 60 + value.minute
+    minutes -= minutes % slot_minutes
+    return time(minutes // 60, minutes % 60)
+
+
+def fill_appointment_slots(apps, schema_editor):
+    # переносим уже существующие записи в счетчики слотов
+    Appointment = apps.get_model('mfc', 'Appointment')
+    AppointmentSlot = apps.get_model('mfc', 'AppointmentSlot')
+    capacity = getattr(settings, 'MFC_DEFAULT_SLOT_CAPACITY', 1)
+    booked = {}
+    appointments = Appointment.objects.exclude(
+        status__in=['CANCELLED', 'NO_SHOW']
+    ).values_list('branch_id', 'service_id', 'date', 'time')
+    for branch_id, service_id, date, value in appointments.iterator():
+        key = (branch_id, service_id, date, slot_start(value))
+        booked[key] = booked.get(key, 0) + 1
+    AppointmentSlot.objects.bulk_create([
+        AppointmentSlot(
+            branch_id=branch_id, service_id=service_id, date=date, time=value,
+            booked=count, capacity=max(capacity, count),
+        )
+        for (branch_id, service_id, date, value), count in booked.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0004_historicalappointment_historicalbranch_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата приема')),
+                ('time', models.TimeField(verbose_name='Начало слота')),
+                ('capacity', models.PositiveIntegerField(verbose_name='Мест в слоте')),
+                ('booked', models.PositiveIntegerField(default=0, verbose_name='Занято мест')),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointment_slots', to='mfc.branch', verbose_name='Отделение')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointment_slots', to='mfc.service', verbose_name='Услуга')),
+            ],
+            options={
+                'verbose_name': 'Слот записи',
+                'verbose_name_plural': 'Слоты записи',
+                'ordering': ['date', 'time'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SlotCapacity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.TimeField(blank=True, help_text='Пусто — для всех слотов рабочего дня', null=True, verbose_name='Начало слота')),
+                ('capacity', models.PositiveIntegerField(default=1, help_text='Сколько записей можно принять на один слот в день', verbose_name='Мест в слоте')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_capacities', to='mfc.branch', verbose_name='Отделение')),
+                ('service', models.ForeignKey(blank=True, help_text='Пусто — для всех услуг отделения', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='slot_capacities', to='mfc.service', verbose_name='Услуга')),
+            ],
+            options={
+                'verbose_name': 'Вместимость слота',
+                'verbose_name_plural': 'Вместимость слотов',
+                'ordering': ['branch__name', 'service__name', 'time'],
+                'unique_together': {('branch', 'service', 'time')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='appointmentslot',
+            index=models.Index(fields=['branch', 'date'], name='mfc_appoint_branch__62ba12_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='appointmentslot',
+            unique_together={('branch', 'service', 'date', 'time')},
+        ),
+        migrations.RunPython(fill_appointment_slots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2 on 2026-10-17 17:35
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Cast, Ceil, Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Branch = apps.get_model('mfc', 'Branch')
+    Service = apps.get_model('mfc', 'Service')
+    BranchService = apps.get_model('mfc', 'BranchService')
+
+    links = BranchService.objects.filter(branch=OuterRef('pk')).order_by().values('branch')
+    Branch.objects.update(
+        services_count=Coalesce(Subquery(links.annotate(total=Count('pk')).values('total')), 0),
+        available_services_count=Coalesce(
+            Subquery(links.filter(is_available=True).annotate(total=Count('pk')).values('total')), 0
+        ),
+        avg_duration_days=Subquery(
+            links.annotate(avg=Cast(Ceil(Avg('service__duration_days')), IntegerField())).values('avg')
+        ),
+    )
+
+    links = BranchService.objects.filter(service=OuterRef('pk'), is_available=True).order_by().values('service')
+    Service.objects.update(
+        available_branches_count=Coalesce(Subquery(links.annotate(total=Count('pk')).values('total')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0005_slotcapacity_appointmentslot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='available_services_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Доступных услуг'),
+        ),
+        migrations.AddField(
+            model_name='branch',
+            name='avg_duration_days',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Средний срок услуг (дн)'),
+        ),
+        migrations.AddField(
+            model_name='branch',
+            name='services_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Услуг'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='available_branches_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Доступна в отделениях'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
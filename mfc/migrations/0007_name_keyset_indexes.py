@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-17 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0006_branch_service_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='branch',
+            index=models.Index(fields=['name', 'id'], name='mfc_branch_name_445fe2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['name', 'id'], name='mfc_service_name_3bfaca_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from mfc.search import BRANCH_TABLE, SERVICE_TABLE, create_index
+
+    create_index(schema_editor)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # FTS5 сам приводит регистр, вручную заменяем только ё на е
+    schema_editor.execute(
+        f"INSERT INTO {BRANCH_TABLE} (rowid, name, address, services) "
+        "SELECT b.id, replace(replace(b.name, 'ё', 'е'), 'Ё', 'Е'), "
+        "replace(replace(b.address, 'ё', 'е'), 'Ё', 'Е'), "
+        "coalesce((SELECT group_concat(replace(replace(s.name, 'ё', 'е'), 'Ё', 'Е'), ' ') "
+        "FROM mfc_branchservice bs JOIN mfc_service s ON s.id = bs.service_id "
+        "WHERE bs.branch_id = b.id), '') "
+        "FROM mfc_branch b"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {SERVICE_TABLE} (rowid, name) "
+        "SELECT id, replace(replace(name, 'ё', 'е'), 'Ё', 'Е') FROM mfc_service"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    from mfc.search import drop_index
+
+    drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0007_name_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-17 17:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mfc', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=50, verbose_name='Ресурс')),
+                ('file_format', models.CharField(max_length=10, verbose_name='Формат')),
+                ('export_fields', models.JSONField(blank=True, null=True, verbose_name='Поля')),
+                ('item_ids', models.JSONField(blank=True, null=True, verbose_name='Выбранные записи')),
+                ('status', models.CharField(choices=[('PENDING', 'В очереди'), ('RUNNING', 'Выполняется'), ('DONE', 'Готово'), ('FAILED', 'Ошибка'), ('CANCELLED', 'Отменено')], default='PENDING', max_length=20, verbose_name='Статус')),
+                ('rows_total', models.PositiveIntegerField(default=0, verbose_name='Всего строк')),
+                ('rows_done', models.PositiveIntegerField(default=0, verbose_name='Выгружено строк')),
+                ('file', models.FileField(blank=True, upload_to='exports/', verbose_name='Файл')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Выгрузка',
+                'verbose_name_plural': 'Выгрузки',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='exportjob',
+            index=models.Index(fields=['user', 'status'], name='mfc_exportj_user_id_497137_idx'),
+        ),
+    ]
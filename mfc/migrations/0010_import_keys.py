@@ -0,0 +1,61 @@
+# Generated by Django 4.2 on 2026-10-17 17:46
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def duplicates(model, field):
+    values = (
+        model.objects.values(field).annotate(total=Count('pk')).filter(total__gt=1).values_list(field, flat=True)
+    )
+    for value in values:
+        # первая запись сохраняет значение, остальные переименовываются
+        yield value, list(model.objects.filter(**{field: value}).order_by('pk')[1:])
+
+
+def resolve_duplicates(apps, schema_editor):
+    # уникальные ограничения не создадутся поверх дублей: не сливаем записи (у них свои
+    # записи на прием и услуги), а делаем значения различимыми и печатаем, что изменили
+    Branch = apps.get_model('mfc', 'Branch')
+    Service = apps.get_model('mfc', 'Service')
+    renamed = []
+
+    for email, branches in duplicates(Branch, 'email'):
+        local, at, domain = email.partition('@')
+        for branch in branches:
+            branch.email = f'{local}+dup{branch.pk}{at}{domain}'
+            branch.save(update_fields=['email'])
+            renamed.append(f'отделение #{branch.pk}: email {email} -> {branch.email}')
+
+    max_length = Service._meta.get_field('name').max_length
+    for name, services in duplicates(Service, 'name'):
+        for service in services:
+            suffix = f' (#{service.pk})'
+            service.name = name[:max_length - len(suffix)] + suffix
+            service.save(update_fields=['name'])
+            renamed.append(f'услуга #{service.pk}: название {name} -> {service.name}')
+
+    if renamed:
+        print('\n  Найдены дубли, значения изменены (проверьте и поправьте вручную):')
+        for line in renamed:
+            print(f'    {line}')
+        print('  Поисковый индекс: python manage.py rebuild_search_index')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0009_export_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='branch',
+            constraint=models.UniqueConstraint(fields=('email',), name='mfc_branch_unique_email'),
+        ),
+        migrations.AddConstraint(
+            model_name='service',
+            constraint=models.UniqueConstraint(fields=('name',), name='mfc_service_unique_name'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-17 17:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0010_import_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата приема')),
+                ('status', models.CharField(choices=[('PENDING', 'Ожидает'), ('CONFIRMED', 'Подтверждена'), ('IN_PROGRESS', 'В работе'), ('COMPLETED', 'Завершена'), ('CANCELLED', 'Отменена'), ('NO_SHOW', 'Не явился')], max_length=20, verbose_name='Статус')),
+                ('hour', models.PositiveSmallIntegerField(verbose_name='Час приема')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='mfc.branch', verbose_name='Отделение')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='mfc.service', verbose_name='Услуга')),
+            ],
+            options={
+                'verbose_name': 'Статистика записей за день',
+                'verbose_name_plural': 'Статистика записей по дням',
+                'ordering': ['date', 'hour'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='appointmentdailystat',
+            index=models.Index(fields=['branch', 'date'], name='mfc_appoint_branch__157a5e_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='appointmentdailystat',
+            unique_together={('branch', 'service', 'date', 'status', 'hour')},
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-17 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0011_appointment_daily_stat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=32, verbose_name='Слепок')),
+                ('view', models.CharField(max_length=200, verbose_name='View')),
+                ('sql', models.TextField(verbose_name='SQL без параметров')),
+                ('example', models.TextField(blank=True, verbose_name='Пример с параметрами')),
+                ('plan', models.TextField(blank=True, verbose_name='План запроса')),
+                ('calls', models.PositiveIntegerField(default=0, verbose_name='Вызовов')),
+                ('total_time', models.FloatField(default=0, verbose_name='Всего, мс')),
+                ('max_time', models.FloatField(default=0, verbose_name='Максимум, мс')),
+                ('first_seen', models.DateTimeField(auto_now_add=True, verbose_name='Впервые')),
+                ('last_seen', models.DateTimeField(auto_now=True, verbose_name='Последний раз')),
+            ],
+            options={
+                'verbose_name': 'Медленный запрос',
+                'verbose_name_plural': 'Медленные запросы',
+                'ordering': ['-total_time'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='slowquery',
+            index=models.Index(fields=['-total_time'], name='mfc_slowque_total_t_09897f_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='slowquery',
+            unique_together={('fingerprint', 'view')},
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-17 18:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0012_slow_query'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='photo_pending',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Фото обрабатывается'),
+        ),
+        migrations.CreateModel(
+            name='PhotoJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('photo', models.CharField(blank=True, max_length=255, verbose_name='Загруженный файл')),
+                ('old_photo', models.CharField(blank=True, max_length=255, verbose_name='Файл к удалению')),
+                ('status', models.CharField(choices=[('PENDING', 'В очереди'), ('RUNNING', 'Выполняется'), ('DONE', 'Готово'), ('FAILED', 'Ошибка')], default='PENDING', max_length=20, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Не раньше')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата запуска')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='photo_jobs', to='mfc.branch', verbose_name='Отделение')),
+            ],
+            options={
+                'verbose_name': 'Обработка фото',
+                'verbose_name_plural': 'Обработка фото',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='photojob',
+            index=models.Index(fields=['status', 'run_after'], name='mfc_photojo_status_bb9b0e_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-17 18:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mfc', '0013_photo_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='Токен')),
+                ('purpose', models.CharField(choices=[('photo', 'Фото отделения'), ('import', 'Импорт')], max_length=20, verbose_name='Назначение')),
+                ('import_kind', models.CharField(blank=True, max_length=50, verbose_name='Что импортировать')),
+                ('filename', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер')),
+                ('offset', models.PositiveBigIntegerField(default=0, verbose_name='Получено байт')),
+                ('status', models.CharField(choices=[('UPLOADING', 'Загружается'), ('DONE', 'Готово'), ('FAILED', 'Ошибка'), ('CANCELLED', 'Отменено')], default='UPLOADING', max_length=20, verbose_name='Статус')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Результат')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='chunked_uploads', to='mfc.branch', verbose_name='Отделение')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunked_uploads', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Загрузка частями',
+                'verbose_name_plural': 'Загрузки частями',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='chunkedupload',
+            index=models.Index(fields=['status', 'updated_at'], name='mfc_chunked_status_b8a4d4_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-17 18:49
+
+from django.db import migrations, models
+import mfc.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0014_chunked_uploads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата обновления'),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='file',
+            field=models.FileField(blank=True, storage=mfc.storage.ExportStorage(), upload_to='', verbose_name='Файл'),
+        ),
+    ]
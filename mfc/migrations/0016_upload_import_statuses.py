@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 18:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0015_export_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chunkedupload',
+            name='status',
+            field=models.CharField(choices=[('UPLOADING', 'Загружается'), ('QUEUED', 'Ждет импорта'), ('IMPORTING', 'Импортируется'), ('DONE', 'Готово'), ('FAILED', 'Ошибка'), ('CANCELLED', 'Отменено')], default='UPLOADING', max_length=20, verbose_name='Статус'),
+        ),
+    ]
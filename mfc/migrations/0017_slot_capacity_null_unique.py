@@ -0,0 +1,58 @@
+# Generated by Django 4.2 on 2026-10-17 19:03
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_null_duplicates(apps, schema_editor):
+    # unique_together пропускал дубли с пустой услугой или временем: оставляем
+    # последнюю измененную запись, остальные удаляем и печатаем, что удалили
+    SlotCapacity = apps.get_model('mfc', 'SlotCapacity')
+    keys = (
+        SlotCapacity.objects.values('branch', 'service', 'time')
+        .annotate(total=Count('pk')).filter(total__gt=1)
+    )
+    removed = []
+    for key in keys:
+        # filter(service=None) превращается в service IS NULL
+        rows = SlotCapacity.objects.filter(branch=key['branch'], service=key['service'], time=key['time'])
+        for row in rows.order_by('-updated_at', '-pk')[1:]:
+            removed.append(f'вместимость #{row.pk}: отделение #{row.branch_id}, '
+                           f'услуга {row.service_id or "все"}, слот {row.time or "все"}, мест {row.capacity}')
+            row.delete()
+
+    if removed:
+        print('\n  Удалены дубли вместимости слотов (осталась последняя измененная запись):')
+        for line in removed:
+            print(f'    {line}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mfc', '0016_upload_import_statuses'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_null_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='slotcapacity',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='slotcapacity',
+            constraint=models.UniqueConstraint(fields=('branch', 'service', 'time'), name='mfc_slotcapacity_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='slotcapacity',
+            constraint=models.UniqueConstraint(condition=models.Q(('service__isnull', True), ('time__isnull', False)), fields=('branch', 'time'), name='mfc_slotcapacity_unique_any_service'),
+        ),
+        migrations.AddConstraint(
+            model_name='slotcapacity',
+            constraint=models.UniqueConstraint(condition=models.Q(('service__isnull', False), ('time__isnull', True)), fields=('branch', 'service'), name='mfc_slotcapacity_unique_any_time'),
+        ),
+        migrations.AddConstraint(
+            model_name='slotcapacity',
+            constraint=models.UniqueConstraint(condition=models.Q(('service__isnull', True), ('time__isnull', True)), fields=('branch',), name='mfc_slotcapacity_unique_branch_default'),
+        ),
+    ]
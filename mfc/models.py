@@ -1,6 +1,12 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
-from simple_history.models import HistoricalRecords
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .history import BufferedHistoricalRecords
+from .images import variant_urls
+from .storage import ExportStorage
 
 
 class Branch(models.Model):
@@ -48,7 +54,35 @@ class Branch(models.Model):
         verbose_name="Дата обновления"
     )
 
-    history = HistoricalRecords()
+    # счетчики по branch_services, пересчитываются в mfc.counters
+    services_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Услуг"
+    )
+
+    available_services_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Доступных услуг"
+    )
+
+    avg_duration_days = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name="Средний срок услуг (дн)"
+    )
+
+    photo_pending = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name="Фото обрабатывается"
+    )
+
+    history = BufferedHistoricalRecords(
+        excluded_fields=['services_count', 'available_services_count', 'avg_duration_days', 'photo_pending']
+    )
     
     class Meta:
         verbose_name = "Отделение"
@@ -61,10 +95,21 @@ class Branch(models.Model):
         indexes = [
             models.Index(fields=['-created_at']),
             models.Index(fields=['is_active']),
+            models.Index(fields=['name', 'id']),  # курсорная пагинация по названию
+        ]
+
+        # ключ для импорта: отделение с тем же email обновляется, а не дублируется
+        constraints = [
+            models.UniqueConstraint(fields=['email'], name='mfc_branch_unique_email'),
         ]
     
     def __str__(self):
         return f"{self.name} ({self.address})"
+
+    @cached_property
+    def photo_variants(self):
+        # уменьшенные копии фото в JPEG и WebP, см. mfc.images
+        return variant_urls(self.photo)
     
 class Service(models.Model):
     class Category(models.TextChoices):
@@ -113,7 +158,13 @@ class Service(models.Model):
         verbose_name="Дата обновления"
     )
 
-    history = HistoricalRecords()
+    available_branches_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Доступна в отделениях"
+    )
+
+    history = BufferedHistoricalRecords(excluded_fields=['available_branches_count'])
     
     class Meta:
         verbose_name = "Услуга"
@@ -123,7 +174,12 @@ class Service(models.Model):
         ordering = ['name']
         
         indexes = [
-            models.Index(fields=['category'])
+            models.Index(fields=['category']),
+            models.Index(fields=['name', 'id']),
+        ]
+
+        constraints = [
+            models.UniqueConstraint(fields=['name'], name='mfc_service_unique_name'),
         ]
     
     def __str__(self):
@@ -359,7 +415,7 @@ class Appointment(models.Model):
         verbose_name="Дата обновления"
     )
 
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
     
     class Meta:
         verbose_name = "Запись на прием"
@@ -375,4 +431,531 @@ class Appointment(models.Model):
     
     def __str__(self):
         user_name = self.user_profile.full_name or self.user_profile.user.username
-        return f"Запись #{self.id}: {user_name} - {self.date} {self.time}"
\ No newline at end of file
+        return f"Запись #{self.id}: {user_name} - {self.date} {self.time}"
+
+
+class SlotCapacity(models.Model):
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        verbose_name="Отделение",
+        related_name='slot_capacities'
+    )
+
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.CASCADE,
+        verbose_name="Услуга",
+        related_name='slot_capacities',
+        blank=True,
+        null=True,
+        help_text="Пусто — для всех услуг отделения"
+    )
+
+    time = models.TimeField(
+        verbose_name="Начало слота",
+        blank=True,
+        null=True,
+        help_text="Пусто — для всех слотов рабочего дня"
+    )
+
+    capacity = models.PositiveIntegerField(
+        default=1,
+        verbose_name="Мест в слоте",
+        help_text="Сколько записей можно принять на один слот в день"
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Дата обновления"
+    )
+
+    class Meta:
+        verbose_name = "Вместимость слота"
+
+        verbose_name_plural = "Вместимость слотов"
+
+        # NULL в уникальном индексе не совпадает сам с собой, поэтому правила
+        # «для всех услуг» и «для всех слотов» нужны отдельные условные ограничения
+        constraints = [
+            models.UniqueConstraint(
+                fields=['branch', 'service', 'time'], name='mfc_slotcapacity_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['branch', 'time'], condition=models.Q(service__isnull=True, time__isnull=False),
+                name='mfc_slotcapacity_unique_any_service',
+            ),
+            models.UniqueConstraint(
+                fields=['branch', 'service'], condition=models.Q(service__isnull=False, time__isnull=True),
+                name='mfc_slotcapacity_unique_any_time',
+            ),
+            models.UniqueConstraint(
+                fields=['branch'], condition=models.Q(service__isnull=True, time__isnull=True),
+                name='mfc_slotcapacity_unique_branch_default',
+            ),
+        ]
+
+        ordering = ['branch__name', 'service__name', 'time']
+
+    def __str__(self):
+        service_name = self.service.name if self.service_id else "все услуги"
+        slot = self.time.strftime('%H:%M') if self.time else "все слоты"
+        return f"{self.branch.name}: {service_name}, {slot} — {self.capacity}"
+
+class AppointmentSlot(models.Model):
+    # счетчик занятых мест на конкретный день и слот, меняется только атомарным UPDATE
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        verbose_name="Отделение",
+        related_name='appointment_slots'
+    )
+
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.CASCADE,
+        verbose_name="Услуга",
+        related_name='appointment_slots'
+    )
+
+    date = models.DateField(
+        verbose_name="Дата приема"
+    )
+
+    time = models.TimeField(
+        verbose_name="Начало слота"
+    )
+
+    capacity = models.PositiveIntegerField(
+        verbose_name="Мест в слоте"
+    )
+
+    booked = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Занято мест"
+    )
+
+    class Meta:
+        verbose_name = "Слот записи"
+
+        verbose_name_plural = "Слоты записи"
+
+        unique_together = ['branch', 'service', 'date', 'time']
+
+        indexes = [
+            models.Index(fields=['branch', 'date']),
+        ]
+
+        ordering = ['date', 'time']
+
+    def __str__(self):
+        return f"{self.branch_id}/{self.service_id} {self.date} {self.time:%H:%M} ({self.booked}/{self.capacity})"
+
+
+class AppointmentDailyStat(models.Model):
+    # число записей за день по отделению, услуге, статусу и часу приема;
+    # меняется сигналами записи на прием, пересчитывается rebuild_daily_stats
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        verbose_name="Отделение",
+        related_name='daily_stats'
+    )
+
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.CASCADE,
+        verbose_name="Услуга",
+        related_name='daily_stats'
+    )
+
+    date = models.DateField(
+        verbose_name="Дата приема"
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=Appointment.Status.choices,
+        verbose_name="Статус"
+    )
+
+    hour = models.PositiveSmallIntegerField(
+        verbose_name="Час приема"
+    )
+
+    count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Записей"
+    )
+
+    class Meta:
+        verbose_name = "Статистика записей за день"
+
+        verbose_name_plural = "Статистика записей по дням"
+
+        unique_together = ['branch', 'service', 'date', 'status', 'hour']
+
+        indexes = [
+            models.Index(fields=['branch', 'date']),
+        ]
+
+        ordering = ['date', 'hour']
+
+    def __str__(self):
+        return f"{self.branch_id}/{self.service_id} {self.date} {self.hour}:00 {self.status} — {self.count}"
+
+
+class ExportJob(models.Model):
+    # выгрузка в фоне: файл пишет пул потоков из mfc.export_jobs
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'В очереди'
+        RUNNING = 'RUNNING', 'Выполняется'
+        DONE = 'DONE', 'Готово'
+        FAILED = 'FAILED', 'Ошибка'
+        CANCELLED = 'CANCELLED', 'Отменено'
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="Пользователь",
+        related_name='export_jobs'
+    )
+
+    resource = models.CharField(
+        max_length=50,
+        verbose_name="Ресурс"
+    )
+
+    file_format = models.CharField(
+        max_length=10,
+        verbose_name="Формат"
+    )
+
+    export_fields = models.JSONField(
+        blank=True,
+        null=True,
+        verbose_name="Поля"
+    )
+
+    item_ids = models.JSONField(
+        blank=True,
+        null=True,
+        verbose_name="Выбранные записи"
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name="Статус"
+    )
+
+    rows_total = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Всего строк"
+    )
+
+    rows_done = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Выгружено строк"
+    )
+
+    file = models.FileField(
+        storage=ExportStorage(),
+        blank=True,
+        verbose_name="Файл"
+    )
+
+    error = models.TextField(
+        blank=True,
+        verbose_name="Ошибка"
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Дата создания"
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Дата обновления"
+    )
+
+    finished_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Дата завершения"
+    )
+
+    class Meta:
+        verbose_name = "Выгрузка"
+
+        verbose_name_plural = "Выгрузки"
+
+        indexes = [
+            models.Index(fields=['user', 'status']),
+        ]
+
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.resource}.{self.file_format} #{self.pk} ({self.get_status_display()})"
+
+
+class SlowQuery(models.Model):
+    # медленный запрос к базе: одна строка на слепок SQL и view, см. mfc.slow_queries
+    fingerprint = models.CharField(
+        max_length=32,
+        verbose_name="Слепок"
+    )
+
+    view = models.CharField(
+        max_length=200,
+        verbose_name="View"
+    )
+
+    sql = models.TextField(
+        verbose_name="SQL без параметров"
+    )
+
+    example = models.TextField(
+        blank=True,
+        verbose_name="Пример с параметрами"
+    )
+
+    plan = models.TextField(
+        blank=True,
+        verbose_name="План запроса"
+    )
+
+    calls = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Вызовов"
+    )
+
+    total_time = models.FloatField(
+        default=0,
+        verbose_name="Всего, мс"
+    )
+
+    max_time = models.FloatField(
+        default=0,
+        verbose_name="Максимум, мс"
+    )
+
+    first_seen = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Впервые"
+    )
+
+    last_seen = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Последний раз"
+    )
+
+    class Meta:
+        verbose_name = "Медленный запрос"
+
+        verbose_name_plural = "Медленные запросы"
+
+        unique_together = ['fingerprint', 'view']
+
+        indexes = [
+            models.Index(fields=['-total_time']),
+        ]
+
+        ordering = ['-total_time']
+
+    def __str__(self):
+        return f"{self.view}: {self.sql[:80]}"
+
+
+class PhotoJob(models.Model):
+    # обработка фото отделения в фоне: проверка, перекодирование, копии и
+    # удаление старых файлов; выполняет пул потоков из mfc.photo_jobs
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'В очереди'
+        RUNNING = 'RUNNING', 'Выполняется'
+        DONE = 'DONE', 'Готово'
+        FAILED = 'FAILED', 'Ошибка'
+
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        verbose_name="Отделение",
+        related_name='photo_jobs'
+    )
+
+    photo = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name="Загруженный файл"
+    )
+
+    old_photo = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name="Файл к удалению"
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name="Статус"
+    )
+
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="Попыток"
+    )
+
+    error = models.TextField(
+        blank=True,
+        verbose_name="Ошибка"
+    )
+
+    run_after = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Не раньше"
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Дата создания"
+    )
+
+    started_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Дата запуска"
+    )
+
+    finished_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Дата завершения"
+    )
+
+    class Meta:
+        verbose_name = "Обработка фото"
+
+        verbose_name_plural = "Обработка фото"
+
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Фото #{self.pk} ({self.get_status_display()})"
+
+
+class ChunkedUpload(models.Model):
+    # загрузка файла частями с докачкой (mfc.uploads): части дописываются в
+    # MEDIA_ROOT/uploads/<token>.part, готовый файл становится фото отделения или идет в импорт
+    class Purpose(models.TextChoices):
+        PHOTO = 'photo', 'Фото отделения'
+        IMPORT = 'import', 'Импорт'
+
+    class Status(models.TextChoices):
+        UPLOADING = 'UPLOADING', 'Загружается'
+        QUEUED = 'QUEUED', 'Ждет импорта'
+        IMPORTING = 'IMPORTING', 'Импортируется'
+        DONE = 'DONE', 'Готово'
+        FAILED = 'FAILED', 'Ошибка'
+        CANCELLED = 'CANCELLED', 'Отменено'
+
+    token = models.UUIDField(
+        default=uuid.uuid4,
+        unique=True,
+        editable=False,
+        verbose_name="Токен"
+    )
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="Пользователь",
+        related_name='chunked_uploads'
+    )
+
+    purpose = models.CharField(
+        max_length=20,
+        choices=Purpose.choices,
+        verbose_name="Назначение"
+    )
+
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        verbose_name="Отделение",
+        related_name='chunked_uploads'
+    )
+
+    import_kind = models.CharField(
+        max_length=50,
+        blank=True,
+        verbose_name="Что импортировать"
+    )
+
+    filename = models.CharField(
+        max_length=255,
+        verbose_name="Имя файла"
+    )
+
+    size = models.PositiveBigIntegerField(
+        verbose_name="Размер"
+    )
+
+    offset = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name="Получено байт"
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.UPLOADING,
+        verbose_name="Статус"
+    )
+
+    error = models.TextField(
+        blank=True,
+        verbose_name="Ошибка"
+    )
+
+    result = models.JSONField(
+        blank=True,
+        null=True,
+        verbose_name="Результат"
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Дата создания"
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Дата обновления"
+    )
+
+    class Meta:
+        verbose_name = "Загрузка частями"
+
+        verbose_name_plural = "Загрузки частями"
+
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
@@ -0,0 +1,172 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination, Cursor, CursorPagination, PageNumberPagination, _reverse_ordering,
+)
+from rest_framework.response import Response
+
+from .counts import EXACT_COUNT_PARAM, ApproximatePaginator
+
+
+class KeysetPagination(CursorPagination):
+    # курсор строится по индексированным колонкам, id разрешает совпадения
+    orderings = {
+        'name': ('name', 'id'),
+        '-created_at': ('-created_at', '-id'),
+    }
+    ordering = orderings['name']
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get('ordering')
+        if ordering in self.orderings:
+            return self.orderings[ordering]
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+
+class ApproximatePageNumberPagination(PageNumberPagination):
+    # номера страниц, но count приблизительный (см. counts.approximate_count);
+    # ?exact_count=1 считает точно
+    def paginate_queryset(self, queryset, request, view=None):
+        self.exact = EXACT_COUNT_PARAM in request.query_params
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, queryset, page_size):
+        return ApproximatePaginator(queryset, page_size, exact=self.exact)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_approximate': self.page.paginator.approximate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_approximate'] = {'type': 'boolean', 'example': True}
+        return response_schema
+
+
+class SelectablePagination(BasePagination):
+    # по умолчанию обычные страницы, как раньше; ?pagination=cursor (или уже
+    # полученный ?cursor=...) включает курсорный режим без COUNT(*) и OFFSET,
+    # ?pagination=approximate — страницы с приблизительным count
+    mode_query_param = 'pagination'
+
+    def __init__(self):
+        self.page_number = PageNumberPagination()
+        self.approximate = ApproximatePageNumberPagination()
+        self.cursor = CompositeKeysetPagination()
+        self.active = self.page_number
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.active = self.cursor
+        elif request.query_params.get(self.mode_query_param) == 'approximate':
+            self.active = self.approximate
+        else:
+            self.active = self.page_number
+        return self.active.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.active.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return (
+            self.page_number.get_schema_operation_parameters(view)
+            + self.cursor.get_schema_operation_parameters(view)
+        )
+
+    def to_html(self):
+        return self.active.to_html()
+
+    def get_results(self, data):
+        return data['results']
+
+
+class CompositeKeysetPagination(KeysetPagination):
+    # CursorPagination из DRF фильтрует только по первому полю сортировки, а совпадения
+    # пропускает через OFFSET (не дальше offset_cutoff); здесь курсор хранит значения
+    # всех полей, и следующая страница — это строки после кортежа, например (name, id)
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = None if self.cursor is None else self.cursor.position
+
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after_position(queryset.model, ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def after_position(self, model, ordering, position):
+        # (a, b, c) > (x, y, z) = a > x OR (a = x AND (b > y OR (b = y AND c > z)))
+        try:
+            fields = [model._meta.get_field(order.lstrip('-')) for order in ordering]
+            values = [field.to_python(value) for field, value in zip(fields, json.loads(position), strict=True)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        for order, field, value in reversed(list(zip(ordering, fields, values))):
+            lookup = 'lt' if order.startswith('-') else 'gt'
+            beyond = Q(**{f'{field.name}__{lookup}': value})
+            condition = beyond | (Q(**{field.name: value}) & condition) if condition else beyond
+        return condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps([str(getattr(instance, order.lstrip('-'))) for order in ordering])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+
+class AppointmentCursorPagination(CompositeKeysetPagination):
+    # порядок совпадает с индексами (branch, date) и (branch, status, date)
+    orderings = {
+        'date': ('date', 'time', 'id'),
+        '-date': ('-date', '-time', '-id'),
+    }
+    ordering = orderings['date']
+
+    def get_ordering(self, request, queryset, view):
+        return self.orderings.get(request.query_params.get('ordering'), self.ordering)
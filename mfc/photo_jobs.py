@@ -0,0 +1,174 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .cache import bump_catalogue_version
+from .images import PhotoRejected, delete_photo, process_upload
+from .metrics import registry
+from .models import Branch, PhotoJob
+
+# задача, которая выполняется дольше, считается брошенной (процесс перезапустили)
+STALE_AFTER = timedelta(minutes=10)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # как и у выгрузок: пул потоков внутри процесса, без внешнего брокера
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'MFC_PHOTO_WORKERS', 2),
+                thread_name_prefix='mfc-photo',
+            )
+        return _executor
+
+
+def get_max_attempts():
+    return getattr(settings, 'MFC_PHOTO_JOB_ATTEMPTS', 3)
+
+
+def get_retry_delay(attempts):
+    # 30 с, 60 с, 120 с...
+    return getattr(settings, 'MFC_PHOTO_RETRY_SECONDS', 30) * 2 ** (attempts - 1)
+
+
+def submit(job_id):
+    get_executor().submit(run_in_worker, job_id)
+
+
+def enqueue_photo_job(branch_id, photo='', old_photo=''):
+    job = PhotoJob.objects.create(branch_id=branch_id, photo=photo, old_photo=old_photo)
+    # воркер видит задачу только после коммита
+    transaction.on_commit(lambda: submit(job.pk))
+    return job
+
+
+def schedule_retry(job_id, delay):
+    timer = threading.Timer(delay, submit, args=[job_id])
+    timer.daemon = True
+    timer.start()
+
+
+def run_in_worker(job_id):
+    close_old_connections()
+    try:
+        run_photo_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def apply_photo(job):
+    # загрузка уже лежит в Branch.photo; меняем ее на обработанную копию,
+    # если за это время отделению не загрузили другое фото
+    if job.branch_id is None or not Branch.objects.filter(pk=job.branch_id, photo=job.photo).exists():
+        return
+    try:
+        clean_name = process_upload(job.photo)
+    except PhotoRejected:
+        Branch.objects.filter(pk=job.branch_id, photo=job.photo).update(photo='', photo_pending=False)
+        bump_catalogue_version()
+        default_storage.delete(job.photo)
+        raise
+    with transaction.atomic():
+        branch = Branch.objects.select_for_update().filter(pk=job.branch_id, photo=job.photo).first()
+        if branch is None:
+            delete_photo(clean_name)
+            return
+        branch.photo = clean_name
+        branch.photo_pending = False
+        branch._photo_from_worker = True
+        branch.save(update_fields=['photo', 'photo_pending', 'updated_at'])
+    # у сырой загрузки копий нет: удаляем только ее, копии обработанного фото остаются
+    default_storage.delete(job.photo)
+
+
+def finish(job, status, error=''):
+    PhotoJob.objects.filter(pk=job.pk).update(status=status, error=error, finished_at=timezone.now())
+
+
+def run_photo_job(job_id):
+    now = timezone.now()
+    started = PhotoJob.objects.filter(pk=job_id, status=PhotoJob.Status.PENDING).update(
+        status=PhotoJob.Status.RUNNING, started_at=now, attempts=F('attempts') + 1
+    )
+    if not started:
+        return
+    job = PhotoJob.objects.get(pk=job_id)
+    registry.observe('photo', {'mfc_job_wait_seconds': (now - job.created_at).total_seconds()}, label='queue')
+    clock = time.perf_counter()
+    try:
+        if job.old_photo:
+            delete_photo(job.old_photo)
+        if job.photo:
+            apply_photo(job)
+    except PhotoRejected as e:
+        # плохой файл не исправится от повтора
+        finish(job, PhotoJob.Status.FAILED, str(e))
+    except Exception as e:
+        if job.attempts < get_max_attempts():
+            delay = get_retry_delay(job.attempts)
+            PhotoJob.objects.filter(pk=job.pk).update(
+                status=PhotoJob.Status.PENDING, error=str(e), run_after=timezone.now() + timedelta(seconds=delay)
+            )
+            schedule_retry(job.pk, delay)
+        else:
+            finish(job, PhotoJob.Status.FAILED, str(e))
+            # фото остается необработанным, но заглушку убираем
+            Branch.objects.filter(pk=job.branch_id, photo=job.photo).update(photo_pending=False)
+            bump_catalogue_version()
+    else:
+        finish(job, PhotoJob.Status.DONE)
+    registry.observe('photo', {'mfc_job_duration_seconds': time.perf_counter() - clock}, label='queue')
+
+
+def retry_job(job):
+    # ручной повтор упавшей задачи из админки
+    retried = PhotoJob.objects.filter(pk=job.pk, status=PhotoJob.Status.FAILED).update(
+        status=PhotoJob.Status.PENDING, attempts=0, error='', run_after=timezone.now(), finished_at=None
+    )
+    if not retried:
+        return False
+    if job.photo:
+        Branch.objects.filter(pk=job.branch_id, photo=job.photo).update(photo_pending=True)
+    transaction.on_commit(lambda: submit(job.pk))
+    return True
+
+
+def run_due_jobs():
+    # для manage.py process_photo_jobs: подхватывает задачи после перезапуска
+    # процесса и повторы, таймер которых пропал вместе с процессом
+    now = timezone.now()
+    PhotoJob.objects.filter(status=PhotoJob.Status.RUNNING, started_at__lt=now - STALE_AFTER).update(
+        status=PhotoJob.Status.PENDING
+    )
+    done = 0
+    due = PhotoJob.objects.filter(status=PhotoJob.Status.PENDING, run_after__lte=now).order_by('pk')
+    for job_id in due.values_list('pk', flat=True):
+        run_photo_job(job_id)
+        done += 1
+    return done
+
+
+def queue_metrics():
+    # глубина очереди для /metrics/
+    counts = dict(PhotoJob.objects.values_list('status').annotate(count=Count('id')).order_by())
+    lines = [
+        '# HELP mfc_photo_jobs Задачи обработки фото по статусам',
+        '# TYPE mfc_photo_jobs gauge',
+    ]
+    for status in PhotoJob.Status.values:
+        lines.append(f'mfc_photo_jobs{{status="{status}"}} {counts.get(status, 0)}')
+    return lines
+
+
+registry.add_collector(queue_metrics)
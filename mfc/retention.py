@@ -0,0 +1,123 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+from glob import glob
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Appointment, Branch, Service
+
+HISTORY_MODELS = {
+    'branch': Branch,
+    'service': Service,
+    'appointment': Appointment,
+}
+# у записей на прием сохраняем каждую смену статуса
+TRANSITION_FIELDS = {
+    'appointment': 'status',
+}
+ARCHIVE_BATCH_SIZE = 2000
+
+
+class CompactionResult:
+    def __init__(self, name):
+        self.name = name
+        self.kept = 0
+        self.archived = 0
+        self.path = None
+
+
+def get_archive_dir():
+    return getattr(settings, 'MFC_HISTORY_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'history_archive'))
+
+
+def classify_rows(history_model, cutoff, transition_field=None, batch_size=ARCHIVE_BATCH_SIZE):
+    # старые версии по объектам в порядке времени; на каждую строку — оставить ли ее в базе.
+    # в памяти только предыдущая строка, поэтому объем таблицы не важен
+    newest = history_model.objects.filter(id=OuterRef('id')).order_by(
+        '-history_date', '-history_id'
+    ).values('history_id')[:1]
+    rows = history_model.objects.filter(history_date__lt=cutoff).annotate(
+        newest_history_id=Subquery(newest)
+    ).order_by('id', 'history_date', 'history_id').values()
+
+    previous = None
+    for row in rows.iterator(chunk_size=batch_size):
+        first = previous is None or previous['id'] != row['id']
+        keep = (
+            first
+            or row['history_id'] == row['newest_history_id']
+            or (transition_field and row[transition_field] != previous[transition_field])
+        )
+        previous = row
+        yield row, keep
+
+
+def compact_history(name, days, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False):
+    history_model = HISTORY_MODELS[name].history.model
+    cutoff = timezone.now() - timedelta(days=days)
+    result = CompactionResult(name)
+
+    directory = get_archive_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{name}-{timezone.now():%Y%m%d-%H%M%S-%f}.jsonl.gz')
+    partial = f'{path}.part'
+    with gzip.open(partial, 'wt', encoding='utf-8') as archive:
+        for row, keep in classify_rows(history_model, cutoff, TRANSITION_FIELDS.get(name), batch_size):
+            if keep:
+                result.kept += 1
+                continue
+            del row['newest_history_id']
+            archive.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+            result.archived += 1
+
+    if dry_run or not result.archived:
+        os.remove(partial)
+        return result
+    # удаляем из базы только после того, как архив целиком записан на диск
+    os.replace(partial, path)
+    result.path = path
+    delete_archived(history_model, path, batch_size)
+    return result
+
+
+def read_archive(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            yield json.loads(line)
+
+
+def delete_archived(history_model, path, batch_size=ARCHIVE_BATCH_SIZE):
+    # id удаляемых строк читаем обратно из архива, а не держим в памяти
+    batch = []
+    for row in read_archive(path):
+        batch.append(row['history_id'])
+        if len(batch) == batch_size:
+            with transaction.atomic():
+                history_model.objects.filter(history_id__in=batch).delete()
+            batch = []
+    with transaction.atomic():
+        history_model.objects.filter(history_id__in=batch).delete()
+
+
+def restore_history(name, object_id):
+    # возвращает в базу архивные версии одного объекта; уже восстановленные пропускает
+    history_model = HISTORY_MODELS[name].history.model
+    fields = {field.attname: field for field in history_model._meta.concrete_fields}
+    seen = set(history_model.objects.filter(id=object_id).values_list('history_id', flat=True))
+    restored = []
+    for path in sorted(glob(os.path.join(get_archive_dir(), f'{name}-*.jsonl.gz'))):
+        for row in read_archive(path):
+            if row['id'] != object_id or row['history_id'] in seen:
+                continue
+            seen.add(row['history_id'])
+            restored.append(history_model(**{
+                attname: fields[attname].to_python(value) for attname, value in row.items()
+            }))
+    history_model.objects.bulk_create(restored)
+    return len(restored)
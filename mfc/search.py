@@ -0,0 +1,208 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Branch, BranchService, Service
+
+BRANCH_TABLE = 'mfc_branch_search'
+SERVICE_TABLE = 'mfc_service_search'
+
+# окончания для грубого стемминга: "паспорта" ищется как "паспорт*"
+ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ом', 'ем', 'ам', 'ям',
+    'ах', 'ях', 'ов', 'ев', 'ей', 'ию', 'ия', 'ью',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+MIN_STEM = 4
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+def stem(word):
+    if not re.search('[а-я]', word):
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(query):
+    return [stem(word) for word in re.findall(r'\w+', normalize(query))]
+
+
+def is_sqlite():
+    return connection.vendor == 'sqlite'
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+# ---------- индекс ----------
+
+def create_index(schema_editor):
+    # вызывается из миграции; для SQLite отдельные FTS5 таблицы, для PostgreSQL
+    # GIN индексы по tsvector, остальные базы ищут через icontains
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        tokenizer = "tokenize = 'unicode61 remove_diacritics 2'"
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {BRANCH_TABLE} USING fts5(name, address, services, {tokenizer})'
+        )
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {SERVICE_TABLE} USING fts5(name, {tokenizer})'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS mfc_branch_fts_idx ON mfc_branch "
+            "USING gin (to_tsvector('russian', name || ' ' || address))"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS mfc_service_fts_idx ON mfc_service "
+            "USING gin (to_tsvector('russian', name))"
+        )
+
+
+def drop_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {BRANCH_TABLE}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SERVICE_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS mfc_branch_fts_idx')
+        schema_editor.execute('DROP INDEX IF EXISTS mfc_service_fts_idx')
+
+
+def index_branches(branch_ids):
+    # PostgreSQL держит индекс сам, синхронизировать нужно только FTS5
+    if not is_sqlite():
+        return
+    branch_ids = list(branch_ids)
+    if not branch_ids:
+        return
+    services = {}
+    links = BranchService.objects.filter(branch_id__in=branch_ids).values_list('branch_id', 'service__name')
+    for branch_id, service_name in links:
+        services.setdefault(branch_id, []).append(normalize(service_name))
+    rows = [
+        (pk, normalize(name), normalize(address), ' '.join(services.get(pk, [])))
+        for pk, name, address in Branch.objects.filter(pk__in=branch_ids).values_list('pk', 'name', 'address')
+    ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(branch_ids), 500):
+            chunk = branch_ids[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {BRANCH_TABLE} WHERE rowid IN ({placeholders})', chunk)
+        cursor.executemany(
+            f'INSERT INTO {BRANCH_TABLE} (rowid, name, address, services) VALUES (%s, %s, %s, %s)', rows
+        )
+
+
+def index_services(service_ids):
+    if not is_sqlite():
+        return
+    service_ids = list(service_ids)
+    if not service_ids:
+        return
+    rows = [
+        (pk, normalize(name))
+        for pk, name in Service.objects.filter(pk__in=service_ids).values_list('pk', 'name')
+    ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(service_ids), 500):
+            chunk = service_ids[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {SERVICE_TABLE} WHERE rowid IN ({placeholders})', chunk)
+        cursor.executemany(f'INSERT INTO {SERVICE_TABLE} (rowid, name) VALUES (%s, %s)', rows)
+
+
+def rebuild_index(batch_size=2000):
+    if not is_sqlite():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {BRANCH_TABLE}')
+        cursor.execute(f'DELETE FROM {SERVICE_TABLE}')
+    for model, index in ((Branch, index_branches), (Service, index_services)):
+        ids = model.objects.order_by('pk').values_list('pk', flat=True)
+        batch = []
+        for pk in ids.iterator(chunk_size=batch_size):
+            batch.append(pk)
+            if len(batch) == batch_size:
+                index(batch)
+                batch = []
+        index(batch)
+
+
+# ---------- поиск ----------
+
+def search_branches(queryset, query):
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset
+    if is_sqlite():
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {BRANCH_TABLE} WHERE {BRANCH_TABLE} MATCH %s', [match]
+        ))
+    if is_postgresql():
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        return queryset.filter(pk__in=RawSQL(
+            "SELECT id FROM mfc_branch "
+            "WHERE to_tsvector('russian', name || ' ' || address) @@ to_tsquery('russian', %s) "
+            "UNION SELECT bs.branch_id FROM mfc_branchservice bs JOIN mfc_service s ON s.id = bs.service_id "
+            "WHERE to_tsvector('russian', s.name) @@ to_tsquery('russian', %s)",
+            [tsquery, tsquery]
+        ))
+    condition = Q()
+    for token in tokens:
+        condition &= (
+            Q(name__icontains=token) | Q(address__icontains=token)
+            | Q(branch_services__service__name__icontains=token)
+        )
+    return queryset.filter(pk__in=Branch.objects.filter(condition).values('pk'))
+
+
+def search_services(queryset, query):
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset
+    if is_sqlite():
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {SERVICE_TABLE} WHERE {SERVICE_TABLE} MATCH %s', [match]
+        ))
+    if is_postgresql():
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        return queryset.filter(pk__in=RawSQL(
+            "SELECT id FROM mfc_service WHERE to_tsvector('russian', name) @@ to_tsquery('russian', %s)",
+            [tsquery]
+        ))
+    condition = Q()
+    for token in tokens:
+        condition &= Q(name__icontains=token)
+    return queryset.filter(condition)
+
+
+SEARCH_FUNCTIONS = {
+    Branch: search_branches,
+    Service: search_services,
+}
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    # ?search=... для списков отделений и услуг через полнотекстовый индекс
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        search = SEARCH_FUNCTIONS.get(queryset.model)
+        if not query or search is None:
+            return queryset
+        return search(queryset, query)
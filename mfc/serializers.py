@@ -1,8 +1,19 @@
 from rest_framework import serializers
 from django.core.validators import EmailValidator, RegexValidator
-from .models import Branch, Service
+from .counters import edited_fields
+from .models import Appointment, Branch, ChunkedUpload, Service
 
-class BranchSerializer(serializers.ModelSerializer):
+
+class EditedFieldsMixin:
+    # PUT/PATCH сохраняет только поля из запроса, счетчики в базе не перезаписываются
+    def update(self, instance, validated_data):
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        instance.save(update_fields=edited_fields(validated_data))
+        return instance
+
+
+class BranchSerializer(EditedFieldsMixin, serializers.ModelSerializer):
     phone = serializers.CharField(
         validators=[
             RegexValidator(
@@ -27,25 +38,32 @@ class BranchSerializer(serializers.ModelSerializer):
         }
     )
 
-    active_services_count = serializers.IntegerField(read_only=True)
+    active_services_count = serializers.SerializerMethodField(read_only=True)
 
     photo_url = serializers.SerializerMethodField(read_only=True)
+    photo_variants = serializers.SerializerMethodField(read_only=True)
     services_count = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Branch
         fields = [
             'id', 'name', 'address', 'phone', 'email', 
-            'photo', 'photo_url', 'work_schedule', 'is_active',
+            'photo', 'photo_url', 'photo_variants', 'photo_pending', 'work_schedule', 'is_active',
             'created_at', 'updated_at',
             'services_count', 'active_services_count'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'photo_url']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'photo_url', 'photo_variants', 'photo_pending']
 
     def get_photo_url(self, obj):
         if obj.photo:
             return obj.photo.url
         return None
+
+    def get_photo_variants(self, obj):
+        # пока фото обрабатывается в фоне, вариантов еще нет
+        if obj.photo_pending:
+            return None
+        return obj.photo_variants
     
     def get_services_count(self, obj):
         context = self.context
@@ -53,7 +71,10 @@ class BranchSerializer(serializers.ModelSerializer):
         # если в контексте сказано не показывать услуги
         if not include_services:
             return None
-        return obj.branch_services.count()
+        return obj.services_count
+
+    def get_active_services_count(self, obj):
+        return obj.available_services_count
     
     def validate_work_schedule(self, value):
         if len(value) < 10:
@@ -77,7 +98,7 @@ class BranchSerializer(serializers.ModelSerializer):
             })
         return data
     
-class ServiceSerializer(serializers.ModelSerializer):
+class ServiceSerializer(EditedFieldsMixin, serializers.ModelSerializer):
     name = serializers.CharField(
         max_length=200,
         min_length=5,
@@ -119,7 +140,7 @@ class ServiceSerializer(serializers.ModelSerializer):
             return "Долго"
         
     def get_branches_count(self, obj):
-        return obj.branch_services.filter(is_available=True).count()
+        return obj.available_branches_count
 
     def validate_name(self, value):
         instance = self.instance
@@ -134,4 +155,65 @@ class ServiceSerializer(serializers.ModelSerializer):
                 "Услуга с таким названием уже существует"
             )
         
-        return value
\ No newline at end of file
+        return value
+
+class AppointmentSerializer(serializers.ModelSerializer):
+    # связанные объекты приходят через select_related во view, без запросов на строку
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    service_name = serializers.CharField(source='service.name', read_only=True)
+    branch_name = serializers.CharField(source='branch.name', read_only=True)
+    branch_address = serializers.CharField(source='branch.address', read_only=True)
+    client_name = serializers.CharField(source='user_profile.full_name', read_only=True)
+
+    class Meta:
+        model = Appointment
+        fields = [
+            'id', 'date', 'time', 'status', 'status_display',
+            'service', 'service_name', 'branch', 'branch_name', 'branch_address',
+            'client_name', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
+# элементы массовых операций: форма проверяется здесь, существование объектов — во view
+class BulkBranchActiveSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    # без значения статус переключается на противоположный
+    is_active = serializers.BooleanField(required=False)
+
+
+class BulkServiceDurationSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    duration_days = serializers.IntegerField(
+        min_value=1,
+        max_value=365,
+        error_messages={
+            'min_value': 'Срок выполнения не может быть меньше 1 дня',
+            'max_value': 'Срок выполнения не может превышать 365 дней'
+        }
+    )
+
+
+class BulkAvailabilitySerializer(serializers.Serializer):
+    branch = serializers.IntegerField()
+    service = serializers.IntegerField()
+    is_available = serializers.BooleanField()
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    size = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = ChunkedUpload
+        fields = [
+            'token', 'purpose', 'branch', 'import_kind', 'filename', 'size',
+            'offset', 'status', 'error', 'result', 'created_at', 'updated_at',
+        ]
+        read_only_fields = ['token', 'offset', 'status', 'error', 'result', 'created_at', 'updated_at']
+
+    def validate(self, data):
+        if data['purpose'] == ChunkedUpload.Purpose.PHOTO and not data.get('branch'):
+            raise serializers.ValidationError({'branch': 'Укажите отделение для фото'})
+        if data['purpose'] == ChunkedUpload.Purpose.IMPORT and not data.get('import_kind'):
+            raise serializers.ValidationError({'import_kind': 'Укажите, что импортировать'})
+        return data
@@ -0,0 +1,199 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .booking import holds_seat, refresh_slot_capacities, release_seat, slot_start, take_seat
+from .cache import bump_catalogue_version
+from .counters import refresh_branch_counters, refresh_service_counters
+from .daily_stats import add_to_stats, stat_key
+from .models import Appointment, Branch, BranchService, Service, SlotCapacity
+from .photo_jobs import enqueue_photo_job
+from .search import index_branches, index_services
+
+
+def appointment_seat(branch_id, service_id, date, value, status):
+    # место в слоте, которое занимает запись, или None для отмененных
+    if not holds_seat(status):
+        return None
+    date = Appointment._meta.get_field('date').to_python(date)
+    value = Appointment._meta.get_field('time').to_python(value)
+    return (branch_id, service_id, date, slot_start(value))
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_appointment_seat(sender, instance, raw=False, **kwargs):
+    instance._old_seat = None
+    instance._old_stat = None
+    if raw or instance.pk is None:
+        return
+    old = Appointment.objects.filter(pk=instance.pk).values_list(
+        'branch_id', 'service_id', 'date', 'time', 'status'
+    ).first()
+    if old:
+        instance._old_seat = appointment_seat(*old)
+        instance._old_stat = stat_key(*old)
+
+
+@receiver(post_save, sender=Appointment)
+def sync_appointment_seat(sender, instance, created, raw=False, **kwargs):
+    # записи из админки и смена статуса (отмена, неявка) тоже двигают счетчик слота
+    if raw:
+        return
+    if getattr(instance, '_slot_reserved', False):
+        instance._slot_reserved = False
+        return
+    old_seat = getattr(instance, '_old_seat', None)
+    new_seat = appointment_seat(
+        instance.branch_id, instance.service_id, instance.date, instance.time, instance.status
+    )
+    if old_seat == new_seat:
+        return
+    if old_seat is not None:
+        release_seat(*old_seat)
+    if new_seat is not None:
+        # сотрудник может записать сверх вместимости, поэтому без проверки мест
+        take_seat(*new_seat, check_capacity=False)
+
+
+@receiver(post_delete, sender=Appointment)
+def release_deleted_appointment_seat(sender, instance, **kwargs):
+    seat = appointment_seat(
+        instance.branch_id, instance.service_id, instance.date, instance.time, instance.status
+    )
+    if seat is not None:
+        release_seat(*seat)
+
+
+@receiver(post_save, sender=Appointment)
+def sync_daily_stats(sender, instance, created, raw=False, **kwargs):
+    # смена статуса переносит запись из одной строки сводки в другую
+    if raw:
+        return
+    old_stat = getattr(instance, '_old_stat', None)
+    new_stat = stat_key(
+        instance.branch_id, instance.service_id, instance.date, instance.time, instance.status
+    )
+    if old_stat == new_stat:
+        return
+    if old_stat is not None:
+        add_to_stats(old_stat, -1)
+    add_to_stats(new_stat, 1)
+
+
+@receiver(post_delete, sender=Appointment)
+def remove_deleted_appointment_stat(sender, instance, **kwargs):
+    add_to_stats(
+        stat_key(instance.branch_id, instance.service_id, instance.date, instance.time, instance.status), -1
+    )
+
+
+@receiver(post_save, sender=SlotCapacity)
+@receiver(post_delete, sender=SlotCapacity)
+def refresh_capacities(sender, instance, **kwargs):
+    refresh_slot_capacities(instance.branch_id)
+
+
+@receiver(post_save, sender=Branch)
+@receiver(post_delete, sender=Branch)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=BranchService)
+@receiver(post_delete, sender=BranchService)
+def invalidate_catalogue(sender, **kwargs):
+    # сохранения из админки (в том числе инлайны) проходят через эти же сигналы
+    bump_catalogue_version()
+
+
+@receiver(pre_save, sender=BranchService)
+def remember_branch_service_links(sender, instance, raw=False, **kwargs):
+    instance._old_link = None
+    if not raw and instance.pk is not None:
+        instance._old_link = BranchService.objects.filter(pk=instance.pk).values_list(
+            'branch_id', 'service_id'
+        ).first()
+
+
+@receiver(post_save, sender=BranchService)
+@receiver(post_delete, sender=BranchService)
+def refresh_link_counters(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    branch_ids = {instance.branch_id}
+    service_ids = {instance.service_id}
+    old_link = getattr(instance, '_old_link', None)
+    if old_link:
+        branch_ids.add(old_link[0])
+        service_ids.add(old_link[1])
+    refresh_branch_counters(branch_ids)
+    refresh_service_counters(service_ids)
+
+
+@receiver(post_save, sender=Service)
+def refresh_duration_counters(sender, instance, created, raw=False, **kwargs):
+    # средний срок отделений зависит от duration_days услуги
+    if raw or created:
+        return
+    refresh_branch_counters(
+        BranchService.objects.filter(service=instance).values_list('branch_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Branch)
+@receiver(post_delete, sender=Branch)
+def reindex_branch(sender, instance, raw=False, **kwargs):
+    # удаленное отделение просто не найдется в базе и уйдет из индекса
+    if not raw:
+        index_branches([instance.pk])
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def reindex_service(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    index_services([instance.pk])
+    if not created:
+        # название услуги входит в документ каждого отделения, где она есть
+        index_branches(BranchService.objects.filter(service=instance).values_list('branch_id', flat=True))
+
+
+@receiver(post_save, sender=BranchService)
+@receiver(post_delete, sender=BranchService)
+def reindex_branch_services(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    branch_ids = {instance.branch_id}
+    old_link = getattr(instance, '_old_link', None)
+    if old_link:
+        branch_ids.add(old_link[0])
+    index_branches(branch_ids)
+
+
+@receiver(pre_save, sender=Branch)
+def remember_branch_photo(sender, instance, raw=False, **kwargs):
+    instance._old_photo = None
+    if raw or getattr(instance, '_photo_from_worker', False):
+        return
+    if instance.pk is not None:
+        instance._old_photo = Branch.objects.filter(pk=instance.pk).values_list('photo', flat=True).first()
+    if (instance._old_photo or '') != (instance.photo.name or ''):
+        # пока воркер не обработал новое фото, вместо него показывается заглушка
+        instance.photo_pending = bool(instance.photo)
+
+
+@receiver(post_save, sender=Branch)
+def queue_photo_processing(sender, instance, raw=False, **kwargs):
+    # к этому моменту загрузка уже сохранена в хранилище; проверка, перекодирование,
+    # уменьшенные копии и удаление старого файла идут в фоне (mfc.photo_jobs)
+    if raw or getattr(instance, '_photo_from_worker', False):
+        instance._photo_from_worker = False
+        return
+    old_name = getattr(instance, '_old_photo', None) or ''
+    new_name = instance.photo.name or ''
+    if old_name != new_name:
+        enqueue_photo_job(instance.pk, photo=new_name, old_photo=old_name)
+
+
+@receiver(post_delete, sender=Branch)
+def queue_photo_deletion(sender, instance, **kwargs):
+    if instance.photo:
+        enqueue_photo_job(None, old_photo=instance.photo.name)
@@ -0,0 +1,196 @@
+import hashlib
+import logging
+import re
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .metrics import view_name
+from .models import SlowQuery
+
+logger = logging.getLogger('mfc.slow_queries')
+
+# EXPLAIN без ANALYZE запрос не выполняет, но пишущие INSERT не разбираем
+EXPLAINED_STATEMENTS = ('select', 'with', 'update', 'delete')
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST = re.compile(r'\bIN \((?:\s*\?\s*,?)+\)', re.IGNORECASE)
+SPACES = re.compile(r'\s+')
+
+_log = ContextVar('mfc_slow_query_log', default=None)
+
+
+def get_threshold_ms():
+    # None выключает журнал
+    return getattr(settings, 'MFC_SLOW_QUERY_MS', 100)
+
+
+def normalize(sql):
+    # слепок: без литералов и длины списков IN, чтобы одинаковые запросы складывались
+    sql = STRING.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    sql = SPACES.sub(' ', sql.replace('%s', '?'))
+    return IN_LIST.sub('IN (...)', sql).strip()
+
+
+def redact(sql, params):
+    # в журнал не попадают значения: ни параметры (email, телефоны, токены),
+    # ни строковые литералы; от параметров остаются только типы
+    sql = STRING.sub("'?'", sql)
+    if not params:
+        return sql
+    values = params.values() if isinstance(params, dict) else params
+    return f'{sql}\n-- параметры: {", ".join(type(value).__name__ for value in values)}'
+
+
+def fingerprint(normalized):
+    return hashlib.md5(normalized.encode()).hexdigest()
+
+
+def format_plan(rows):
+    if connection.vendor != 'sqlite':
+        # EXPLAIN в PostgreSQL и MySQL подставляет значения параметров в условия
+        return STRING.sub("'?'", '\n'.join(' '.join(str(value) for value in row) for row in rows))
+    # EXPLAIN QUERY PLAN: (id, parent, notused, detail), вложенность по parent
+    depth = {}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return '\n'.join(lines)
+
+
+def explain(sql, params, many):
+    if many or not sql.lstrip().lower().startswith(EXPLAINED_STATEMENTS):
+        return ''
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        # точка сохранения: ошибка EXPLAIN не должна сломать текущую транзакцию
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return format_plan(cursor.fetchall())
+    except DatabaseError:
+        logger.warning('Не удалось получить план запроса: %s', sql, exc_info=True)
+        return ''
+
+
+class SlowQueryLog:
+    # обертка connection.execute_wrapper: запоминает запросы дольше порога
+    def __init__(self, threshold_ms):
+        self.threshold = threshold_ms / 1000
+        self.entries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            if elapsed >= self.threshold:
+                self.entries.append((sql, params, many, elapsed))
+
+    def flush(self, view):
+        for sql, params, many, elapsed in self.entries:
+            record(view, sql, params, many, elapsed * 1000)
+        self.entries = []
+
+
+def logged_execute(execute, sql, params, many, context):
+    log = _log.get()
+    if log is None:
+        return execute(sql, params, many, context)
+    return log(execute, sql, params, many, context)
+
+
+def install_execute_wrapper(sender, connection, **kwargs):
+    # как в mfc.metrics: одна обертка на соединение, журнал текущего запроса в ContextVar
+    if logged_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(logged_execute)
+
+
+def record(view, sql, params, many, ms):
+    normalized = normalize(sql)
+    key = fingerprint(normalized)
+    logger.warning('Медленный запрос %.1f мс в %s: %s', ms, view, normalized)
+
+    def add_call():
+        return SlowQuery.objects.filter(fingerprint=key, view=view).update(
+            calls=F('calls') + 1,
+            total_time=F('total_time') + ms,
+            max_time=Greatest('max_time', Value(ms, output_field=FloatField())),
+            last_seen=timezone.now(),
+        )
+
+    if add_call():
+        return
+    # план снимаем один раз на слепок, другие view берут его из уже сохраненной строки
+    plan = SlowQuery.objects.filter(fingerprint=key).exclude(plan='').values_list('plan', flat=True).first()
+    if plan is None:
+        plan = explain(sql, params, many)
+    example = redact(sql, params)
+    _, created = SlowQuery.objects.get_or_create(fingerprint=key, view=view, defaults={
+        'sql': normalized,
+        'example': example[:10000],
+        'plan': plan,
+        'calls': 1,
+        'total_time': ms,
+        'max_time': ms,
+    })
+    if not created:
+        add_call()
+
+
+class SlowQueryMiddleware:
+    # запросы дольше MFC_SLOW_QUERY_MS мс сохраняются в SlowQuery после ответа,
+    # когда уже известен view
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        threshold = get_threshold_ms()
+        if threshold is None:
+            return self.get_response(request)
+        log = SlowQueryLog(threshold)
+        token = _log.set(log)
+        try:
+            response = self.get_response(request)
+        finally:
+            _log.reset(token)
+        if log.entries:
+            save_log(log, view_name(request))
+        return response
+
+    async def __acall__(self, request):
+        threshold = get_threshold_ms()
+        if threshold is None:
+            return await self.get_response(request)
+        log = SlowQueryLog(threshold)
+        token = _log.set(log)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _log.reset(token)
+        if log.entries:
+            await sync_to_async(save_log)(log, view_name(request))
+        return response
+
+
+def save_log(log, view):
+    try:
+        log.flush(view)
+    except DatabaseError:
+        logger.exception('Не удалось сохранить медленные запросы')
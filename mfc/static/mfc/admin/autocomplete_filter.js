@@ -0,0 +1,15 @@
+'use strict';
+// фильтр списка в админке: выбор значения в autocomplete сразу применяет фильтр
+{
+    const $ = django.jQuery;
+
+    $(function() {
+        $('.mfc-autocomplete-filter').on('change', function() {
+            if (this.value) {
+                window.location.href = this.dataset.urlTemplate.replace('__value__', encodeURIComponent(this.value));
+            } else {
+                window.location.href = this.dataset.clearUrl;
+            }
+        });
+    });
+}
@@ -0,0 +1,16 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+class ExportStorage(FileSystemStorage):
+    # выгрузки лежат вне MEDIA_ROOT и не раздаются как статика: файл отдает
+    # только админка после проверки владельца (ExportJobAdmin.download_view)
+    @property
+    def base_location(self):
+        return getattr(settings, 'MFC_EXPORT_DIR', os.path.join(settings.BASE_DIR, 'exports'))
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
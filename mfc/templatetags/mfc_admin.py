@@ -0,0 +1,87 @@
+import datetime
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.utils import get_fields_from_path
+from django.db import models
+from django.utils import formats
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+register = template.Library()
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def index_date_hierarchy(cl):
+    # как стандартный date_hierarchy, но годы и месяцы берутся из MIN/MAX по
+    # индексу даты, а не из SELECT DISTINCT по всей таблице; дни — только
+    # внутри выбранного месяца
+    field_name = cl.date_hierarchy
+    if isinstance(get_fields_from_path(cl.model, field_name)[-1], models.DateTimeField):
+        return date_hierarchy(cl)
+
+    year_field = f'{field_name}__year'
+    month_field = f'{field_name}__month'
+    day_field = f'{field_name}__day'
+    year_lookup = cl.params.get(year_field)
+    month_lookup = cl.params.get(month_field)
+    day_lookup = cl.params.get(day_field)
+
+    def link(filters):
+        return cl.get_query_string(filters, [f'{field_name}__'])
+
+    date_range = None
+    if not day_lookup:
+        date_range = cl.queryset.aggregate(first=models.Min(field_name), last=models.Max(field_name))
+        if not (date_range['first'] and date_range['last']):
+            return {'show': True, 'back': None, 'choices': []}
+        first, last = date_range['first'], date_range['last']
+        if not year_lookup and first.year == last.year:
+            year_lookup = first.year
+        if year_lookup and not month_lookup and first.month == last.month:
+            month_lookup = first.month
+
+    if year_lookup and month_lookup and day_lookup:
+        day = datetime.date(int(year_lookup), int(month_lookup), int(day_lookup))
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year_lookup, month_field: month_lookup}),
+                'title': capfirst(formats.date_format(day, 'YEAR_MONTH_FORMAT')),
+            },
+            'choices': [{'title': capfirst(formats.date_format(day, 'MONTH_DAY_FORMAT'))}],
+        }
+    if year_lookup and month_lookup:
+        days = cl.queryset.dates(field_name, 'day')
+        return {
+            'show': True,
+            'back': {'link': link({year_field: year_lookup}), 'title': str(year_lookup)},
+            'choices': [
+                {
+                    'link': link({year_field: year_lookup, month_field: month_lookup, day_field: day.day}),
+                    'title': capfirst(formats.date_format(day, 'MONTH_DAY_FORMAT')),
+                }
+                for day in days
+            ],
+        }
+    if year_lookup:
+        months = [datetime.date(int(year_lookup), month, 1) for month in range(first.month, last.month + 1)]
+        return {
+            'show': True,
+            'back': {'link': link({}), 'title': _('All dates')},
+            'choices': [
+                {
+                    'link': link({year_field: year_lookup, month_field: month.month}),
+                    'title': capfirst(formats.date_format(month, 'YEAR_MONTH_FORMAT')),
+                }
+                for month in months
+            ],
+        }
+    return {
+        'show': True,
+        'back': None,
+        'choices': [
+            {'link': link({year_field: str(year)}), 'title': str(year)}
+            for year in range(first.year, last.year + 1)
+        ],
+    }
@@ -1,3 +1,1705 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from datetime import time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models.signals import pre_save
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .admin import BranchAdmin
+from .benchmarks import build_context, compare_reports
+from .booking import SlotUnavailable, reserve_appointment
+from .counters import defer_counters, find_counter_mismatches
+from .counts import COUNT_QUERIES_KEY, approximate_count, refresh_statistics
+from .daily_stats import get_branch_stats, rebuild_daily_stats
+from .export_jobs import cancel_export, run_export_job
+from .generators import LoadDataGenerator
+from .history import history_batch
+from .images import delete_photo, variant_name, variant_names
+from .imports import ModelImporter, run_import
+from .metrics import registry
+from .photo_jobs import run_due_jobs, run_photo_job
+from .search import search_branches
+from .slow_queries import normalize, record
+from .uploads import run_import_job, write_chunk
+from .resources import BranchResource
+from .retention import compact_history, restore_history
+from .models import (
+    Appointment, AppointmentDailyStat, AppointmentSlot, Branch, BranchService, ChunkedUpload, Employee, ExportJob,
+    PhotoJob, Service, SlotCapacity, SlowQuery, UserProfile,
+)
+
+
+def create_branch(number, **kwargs):
+    data = {
+        'name': f'Отделение {number:05d}',
+        'address': f'г. Москва, ул. Тестовая, д. {number}',
+        'phone': '+7 (495) 123-45-67',
+        'email': f'office{number}@mfc.ru',
+        'work_schedule': 'Пн-Пт 9:00-18:00',
+    }
+    data.update(kwargs)
+    return Branch.objects.create(**data)
+
+
+def create_service(number, **kwargs):
+    data = {
+        'name': f'Услуга номер {number:05d}',
+        'category': Service.Category.DOCUMENTS,
+        'duration_days': 5,
+    }
+    data.update(kwargs)
+    return Service.objects.create(**data)
+
+
+def create_client_profile(number):
+    user = User.objects.create_user(username=f'client{number}')
+    return UserProfile.objects.create(
+        user=user,
+        full_name=f'Клиент {number}',
+        email=f'client{number}@example.com',
+        phone='89001234567',
+    )
+
+
+class ListQueryCountTests(TestCase):
+    # количество запросов на страницу не должно зависеть от числа строк на ней
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.services = [create_service(i) for i in range(3)]
+        cls.branches = [create_branch(i) for i in range(3)]
+        for branch in cls.branches:
+            for service in cls.services:
+                BranchService.objects.create(branch=branch, service=service)
+
+    def add_rows(self, count):
+        start = len(self.branches) + 100
+        for i in range(start, start + count):
+            branch = create_branch(i)
+            service = create_service(i)
+            BranchService.objects.create(branch=branch, service=service, is_available=False)
+            BranchService.objects.create(branch=branch, service=self.services[0])
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+    def assert_constant_queries(self, url):
+        small, _ = self.count_queries(url)
+        self.add_rows(10)
+        full, data = self.count_queries(url)
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(small, full)
+
+    def test_branch_list_queries(self):
+        self.assert_constant_queries('/api/branches/')
+
+    def test_branch_active_queries(self):
+        self.assert_constant_queries('/api/branches/active/')
+
+    def test_branch_complex_search_queries(self):
+        self.assert_constant_queries('/api/branches/complex_search/?query=Отделение')
+
+    def test_service_list_queries(self):
+        self.assert_constant_queries('/api/services/')
+
+    def test_service_fast_services_queries(self):
+        self.assert_constant_queries('/api/services/fast_services/')
+
+    def test_counts_match_relations(self):
+        _, data = self.count_queries('/api/branches/')
+        branch = data['results'][0]
+        self.assertEqual(branch['services_count'], 3)
+        self.assertEqual(branch['active_services_count'], 3)
+
+        _, data = self.count_queries('/api/services/')
+        self.assertEqual(data['results'][0]['branches_count'], 3)
+
+    def test_serializer_falls_back_without_annotation(self):
+        from .serializers import BranchSerializer, ServiceSerializer
+
+        branch = Branch.objects.get(pk=self.branches[0].pk)
+        data = BranchSerializer(branch).data
+        self.assertEqual(data['services_count'], 3)
+        self.assertEqual(data['active_services_count'], 3)
+
+        service = Service.objects.get(pk=self.services[0].pk)
+        self.assertEqual(ServiceSerializer(service).data['branches_count'], 3)
+
+
+@override_settings(MFC_DEFAULT_SLOT_CAPACITY=2)
+class SlotReservationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = create_branch(1)
+        cls.service = create_service(1)
+        BranchService.objects.create(branch=cls.branch, service=cls.service)
+        cls.profiles = [create_client_profile(i) for i in range(4)]
+        cls.day = timezone.localdate() + timedelta(days=1)
+
+    def reserve(self, profile, value=time(10, 0)):
+        return reserve_appointment(profile, self.service, self.branch, self.day, value)
+
+    def get_slot(self, value=time(10, 0)):
+        return AppointmentSlot.objects.get(branch=self.branch, service=self.service, date=self.day, time=value)
+
+    def test_reservation_stops_at_capacity(self):
+        self.reserve(self.profiles[0])
+        self.reserve(self.profiles[1], time(10, 15))
+        with self.assertRaises(SlotUnavailable):
+            self.reserve(self.profiles[2])
+        self.assertEqual(self.get_slot().booked, 2)
+        self.assertEqual(Appointment.objects.count(), 2)
+
+    def test_capacity_rule_overrides_default(self):
+        SlotCapacity.objects.create(branch=self.branch, service=self.service, time=time(10, 0), capacity=1)
+        self.reserve(self.profiles[0])
+        with self.assertRaises(SlotUnavailable):
+            self.reserve(self.profiles[1])
+        self.reserve(self.profiles[1], time(11, 0))
+
+    def test_capacity_rules_are_unique_with_empty_fields(self):
+        # пустые услуга и время тоже образуют ключ: второе такое же правило не создается
+        for service, value in [(None, time(10, 0)), (self.service, None), (None, None)]:
+            SlotCapacity.objects.create(branch=self.branch, service=service, time=value, capacity=1)
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                SlotCapacity.objects.create(branch=self.branch, service=service, time=value, capacity=2)
+        self.assertEqual(SlotCapacity.objects.count(), 3)
+
+    def test_cancel_releases_seat(self):
+        first = self.reserve(self.profiles[0])
+        self.reserve(self.profiles[1])
+        first.status = Appointment.Status.CANCELLED
+        first.save()
+        self.assertEqual(self.get_slot().booked, 1)
+        self.reserve(self.profiles[2])
+        self.assertEqual(self.get_slot().booked, 2)
+
+    def test_moving_and_deleting_appointment(self):
+        appointment = self.reserve(self.profiles[0])
+        appointment.time = time(12, 0)
+        appointment.save()
+        self.assertEqual(self.get_slot().booked, 0)
+        self.assertEqual(self.get_slot(time(12, 0)).booked, 1)
+        appointment.delete()
+        self.assertEqual(self.get_slot(time(12, 0)).booked, 0)
+
+    def test_view_rejects_full_slot(self):
+        SlotCapacity.objects.create(branch=self.branch, capacity=1)
+        self.reserve(self.profiles[0])
+        self.client.force_login(self.profiles[1].user)
+        response = self.client.post(f'/branches/{self.branch.pk}/appointment/', {
+            'service': self.service.pk,
+            'date': self.day.isoformat(),
+            'time': '10:00',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+@override_settings(MFC_DEFAULT_SLOT_CAPACITY=5)
+class ConcurrentReservationTests(TransactionTestCase):
+    # нагрузочный тест: много потоков одновременно бьются за последние места слота
+
+    workers = 40
+
+    def test_no_overbooking_under_contention(self):
+        branch = create_branch(1)
+        service = create_service(1)
+        profiles = [create_client_profile(i) for i in range(self.workers)]
+        day = timezone.localdate() + timedelta(days=1)
+        barrier = threading.Barrier(self.workers)
+        results = []
+
+        def book(profile):
+            barrier.wait()
+            try:
+                reserve_appointment(profile, service, branch, day, time(9, 30))
+                results.append('ok')
+            except SlotUnavailable:
+                results.append('full')
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=book, args=(profile,)) for profile in profiles]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('ok'), 5)
+        self.assertEqual(results.count('full'), self.workers - 5)
+        self.assertEqual(Appointment.objects.filter(branch=branch, date=day).count(), 5)
+        slot = AppointmentSlot.objects.get(branch=branch, service=service, date=day)
+        self.assertEqual(slot.booked, 5)
+
+
+@override_settings(MFC_DEFAULT_SLOT_CAPACITY=1)
+class AvailabilityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = create_branch(1)
+        cls.service = create_service(1)
+        cls.other_service = create_service(2)
+        BranchService.objects.create(branch=cls.branch, service=cls.service)
+        BranchService.objects.create(branch=cls.branch, service=cls.other_service, is_available=False)
+        cls.profile = create_client_profile(1)
+        cls.day = timezone.localdate() + timedelta(days=1)
+
+    def get_slots(self, **params):
+        params.setdefault('date_from', self.day.isoformat())
+        params.setdefault('date_to', self.day.isoformat())
+        response = self.client.get(f'/api/branches/{self.branch.pk}/availability/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['slots']
+
+    def test_full_day_grid_for_available_services(self):
+        slots = self.get_slots()
+        self.assertEqual(len(slots), 19)
+        self.assertEqual(slots[0]['time'], '09:00')
+        self.assertEqual(slots[-1]['time'], '18:00')
+        self.assertEqual({slot['service'] for slot in slots}, {self.service.pk})
+
+    def test_booking_and_cancel_update_open_slots(self):
+        self.get_slots()
+        appointment = reserve_appointment(self.profile, self.service, self.branch, self.day, time(9, 0))
+        self.assertNotIn('09:00', [slot['time'] for slot in self.get_slots()])
+
+        appointment.status = Appointment.Status.NO_SHOW
+        appointment.save()
+        self.assertIn('09:00', [slot['time'] for slot in self.get_slots()])
+
+    def test_read_does_not_write_slots(self):
+        SlotCapacity.objects.create(branch=self.branch, time=time(10, 0), capacity=3)
+        with CaptureQueriesContext(connection) as context:
+            slots = self.get_slots()
+        self.assertFalse(AppointmentSlot.objects.exists())
+        self.assertFalse(any(
+            query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE')) for query in context.captured_queries
+        ))
+        self.assertEqual([slot['free'] for slot in slots if slot['time'] == '10:00'], [3])
+
+        # строки, созданные записью, читаются как есть
+        reserve_appointment(self.profile, self.service, self.branch, self.day, time(10, 0))
+        slots = self.get_slots()
+        self.assertEqual([slot['free'] for slot in slots if slot['time'] == '10:00'], [2])
+        self.assertEqual(AppointmentSlot.objects.count(), 1)
+
+    def test_rejects_bad_dates(self):
+        response = self.client.get(f'/api/branches/{self.branch.pk}/availability/', {'date_from': 'завтра'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BranchListCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = create_branch(1)
+        cls.service = create_service(1)
+        cls.link = BranchService.objects.create(branch=cls.branch, service=cls.service)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeat_anonymous_hit_skips_database(self):
+        self.client.get('/')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertContains(response, self.branch.name)
+
+    def test_not_modified_until_catalogue_changes(self):
+        etag = self.client.get('/')['ETag']
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.link.is_available = False
+        self.link.save()
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_changes_are_visible_after_save_and_delete(self):
+        self.client.get('/')
+        self.service.branch_services.all().delete()
+        create_branch(2, name='Новое отделение')
+        response = self.client.get('/')
+        self.assertContains(response, 'Новое отделение')
+
+    def test_authenticated_users_get_fresh_page(self):
+        user = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(user)
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertContains(response, 'Добавить новое отделение')
+
+
+class ServiceCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = create_branch(1)
+        cls.other_branch = create_branch(2)
+        cls.fast = create_service(1, duration_days=2)
+        cls.slow = create_service(2, duration_days=7)
+
+    def assert_counters(self, branch, services, available, avg):
+        branch.refresh_from_db()
+        self.assertEqual(
+            (branch.services_count, branch.available_services_count, branch.avg_duration_days),
+            (services, available, avg),
+        )
+
+    def test_link_changes_keep_counters_exact(self):
+        link = BranchService.objects.create(branch=self.branch, service=self.fast)
+        BranchService.objects.create(branch=self.branch, service=self.slow, is_available=False)
+        self.assert_counters(self.branch, 2, 1, 5)
+        self.fast.refresh_from_db()
+        self.assertEqual(self.fast.available_branches_count, 1)
+
+        link.branch = self.other_branch
+        link.save()
+        self.assert_counters(self.branch, 1, 0, 7)
+        self.assert_counters(self.other_branch, 1, 1, 2)
+
+        link.delete()
+        self.assert_counters(self.other_branch, 0, 0, None)
+        self.assertEqual(find_counter_mismatches(), [])
+
+    def test_duration_change_updates_average(self):
+        BranchService.objects.create(branch=self.branch, service=self.fast)
+        self.fast.duration_days = 10
+        self.fast.save()
+        self.assert_counters(self.branch, 1, 1, 10)
+
+    def test_deferred_refresh_runs_once(self):
+        with defer_counters():
+            BranchService.objects.create(branch=self.branch, service=self.fast)
+            BranchService.objects.create(branch=self.branch, service=self.slow)
+            self.assert_counters(self.branch, 0, 0, None)
+        self.assert_counters(self.branch, 2, 2, 5)
+
+    def test_branch_edits_do_not_write_counters(self):
+        BranchService.objects.create(branch=self.branch, service=self.fast)
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+        with CaptureQueriesContext(connection) as captured:
+            self.client.post(f'/api/branches/{self.branch.pk}/toggle_active/')
+            self.client.post(f'/branches/{self.branch.pk}/edit/', {
+                'name': 'Новое название',
+                'address': self.branch.address,
+                'phone': self.branch.phone,
+                'email': self.branch.email,
+                'work_schedule': self.branch.work_schedule,
+            })
+        updates = [
+            query['sql'] for query in captured.captured_queries if query['sql'].startswith('UPDATE "mfc_branch"')
+        ]
+        self.assertEqual(len(updates), 2)
+        self.assertFalse(any('services_count' in sql for sql in updates))
+        self.branch.refresh_from_db()
+        self.assertEqual(self.branch.name, 'Новое название')
+        self.assert_counters(self.branch, 1, 1, 2)
+
+    def test_edits_keep_counters_refreshed_meanwhile(self):
+        def concurrent_refresh(sender, instance, **kwargs):
+            # пока объект был загружен, сигналы BranchService успели пересчитать счетчики
+            field = 'available_branches_count' if sender is Service else 'services_count'
+            sender.objects.filter(pk=instance.pk).update(**{field: 7})
+
+        for model in (Branch, Service):
+            pre_save.connect(concurrent_refresh, sender=model)
+            self.addCleanup(pre_save.disconnect, concurrent_refresh, sender=model)
+        self.client.force_login(User.objects.create_user(username='admin', is_staff=True, is_superuser=True))
+
+        def assert_kept(response, obj=self.fast, field='available_branches_count'):
+            self.assertIn(response.status_code, (200, 302))
+            obj.refresh_from_db()
+            self.assertEqual(getattr(obj, field), 7)
+            type(obj).objects.update(**{field: 0})
+
+        assert_kept(self.client.post(f'/api/services/{self.fast.pk}/update_duration/', {'duration_days': 4}))
+        assert_kept(self.client.patch(
+            f'/api/services/{self.fast.pk}/', {'duration_days': 6}, content_type='application/json'
+        ))
+        assert_kept(self.client.patch(
+            f'/api/branches/{self.branch.pk}/', {'name': 'Отделение на Мира'}, content_type='application/json'
+        ), self.branch, 'services_count')
+        self.assertEqual(Service.objects.get(pk=self.fast.pk).duration_days, 6)
+
+        url = f'/admin/mfc/service/{self.fast.pk}/change/'
+        prefix = self.client.get(url).context['inline_admin_formsets'][0].formset.prefix
+        assert_kept(self.client.post(url, {
+            'name': self.fast.name, 'category': self.fast.category, 'duration_days': 9,
+            f'{prefix}-TOTAL_FORMS': 0, f'{prefix}-INITIAL_FORMS': 0,
+            f'{prefix}-MIN_NUM_FORMS': 0, f'{prefix}-MAX_NUM_FORMS': 1000,
+        }))
+        self.assertEqual(Service.objects.get(pk=self.fast.pk).duration_days, 9)
+
+    def test_rebuild_command_repairs_drift(self):
+        BranchService.objects.create(branch=self.branch, service=self.fast)
+        Branch.objects.filter(pk=self.branch.pk).update(services_count=42)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', '--check', stdout=StringIO())
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assert_counters(self.branch, 1, 1, 2)
+
+
+class CursorPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # одинаковые названия проверяют разрешение совпадений по id
+        for i in range(25):
+            create_branch(i, name=f'Отделение {i % 4}')
+
+    def walk(self, url):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(branch['id'] for branch in data['results'])
+            url = data['next']
+        return ids
+
+    def test_page_numbers_stay_default(self):
+        data = self.client.get('/api/branches/').json()
+        self.assertEqual(data['count'], 25)
+
+    def test_cursor_walk_is_complete_and_stable(self):
+        ids = self.walk('/api/branches/?pagination=cursor')
+        expected = list(Branch.objects.order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+        ids = self.walk('/api/branches/?pagination=cursor&ordering=-created_at')
+        expected = list(Branch.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_cursor_walks_ties_by_position_without_offset(self):
+        # больше page_size строк с одним названием: страницы идут по (name, id), без OFFSET
+        for i in range(25, 48):
+            create_branch(i, name='Отделение 0')
+        expected = list(Branch.objects.order_by('name', 'id').values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as context:
+            ids = self.walk('/api/branches/?pagination=cursor')
+        self.assertEqual(ids, expected)
+        self.assertFalse(any('OFFSET' in query['sql'] for query in context.captured_queries))
+
+        url = self.client.get('/api/branches/?pagination=cursor&ordering=name').json()['next']
+        for _ in range(2):
+            url = self.client.get(url).json()['next']
+        data = self.client.get(url).json()
+        backwards = []
+        while data['previous']:
+            data = self.client.get(data['previous']).json()
+            backwards = [branch['id'] for branch in data['results']] + backwards
+        self.assertEqual(backwards, expected[:30])
+
+    def test_cursor_mode_skips_count_query(self):
+        with CaptureQueriesContext(connection) as context:
+            data = self.client.get('/api/branches/active/?pagination=cursor').json()
+        self.assertNotIn('count', data)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in context.captured_queries))
+
+
+class FullTextSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.center = create_branch(1, name='Центральное отделение', address='г. Москва, ул. Тверская, д. 1')
+        cls.north = create_branch(2, name='Северное отделение', address='г. Москва, ул. Ленина, д. 5')
+        cls.hidden = create_branch(3, name='Тестовое центральное', email='test@mfc.ru')
+        cls.passport = create_service(1, name='Заграничный паспорт')
+        BranchService.objects.create(branch=cls.north, service=cls.passport)
+
+    def search(self, query):
+        data = self.client.get('/api/branches/complex_search/', {'query': query}).json()
+        return {branch['id'] for branch in data['results']}
+
+    def test_prefix_and_word_forms(self):
+        self.assertEqual(self.search('центр'), {self.center.pk})
+        self.assertEqual(self.search('тверской'), {self.center.pk})
+        self.assertEqual(self.search('ОТДЕЛЕНИЯ москвы'), {self.center.pk, self.north.pk})
+
+    def test_service_names_are_searchable(self):
+        self.assertEqual(self.search('паспорта'), {self.north.pk})
+        self.passport.name = 'Загранпаспорт нового образца'
+        self.passport.save()
+        self.assertEqual(self.search('образцом'), {self.north.pk})
+        BranchService.objects.filter(branch=self.north).delete()
+        self.assertEqual(self.search('загранпаспорт'), set())
+
+    def test_index_follows_branch_changes(self):
+        self.north.name = 'Южное отделение'
+        self.north.save()
+        self.assertEqual(self.search('южное'), {self.north.pk})
+        self.assertEqual(self.search('северное'), set())
+
+    def test_service_search_param(self):
+        data = self.client.get('/api/services/', {'search': 'загранич'}).json()
+        self.assertEqual([service['id'] for service in data['results']], [self.passport.pk])
+
+    def test_admin_search_box(self):
+        admin_user = User.objects.create_superuser(username='admin', email='admin@mfc.ru')
+        self.client.force_login(admin_user)
+        response = self.client.get('/admin/mfc/branch/', {'q': 'тверская'})
+        self.assertContains(response, 'Центральное отделение')
+        self.assertNotContains(response, 'Северное отделение')
+
+
+class LoadDataGeneratorTests(TestCase):
+
+    def test_small_dataset_is_consistent(self):
+        generator = LoadDataGenerator(seed=1, batch_size=7)
+        generator.generate(
+            branches=5, services=30, users=40, employees_per_branch=2, appointments=300,
+            days_back=10, days_ahead=5,
+        )
+        self.assertEqual(Branch.objects.count(), 5)
+        self.assertEqual(Service.objects.count(), 30)
+        self.assertEqual(Employee.objects.count(), 10)
+        self.assertEqual(Appointment.objects.count(), 300)
+        self.assertFalse(Appointment.objects.filter(user_profile__role='employee').exists())
+        # записи только в рабочие дни и внутри диапазона, по которому пересчитаны слоты
+        today = timezone.localdate()
+        dates = set(Appointment.objects.values_list('date', flat=True))
+        self.assertTrue(all(today - timedelta(days=10) <= day <= today + timedelta(days=5) for day in dates))
+        self.assertFalse(any(day.weekday() == 6 for day in dates))
+        self.assertEqual(find_counter_mismatches(), [])
+        self.assertTrue(generator.exists())
+
+
+class BenchmarkReportTests(TestCase):
+
+    def test_compare_flags_latency_and_query_regressions(self):
+        def report(p50, queries):
+            return {'results': {'api_branches': {'p50_ms': p50, 'queries': queries}}}
+
+        _, regressions = compare_reports(report(10, 2), report(11, 2), threshold=0.2)
+        self.assertEqual(regressions, [])
+        _, regressions = compare_reports(report(10, 2), report(13, 2), threshold=0.2)
+        self.assertEqual(regressions, ['api_branches'])
+        _, regressions = compare_reports(report(10, 2), report(10, 3), threshold=0.2)
+        self.assertEqual(regressions, ['api_branches'])
+
+
+    def test_empty_database_asks_for_load_data(self):
+        with self.assertRaisesMessage(CommandError, 'generate_load_data'):
+            build_context()
+
+
+class StreamingExportTests(TestCase):
+
+    def setUp(self):
+        for number in range(1, 6):
+            create_branch(number, phone=f'8495123456{number}')
+        create_branch(6, is_active=False)
+        staff = User.objects.create_user(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(staff)
+
+    def export(self, file_format):
+        data = {'format': file_format}
+        data.update({f'branchresource_{name}': 'on' for name in BranchResource().get_export_order()})
+        return self.client.post('/admin/mfc/branch/export/', data)
+
+    def test_csv_is_streamed_with_dehydrated_values(self):
+        response = self.export(1)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['id', 'name', 'address', 'phone_formatted'])
+        self.assertEqual(len(lines), 6)  # заголовок и только активные отделения
+        self.assertIn('+74951234561', lines[1])
+
+    def test_unknown_field_is_reported_before_streaming(self):
+        fields = ['name', 'no_such_field']
+        with mock.patch.object(BranchAdmin, 'get_export_resource_fields_from_form', return_value=fields):
+            response = self.export(1)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Неизвестные поля экспорта: no_such_field')
+
+    def test_xlsx_is_written_in_write_only_mode(self):
+        from openpyxl import load_workbook
+
+        response = self.export(0)
+        self.assertTrue(response.streaming)
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)
+        rows = list(workbook.active.iter_rows(values_only=True))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0][3], 'phone_formatted')
+
+
+class ExportJobTests(TestCase):
+
+    def setUp(self):
+        for number in range(1, 6):
+            create_branch(number)
+        self.staff = User.objects.create_user(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(self.staff)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=os.path.join(media.name, 'media'),
+            MFC_EXPORT_DIR=os.path.join(media.name, 'exports'),
+            MFC_EXPORT_BACKGROUND_ROWS=2,
+        ))
+        self.media = media.name
+
+    def export(self):
+        data = {'format': 1}
+        data.update({f'branchresource_{name}': 'on' for name in BranchResource().get_export_order()})
+        # воркер запускается после коммита, в тесте выполняем задачу сами
+        with self.captureOnCommitCallbacks(execute=False):
+            return self.client.post('/admin/mfc/branch/export/', data)
+
+    def test_large_export_is_queued_and_served_to_owner_only(self):
+        response = self.export()
+        self.assertRedirects(response, '/admin/mfc/exportjob/')
+        job = ExportJob.objects.get()
+        run_export_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.DONE)
+        self.assertEqual((job.rows_done, job.rows_total), (5, 5))
+        # файл не в MEDIA_ROOT, по адресу /media/ его не достать
+        self.assertTrue(os.path.exists(os.path.join(self.media, 'exports', job.file.name)))
+        self.assertFalse(os.path.exists(os.path.join(self.media, 'media')))
+
+        url = f'/admin/mfc/exportjob/{job.pk}/download/'
+        self.assertContains(self.client.get('/admin/mfc/exportjob/'), url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).decode('utf-8').splitlines()), 6)
+
+        self.client.force_login(User.objects.create_user(username='other', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_cancelled_job_is_not_run(self):
+        self.export()
+        job = ExportJob.objects.get()
+        self.assertEqual(cancel_export(job), 1)
+        run_export_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.CANCELLED)
+        self.assertFalse(job.file)
+
+    def test_abandoned_jobs_are_expired(self):
+        with override_settings(MFC_EXPORT_JOBS_PER_USER=2):
+            self.export()
+            self.export()
+        running, pending = ExportJob.objects.order_by('pk')
+        ExportJob.objects.filter(pk=running.pk).update(status=ExportJob.Status.RUNNING)
+        # процесс остановился: задачи больше не двигаются и не держат лимит
+        ExportJob.objects.update(updated_at=timezone.now() - timedelta(minutes=11))
+        with override_settings(MFC_EXPORT_JOBS_PER_USER=2):
+            self.export()
+        self.assertEqual(ExportJob.objects.count(), 3)
+
+        call_command('process_export_jobs', stdout=StringIO())
+        running.refresh_from_db()
+        pending.refresh_from_db()
+        self.assertEqual(running.status, ExportJob.Status.FAILED)
+        self.assertEqual(pending.status, ExportJob.Status.DONE)
+        self.assertEqual(ExportJob.objects.filter(status=ExportJob.Status.PENDING).count(), 1)
+
+    def test_active_jobs_are_limited_per_user(self):
+        with override_settings(MFC_EXPORT_JOBS_PER_USER=1):
+            self.export()
+            response = self.export()
+        self.assertRedirects(response, '/admin/mfc/exportjob/')
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+
+class BulkImportTests(TestCase):
+
+    def csv_file(self, rows):
+        output = StringIO()
+        csv.writer(output).writerows(rows)
+        return BytesIO(output.getvalue().encode('utf-8'))
+
+    def test_branches_are_upserted_with_history(self):
+        existing = create_branch(1)
+        source = self.csv_file([
+            ['name', 'address', 'phone', 'email', 'work_schedule'],
+            ['Обновленное отделение', 'г. Москва, ул. Новая, д. 1', '84951234567', existing.email, 'Пн-Пт 9:00-18:00'],
+            ['Новое отделение', 'г. Казань, ул. Мира, д. 2', '+7 (843) 123-45-67', 'new@mfc.ru', 'Пн-Пт 9:00-18:00'],
+            ['Плохой телефон', 'г. Томск', '12345', 'bad@mfc.ru', 'Пн-Пт 9:00-18:00'],
+        ])
+        with CaptureQueriesContext(connection) as captured:
+            result = run_import('branches', source, 'csv')
+
+        self.assertEqual((result.rows, result.created, result.updated), (3, 1, 1))
+        self.assertEqual([(number, list(errors)) for number, errors in result.errors], [(4, ['phone'])])
+        existing.refresh_from_db()
+        self.assertEqual(existing.name, 'Обновленное отделение')
+        self.assertEqual(existing.history.count(), 2)
+        self.assertEqual(existing.history.first().history_type, '~')
+        self.assertEqual(Branch.objects.get(email='new@mfc.ru').history.get().history_type, '+')
+        self.assertEqual(Branch.objects.filter(email='bad@mfc.ru').count(), 0)
+        self.assertEqual(list(search_branches(Branch.objects.all(), 'Казань')), [Branch.objects.get(email='new@mfc.ru')])
+        self.assertLess(len(captured), 20)
+
+    def test_availability_matrix_updates_links_and_counters(self):
+        branch = create_branch(1)
+        first = create_service(1)
+        second = create_service(2)
+        BranchService.objects.create(branch=branch, service=first, is_available=True)
+        source = self.csv_file([
+            ['branch', first.name, second.name, 'Нет такой услуги'],
+            [branch.email, 'нет', 'да', '1'],
+            ['unknown@mfc.ru', 'да', 'да', ''],
+        ])
+        result = run_import('availability', source, 'csv')
+
+        self.assertEqual((result.created, result.updated), (1, 1))
+        self.assertEqual([number for number, _ in result.errors], [1, 3])
+        self.assertEqual(
+            dict(branch.branch_services.values_list('service_id', 'is_available')),
+            {first.pk: False, second.pk: True},
+        )
+        self.assertEqual(find_counter_mismatches(), [])
+
+    def test_dry_run_does_not_write(self):
+        source = self.csv_file([
+            ['name', 'category', 'duration_days'],
+            ['Выдача справки', 'DOC', '3'],
+            ['Спр', 'Неизвестно', '0'],
+        ])
+        result = run_import('services', source, 'csv', dry_run=True)
+        self.assertEqual(len(result.errors), 1)
+        self.assertEqual(set(result.errors[0][1]), {'name', 'category', 'duration_days'})
+        self.assertFalse(Service.objects.exists())
+
+
+    def test_importer_must_define_clean(self):
+        class Incomplete(ModelImporter):
+            model = Branch
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_branch_form_rejects_taken_email(self):
+        first, second = create_branch(1), create_branch(2)
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+        response = self.client.post(f'/branches/{second.pk}/edit/', {
+            'name': second.name,
+            'address': second.address,
+            'phone': second.phone,
+            'email': first.email,
+            'work_schedule': second.work_schedule,
+        })
+        self.assertContains(response, 'Отделение с таким email уже существует')
+        second.refresh_from_db()
+        self.assertNotEqual(second.email, first.email)
+
+
+class BulkApiTests(TestCase):
+
+    def setUp(self):
+        self.branches = [create_branch(number) for number in range(1, 4)]
+        self.services = [create_service(number) for number in range(1, 4)]
+        for branch in self.branches:
+            for service in self.services:
+                BranchService.objects.create(branch=branch, service=service)
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+
+    def post(self, url, items):
+        return self.client.post(url, {'items': items}, content_type='application/json')
+
+    def test_anonymous_bulk_writes_are_rejected(self):
+        self.client.logout()
+        responses = [
+            self.post('/api/branches/bulk_toggle_active/', [{'id': self.branches[0].pk}]),
+            self.post('/api/branches/bulk_availability/', [
+                {'branch': self.branches[0].pk, 'service': self.services[0].pk, 'is_available': False},
+            ]),
+            self.post('/api/services/bulk_update_duration/', [{'id': self.services[0].pk, 'duration_days': 30}]),
+        ]
+        self.assertEqual([response.status_code for response in responses], [403, 403, 403])
+        self.assertTrue(Branch.objects.get(pk=self.branches[0].pk).is_active)
+        self.assertTrue(BranchService.objects.get(branch=self.branches[0], service=self.services[0]).is_available)
+        self.assertEqual(Service.objects.get(pk=self.services[0].pk).duration_days, 5)
+
+    def test_toggle_many_branches_in_constant_queries(self):
+        items = [{'id': branch.pk} for branch in self.branches] + [{'id': self.branches[0].pk}]
+        response = self.post('/api/branches/bulk_toggle_active/', items)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'][3]['status'], 'error')
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.post('/api/branches/bulk_toggle_active/', items[:2] + [{'id': self.branches[2].pk, 'is_active': True}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['is_active'] for result in response.json()['results']], [False, False, True]
+        )
+        self.assertEqual(Branch.objects.filter(is_active=False).count(), 2)
+        self.assertEqual(self.branches[0].history.count(), 2)
+        self.assertLess(len(captured), 10)
+
+    def test_invalid_item_rejects_whole_batch(self):
+        response = self.post('/api/services/bulk_update_duration/', [
+            {'id': self.services[0].pk, 'duration_days': 10},
+            {'id': self.services[1].pk, 'duration_days': 0},
+            {'id': 999999, 'duration_days': 5},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [result['status'] for result in response.json()['results']], ['ok', 'error', 'error']
+        )
+        self.services[0].refresh_from_db()
+        self.assertEqual(self.services[0].duration_days, 5)
+
+    def test_duration_and_availability_keep_counters_in_sync(self):
+        response = self.post('/api/services/bulk_update_duration/', [
+            {'id': service.pk, 'duration_days': 20} for service in self.services
+        ])
+        self.assertEqual(response.status_code, 200)
+        response = self.post('/api/branches/bulk_availability/', [
+            {'branch': self.branches[0].pk, 'service': service.pk, 'is_available': False}
+            for service in self.services
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 3)
+        self.assertEqual(find_counter_mismatches(), [])
+        self.branches[0].refresh_from_db()
+        self.assertEqual((self.branches[0].available_services_count, self.branches[0].avg_duration_days), (0, 20))
+
+
+class HistoryBatchTests(TestCase):
+    # TestCase держит каждый тест в транзакции, поэтому пачка пишется в on_commit;
+    # captureOnCommitCallbacks(execute=True) выполняет его, как при настоящем коммите
+
+    def history_inserts(self, captured):
+        return [query for query in captured if query['sql'].startswith('INSERT INTO "mfc_historicalbranch"')]
+
+    def test_batch_writes_history_with_one_insert(self):
+        with CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+            with history_batch():
+                branches = [create_branch(number) for number in range(1, 4)]
+                branches[0].name = 'Переименованное отделение'
+                branches[0].save()
+        self.assertEqual(len(self.history_inserts(captured)), 1)
+        self.assertEqual(branches[0].history.count(), 2)
+        self.assertEqual(branches[0].history.first().name, 'Переименованное отделение')
+
+    def test_batch_covers_nested_atomic_and_skips_rolled_back_blocks(self):
+        with CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+            with history_batch(), transaction.atomic():
+                kept = create_branch(1)
+                with transaction.atomic():
+                    create_branch(2)
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    create_branch(3)
+                    raise RuntimeError
+                self.assertEqual(self.history_inserts(captured), [])
+        self.assertEqual(len(self.history_inserts(captured)), 1)
+        self.assertEqual(
+            sorted(Branch.history.values_list('email', flat=True)),
+            sorted(Branch.objects.values_list('email', flat=True)),
+        )
+        self.assertEqual(kept.history.count(), 1)
+
+    def test_rolled_back_transaction_leaves_no_history(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic(), history_batch():
+                    create_branch(1)
+                    raise RuntimeError
+        self.assertFalse(Branch.history.exists())
+
+    @override_settings(MFC_HISTORY_DIFF_ONLY=True)
+    def test_diff_only_skips_saves_without_changes(self):
+        branch = create_branch(1)
+        branch.save()
+        with self.captureOnCommitCallbacks(execute=True), history_batch():
+            branch.save()
+            branch.is_active = False
+            branch.save()
+            branch.save()
+        self.assertEqual(list(branch.history.values_list('history_type', flat=True)), ['~', '+'])
+
+    def test_request_history_is_flushed_by_middleware(self):
+        branch = create_branch(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/branches/{branch.pk}/toggle_active/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(branch.history.first().is_active, False)
+
+
+class HistoryRetentionTests(TestCase):
+
+    def setUp(self):
+        archive = tempfile.TemporaryDirectory()
+        self.addCleanup(archive.cleanup)
+        self.enterContext(override_settings(MFC_HISTORY_ARCHIVE_DIR=archive.name))
+        branch = create_branch(1)
+        service = create_service(1)
+        self.appointment = Appointment.objects.create(
+            user_profile=create_client_profile(1), service=service, branch=branch,
+            date=timezone.localdate() + timedelta(days=1), time=time(10, 0),
+        )
+        for status in ['PENDING', 'CONFIRMED', 'CONFIRMED', 'COMPLETED', 'COMPLETED']:
+            self.appointment.status = status
+            self.appointment.save()
+        self.appointment.history.update(history_date=timezone.now() - timedelta(days=400))
+
+    def statuses(self):
+        return list(self.appointment.history.order_by('history_id').values_list('status', flat=True))
+
+    def test_keeps_first_last_and_status_transitions(self):
+        result = compact_history('appointment', days=365)
+        self.assertEqual((result.kept, result.archived), (4, 2))
+        self.assertEqual(self.statuses(), ['PENDING', 'CONFIRMED', 'COMPLETED', 'COMPLETED'])
+
+        self.assertEqual(restore_history('appointment', self.appointment.pk), 2)
+        self.assertEqual(restore_history('appointment', self.appointment.pk), 0)
+        self.assertEqual(
+            self.statuses(), ['PENDING', 'PENDING', 'CONFIRMED', 'CONFIRMED', 'COMPLETED', 'COMPLETED']
+        )
+
+    def test_recent_history_and_dry_run_are_untouched(self):
+        self.assertEqual(compact_history('appointment', days=365, dry_run=True).archived, 2)
+        self.assertEqual(compact_history('appointment', days=500).archived, 0)
+        self.assertEqual(len(self.statuses()), 6)
+
+
+class AppointmentApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = create_branch(1)
+        other_branch = create_branch(2)
+        service = create_service(1)
+        cls.client_profile = create_client_profile(1)
+        other_client = create_client_profile(2)
+        start = timezone.localdate() + timedelta(days=1)
+        for i in range(25):
+            Appointment.objects.create(
+                user_profile=cls.client_profile, service=service, branch=cls.branch,
+                date=start + timedelta(days=i // 10), time=time(9 + i % 10, 0),
+                status=Appointment.Status.CONFIRMED if i % 2 else Appointment.Status.PENDING,
+            )
+        Appointment.objects.create(
+            user_profile=other_client, service=service, branch=other_branch, date=start, time=time(9, 0)
+        )
+        employee_profile = create_client_profile(3)
+        Employee.objects.create(user_profile=employee_profile, office=other_branch)
+        cls.employee = employee_profile.user
+
+    def test_client_sees_own_appointments_in_constant_queries(self):
+        self.client.force_login(self.client_profile.user)
+        url = '/api/appointments/'
+        counts = []
+        seen = []
+        while url:
+            with CaptureQueriesContext(connection) as captured:
+                data = self.client.get(url).json()
+            counts.append(len(captured))
+            seen.extend(item['id'] for item in data['results'])
+            url = data['next']
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+        self.assertEqual(len(set(counts)), 1)
+        self.assertLessEqual(counts[0], 4)
+
+    def test_employee_sees_branch_appointments_with_filters(self):
+        self.client.force_login(self.employee)
+        data = self.client.get('/api/appointments/').json()
+        self.assertEqual(len(data['results']), 1)
+
+        self.client.force_login(self.client_profile.user)
+        day = (timezone.localdate() + timedelta(days=2)).isoformat()
+        data = self.client.get('/api/appointments/', {
+            'date_from': day, 'date_to': day, 'status': 'CONFIRMED',
+        }).json()
+        self.assertEqual(len(data['results']), 5)
+        self.assertEqual({item['status'] for item in data['results']}, {'CONFIRMED'})
+
+    def test_anonymous_is_rejected(self):
+        self.assertEqual(self.client.get('/api/appointments/').status_code, 403)
+
+    def test_cursor_walks_past_thousand_rows_on_one_date(self):
+        # DRF-курсор по одной дате упирался в offset_cutoff=1000 и обрывал выдачу
+        day = timezone.localdate() + timedelta(days=30)
+        service = Service.objects.first()
+        Appointment.objects.bulk_create(
+            Appointment(
+                user_profile=self.client_profile, service=service, branch=self.branch,
+                date=day, time=time(9 + i % 3, 0),
+            )
+            for i in range(1005)
+        )
+        self.client.force_login(self.client_profile.user)
+        url = f'/api/appointments/?date_from={day.isoformat()}'
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(item['id'] for item in data['results'])
+            previous, url = data['previous'], data['next']
+        expected = list(
+            Appointment.objects.filter(date=day).order_by('date', 'time', 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+        data = self.client.get(previous).json()
+        self.assertEqual([item['id'] for item in data['results']], expected[-15:-5])
+
+
+class AdminChangelistTests(TestCase):
+
+    def setUp(self):
+        self.branches = [create_branch(number) for number in range(1, 4)]
+        self.services = [create_service(number) for number in range(1, 4)]
+        self.next_profile = 1
+        admin_user = User.objects.create_user(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+
+    def add_rows(self, count):
+        start = timezone.localdate() + timedelta(days=1)
+        for i in range(count):
+            profile = create_client_profile(self.next_profile)
+            branch = self.branches[i % 3]
+            service = self.services[i % 3]
+            self.next_profile += 1
+            Appointment.objects.create(
+                user_profile=profile, service=service, branch=branch,
+                date=start + timedelta(days=40 * (i % 2)), time=time(9 + i % 8, 0),
+            )
+            BranchService.objects.get_or_create(branch=branch, service=self.services[(i + 1) % 3])
+            Employee.objects.create(user_profile=create_client_profile(1000 + self.next_profile), office=branch)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(captured)
+
+    def test_changelists_do_not_grow_with_rows(self):
+        urls = ['/admin/mfc/appointment/', '/admin/mfc/employee/', '/admin/mfc/branchservice/']
+        self.add_rows(2)
+        before = [self.count_queries(url) for url in urls]
+        self.add_rows(8)
+        after = [self.count_queries(url) for url in urls]
+        self.assertEqual(before, after)
+
+    def test_autocomplete_filter_and_date_hierarchy(self):
+        self.add_rows(4)
+        response = self.client.get('/admin/mfc/appointment/')
+        # отделения в фильтре не перечисляются, только поле автодополнения
+        self.assertContains(response, 'data-field-name="branch"')
+        self.assertContains(response, 'mfc/admin/autocomplete_filter.js')
+        year = (timezone.localdate() + timedelta(days=1)).year
+        self.assertContains(response, f'date__year={year}')
+
+        response = self.client.get('/admin/mfc/appointment/', {'branch__id__exact': self.branches[0].pk})
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        self.assertContains(response, f'<option value="{self.branches[0].pk}" selected>')
+
+
+@override_settings(MFC_APPROXIMATE_COUNT_THRESHOLD=3)
+class ApproximateCountTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.branch = create_branch(1)
+        self.services = [create_service(number) for number in range(1, 11)]
+        for service in self.services[:6]:
+            BranchService.objects.create(branch=self.branch, service=service)
+        admin_user = User.objects.create_user(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in captured if 'COUNT(' in query['sql']]
+
+    def test_unfiltered_count_comes_from_statistics(self):
+        refresh_statistics()
+        for service in self.services[6:]:
+            BranchService.objects.create(branch=self.branch, service=service)
+        self.assertEqual(approximate_count(BranchService.objects.all()), (6, True))
+
+        response, counts = self.count_queries('/admin/mfc/branchservice/')
+        self.assertEqual(counts, [])
+        self.assertEqual(response.context['cl'].result_count, 6)
+        self.assertContains(response, 'exact_count=1')
+
+        response, counts = self.count_queries('/admin/mfc/branchservice/', {'exact_count': 1})
+        self.assertEqual(response.context['cl'].result_count, 10)
+        self.assertNotContains(response, 'exact_count=1')
+
+        response, counts = self.count_queries('/admin/mfc/historicalappointment/', {'exact_count': 1})
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_filtered_count_is_cached(self):
+        params = {'is_available__exact': 1}
+        response, counts = self.count_queries('/admin/mfc/branchservice/', params)
+        self.assertEqual(len(counts), 1)
+        self.assertNotContains(response, 'exact_count=1')
+        # второй раз число берется из кэша и помечается как приблизительное
+        response, counts = self.count_queries('/admin/mfc/branchservice/', params)
+        self.assertEqual(counts, [])
+        self.assertContains(response, 'exact_count=1')
+
+    def test_refresh_counts_recounts_cached_filters(self):
+        params = {'is_available__exact': 1}
+        self.count_queries('/admin/mfc/branchservice/', params)
+        BranchService.objects.create(branch=self.branch, service=self.services[6])
+        response, _ = self.count_queries('/admin/mfc/branchservice/', params)
+        self.assertEqual(response.context['cl'].result_count, 6)
+
+        call_command('refresh_counts', stdout=StringIO())
+        response, counts = self.count_queries('/admin/mfc/branchservice/', params)
+        self.assertEqual(counts, [])
+        self.assertEqual(response.context['cl'].result_count, 7)
+
+        # выпавший из кэша подсчет больше не пересчитывается
+        cache.delete_many([key for key in cache.get(COUNT_QUERIES_KEY)])
+        output = StringIO()
+        call_command('refresh_counts', stdout=output)
+        self.assertIn('Пересчитано подсчетов с фильтрами: 0', output.getvalue())
+
+    def test_small_tables_are_counted_exactly(self):
+        with self.settings(MFC_APPROXIMATE_COUNT_THRESHOLD=100):
+            refresh_statistics()
+            self.assertEqual(approximate_count(BranchService.objects.all()), (6, False))
+
+    def test_api_approximate_pagination(self):
+        refresh_statistics([Branch])
+        create_branch(2)
+        data = self.client.get('/api/branches/', {'pagination': 'approximate'}).json()
+        self.assertEqual((data['count'], data['count_approximate']), (2, False))
+        with self.settings(MFC_APPROXIMATE_COUNT_THRESHOLD=1):
+            data = self.client.get('/api/branches/', {'pagination': 'approximate'}).json()
+            self.assertEqual((data['count'], data['count_approximate']), (1, True))
+            self.assertEqual(len(data['results']), 2)
+            data = self.client.get('/api/branches/', {'pagination': 'approximate', 'exact_count': 1}).json()
+            self.assertEqual((data['count'], data['count_approximate']), (2, False))
+
+
+class DailyStatsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = create_branch(1)
+        cls.services = [create_service(1), create_service(2)]
+        cls.profiles = [create_client_profile(i) for i in range(4)]
+        cls.day = timezone.localdate()
+
+    def book(self, profile, service, value, status=Appointment.Status.PENDING):
+        return Appointment.objects.create(
+            user_profile=profile, service=service, branch=self.branch,
+            date=self.day, time=value, status=status,
+        )
+
+    def snapshot(self):
+        return sorted(
+            AppointmentDailyStat.objects.filter(count__gt=0)
+            .values_list('branch_id', 'service_id', 'date', 'status', 'hour', 'count')
+        )
+
+    def test_signals_keep_rollup_in_sync(self):
+        first = self.book(self.profiles[0], self.services[0], time(9, 30))
+        self.book(self.profiles[1], self.services[0], time(9, 0))
+        third = self.book(self.profiles[2], self.services[1], time(14, 0))
+        first.status = Appointment.Status.CANCELLED
+        first.save()
+        third.time = time(15, 0)
+        third.save()
+        self.book(self.profiles[3], self.services[1], time(15, 30)).delete()
+
+        incremental = self.snapshot()
+        self.assertEqual(rebuild_daily_stats(), 3)
+        self.assertEqual(self.snapshot(), incremental)
+
+        day = get_branch_stats(self.branch.pk, self.day, self.day)[0]
+        self.assertEqual(day['total'], 3)
+        self.assertEqual({row['status']: row['count'] for row in day['by_status']}, {'CANCELLED': 1, 'PENDING': 2})
+        self.assertEqual([(row['hour'], row['count']) for row in day['by_hour']], [(9, 2), (15, 1)])
+        self.assertEqual(day['by_service'][0], {'service': self.services[0].pk, 'name': self.services[0].name, 'count': 2})
+
+    def test_api_and_dashboard_read_only_the_rollup(self):
+        self.book(self.profiles[0], self.services[0], time(10, 0))
+        url = f'/api/branches/{self.branch.pk}/daily_stats/'
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        with CaptureQueriesContext(connection) as captured:
+            data = self.client.get(url, {'date_from': self.day.isoformat()}).json()
+        self.assertEqual(data['days'][0]['total'], 1)
+        self.assertFalse(any('"mfc_appointment"' in query['sql'] for query in captured))
+
+        response = self.client.get(f'/branches/{self.branch.pk}/stats/', {'date': self.day.isoformat()})
+        self.assertContains(response, 'Всего записей:</strong> 1')
+        self.assertContains(response, '10:00')
+
+    def test_branch_employee_sees_own_branch_only(self):
+        other = create_branch(2)
+        Employee.objects.create(user_profile=self.profiles[0], office=self.branch)
+        self.client.force_login(self.profiles[0].user)
+        self.assertEqual(self.client.get(f'/api/branches/{self.branch.pk}/daily_stats/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/branches/{other.pk}/daily_stats/').status_code, 403)
+
+
+@override_settings(MFC_METRICS_SAMPLE_RATE=1, MFC_METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        create_branch(1)
+
+    def metrics(self):
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        return self.client.get('/metrics/').content.decode()
+
+    def test_histograms_per_view(self):
+        self.client.get('/')
+        self.client.get('/api/branches/')
+        text = self.metrics()
+        self.assertIn('mfc_requests_total{view="mfc:branch_list"} 1', text)
+        self.assertIn('mfc_request_duration_seconds_count{view="mfc:branch-list"} 1', text)
+        self.assertIn('mfc_db_queries_bucket{view="mfc:branch_list",le="+Inf"} 1', text)
+        self.assertIn('mfc_template_duration_seconds_count{view="mfc:branch_list"} 1', text)
+        self.assertIn('mfc_response_size_bytes_count{view="mfc:branch-list"} 1', text)
+        sums = dict(
+            line.rsplit(' ', 1) for line in text.splitlines() if line.startswith('mfc_template_duration_seconds_sum')
+        )
+        self.assertGreater(float(sums['mfc_template_duration_seconds_sum{view="mfc:branch_list"}']), 0)
+
+    def test_unsampled_requests_are_only_counted(self):
+        with self.settings(MFC_METRICS_SAMPLE_RATE=0):
+            self.client.get('/api/branches/')
+        text = self.metrics()
+        self.assertIn('mfc_requests_total{view="mfc:branch-list"} 1', text)
+        self.assertNotIn('mfc_request_duration_seconds_count{view="mfc:branch-list"}', text)
+
+    def test_endpoint_is_staff_or_token_only(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertContains(response, '# TYPE mfc_request_duration_seconds histogram')
+
+
+@override_settings(MFC_SLOW_QUERY_MS=0)
+class SlowQueryLogTests(TestCase):
+
+    def setUp(self):
+        create_branch(1)
+
+    def get(self, url):
+        with self.assertLogs('mfc.slow_queries', 'WARNING'):
+            self.client.get(url)
+
+    def test_fingerprint_ignores_literals_and_list_length(self):
+        self.assertEqual(
+            normalize("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x''y'\n LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+        self.assertEqual(normalize('WHERE id IN (%s)'), normalize('WHERE id IN (%s, %s)'))
+
+    def test_slow_queries_are_grouped_per_view_with_plan(self):
+        self.get('/api/branches/')
+        entry = SlowQuery.objects.get(view='mfc:branch-list', sql__contains='FROM "mfc_branch"', sql__startswith='SELECT "mfc_branch"')
+        self.assertEqual(entry.calls, 1)
+        self.assertIn('mfc_branch', entry.plan)
+
+        # второй раз план не снимается
+        with CaptureQueriesContext(connection) as captured:
+            self.get('/api/branches/')
+        self.assertFalse(any(query['sql'].startswith('EXPLAIN') for query in captured))
+        entry.refresh_from_db()
+        self.assertEqual(entry.calls, 2)
+        self.assertGreaterEqual(entry.total_time, entry.max_time)
+
+        out = StringIO()
+        call_command('slow_queries', '--top', '3', '--plan', stdout=out)
+        self.assertIn('1. ', out.getvalue())
+
+        admin_user = User.objects.create_user(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        with self.settings(MFC_SLOW_QUERY_MS=None):
+            self.assertContains(self.client.get(f'/admin/mfc/slowquery/{entry.pk}/change/'), '<pre>')
+
+    def test_example_does_not_keep_values(self):
+        sql = 'SELECT "id" FROM "mfc_branch" WHERE "email" = %s AND "name" = \'Секретное\' AND "id" > %s'
+        with self.assertLogs('mfc.slow_queries', 'WARNING'):
+            record('test', sql, ('secret@mfc.ru', 7), False, 150.0)
+        example = SlowQuery.objects.get(view='test').example
+        self.assertNotIn('secret@mfc.ru', example)
+        self.assertNotIn('Секретное', example)
+        self.assertIn('"email" = %s', example)
+        self.assertIn('параметры: str, int', example)
+
+    def test_disabled_log_writes_nothing(self):
+        with self.settings(MFC_SLOW_QUERY_MS=None):
+            self.client.get('/api/branches/')
+        self.assertFalse(SlowQuery.objects.exists())
+
+
+def make_photo(name='office.jpg', size=(2000, 1500)):
+    # шум плохо сжимается, поэтому файл по размеру похож на настоящее фото
+    from PIL import Image
+    image = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+
+class BranchPhotoTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.branch = create_branch(1)
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+
+    def edit(self, **extra):
+        data = {
+            'name': self.branch.name,
+            'address': self.branch.address,
+            'phone': self.branch.phone,
+            'email': self.branch.email,
+            'work_schedule': self.branch.work_schedule,
+            'is_active': 'on',
+        }
+        data.update(extra)
+        self.client.post(f'/branches/{self.branch.pk}/edit/', data)
+        self.branch.refresh_from_db()
+
+    def process(self):
+        # в TestCase on_commit не срабатывает, поэтому очередь разбираем сами
+        run_due_jobs()
+        self.branch.refresh_from_db()
+
+    def test_upload_builds_small_variants(self):
+        self.edit(photo=make_photo())
+        self.process()
+        name = self.branch.photo.name
+        self.assertTrue(all(default_storage.exists(variant) for variant in variant_names(name)))
+        self.assertFalse(any(file.endswith('.part') for file in os.listdir(default_storage.path('branches'))))
+        original = default_storage.size(name)
+        self.assertLess(default_storage.size(variant_name(name, 'thumb', 'webp')) * 10, original)
+        self.assertLess(default_storage.size(variant_name(name, 'thumb', 'jpg')) * 10, original)
+
+        data = self.client.get(f'/api/branches/{self.branch.pk}/').json()
+        self.assertTrue(data['photo_variants']['thumb_webp'].endswith('.thumb.webp'))
+        self.assertTrue(data['photo_variants']['medium'].endswith('.medium.jpg'))
+        self.client.logout()
+        self.assertContains(self.client.get('/'), variant_name(name, 'thumb', 'webp'))
+
+    def test_clear_and_delete_remove_variants(self):
+        self.edit(photo=make_photo('first.jpg', (400, 300)))
+        self.process()
+        first = self.branch.photo.name
+        self.edit(photo=make_photo('second.jpg', (400, 300)))
+        self.process()
+        second = self.branch.photo.name
+        self.assertFalse(default_storage.exists(first))
+        self.assertFalse(any(default_storage.exists(variant) for variant in variant_names(first)))
+        self.assertTrue(default_storage.exists(variant_name(second, 'medium', 'webp')))
+
+        self.edit(**{'photo-clear': '1'})
+        self.process()
+        self.assertFalse(self.branch.photo)
+        self.assertFalse(any(default_storage.exists(variant) for variant in variant_names(second)))
+
+        self.edit(photo=make_photo('third.jpg', (400, 300)))
+        self.process()
+        third = self.branch.photo.name
+        self.client.post(f'/branches/{self.branch.pk}/delete/')
+        run_due_jobs()
+        self.assertFalse(default_storage.exists(third))
+        self.assertFalse(any(default_storage.exists(variant) for variant in variant_names(third)))
+
+    def test_old_photos_fall_back_to_original_until_rebuilt(self):
+        name = default_storage.save('branches/legacy.jpg', make_photo('legacy.jpg', (400, 300)))
+        Branch.objects.filter(pk=self.branch.pk).update(photo=name)
+        self.branch.refresh_from_db()
+        self.assertEqual(self.branch.photo_variants['thumb'], self.branch.photo.url)
+
+        call_command('rebuild_photo_variants', stdout=StringIO())
+        del self.branch.photo_variants
+        self.assertTrue(self.branch.photo_variants['thumb'].endswith('legacy.jpg.thumb.jpg'))
+
+    def test_variants_of_same_base_name_do_not_collide(self):
+        jpeg = default_storage.save('branches/office.jpg', make_photo('office.jpg', (400, 300)))
+        png = default_storage.save('branches/office.png', make_photo('office.png', (400, 300)))
+        other = create_branch(2)
+        Branch.objects.filter(pk=self.branch.pk).update(photo=jpeg)
+        Branch.objects.filter(pk=other.pk).update(photo=png)
+        self.assertFalse(set(variant_names(jpeg)) & set(variant_names(png)))
+
+        call_command('rebuild_photo_variants', stdout=StringIO())
+        self.assertTrue(all(default_storage.exists(variant) for variant in variant_names(jpeg) + variant_names(png)))
+        delete_photo(png)
+        self.assertTrue(all(default_storage.exists(variant) for variant in variant_names(jpeg)))
+
+    def test_upload_is_processed_off_request(self):
+        from PIL import Image
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera'  # Make
+        exif[0x8825] = {2: (55.0, 45.0, 0.0)}  # GPS
+        output = BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(output, 'JPEG', exif=exif)
+        self.edit(photo=SimpleUploadedFile('gps.jpg', output.getvalue(), content_type='image/jpeg'))
+
+        # до обработки: заглушка на страницах и в API, загрузка лежит как есть
+        upload = self.branch.photo.name
+        self.assertTrue(self.branch.photo_pending)
+        self.assertContains(self.client.get('/'), 'Обработка...')
+        self.assertIsNone(self.client.get(f'/api/branches/{self.branch.pk}/').json()['photo_variants'])
+        job = PhotoJob.objects.get(branch=self.branch)
+        self.assertEqual((job.status, job.photo), (PhotoJob.Status.PENDING, upload))
+
+        self.process()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (PhotoJob.Status.DONE, 1))
+        self.assertFalse(self.branch.photo_pending)
+        self.assertFalse(default_storage.exists(upload))
+        with default_storage.open(self.branch.photo.name, 'rb') as photo:
+            self.assertEqual(len(Image.open(photo).getexif()), 0)
+        self.assertNotContains(self.client.get('/'), 'Обработка...')
+
+    def test_png_upload_keeps_its_variants(self):
+        from PIL import Image
+        output = BytesIO()
+        Image.new('RGBA', (400, 300), (255, 0, 0, 128)).save(output, 'PNG')
+        self.edit(photo=SimpleUploadedFile('office.png', output.getvalue(), content_type='image/png'))
+        upload = self.branch.photo.name
+        self.process()
+        name = self.branch.photo.name
+        self.assertTrue(name.endswith('.jpg'))
+        self.assertFalse(default_storage.exists(upload))
+        self.assertTrue(default_storage.exists(name))
+        self.assertTrue(all(default_storage.exists(variant) for variant in variant_names(name)))
+
+    def test_invalid_file_fails_without_retry(self):
+        self.edit(photo=SimpleUploadedFile('fake.jpg', b'not an image', content_type='image/jpeg'))
+        self.assertTrue(self.branch.photo_pending)
+        upload = self.branch.photo.name
+        with mock.patch('mfc.photo_jobs.schedule_retry') as retry:
+            self.process()
+        retry.assert_not_called()
+        job = PhotoJob.objects.get(branch=self.branch)
+        self.assertEqual(job.status, PhotoJob.Status.FAILED)
+        self.assertFalse(self.branch.photo)
+        self.assertFalse(self.branch.photo_pending)
+        self.assertFalse(default_storage.exists(upload))
+
+    def test_transient_error_is_retried_with_backoff(self):
+        self.edit(photo=make_photo('office.jpg', (400, 300)))
+        job = PhotoJob.objects.get(branch=self.branch)
+        with mock.patch('mfc.photo_jobs.process_upload', side_effect=OSError('диск занят')), \
+                mock.patch('mfc.photo_jobs.schedule_retry') as retry:
+            run_photo_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (PhotoJob.Status.PENDING, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        retry.assert_called_once_with(job.pk, 30)
+
+        # повтор проходит, когда подойдет время
+        PhotoJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.process()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (PhotoJob.Status.DONE, 2))
+        self.assertTrue(default_storage.exists(variant_name(self.branch.photo.name, 'thumb', 'webp')))
+        self.assertIn('mfc_photo_jobs{status="DONE"} 1', self.client.get('/metrics/').content.decode())
+
+
+class ChunkedUploadTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.branch = create_branch(1)
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+
+    def start(self, **data):
+        return self.client.post('/api/uploads/', data, content_type='application/json')
+
+    def put(self, token, offset, body, **extra):
+        return self.client.put(
+            f'/api/uploads/{token}/', body, content_type='application/octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset), **extra
+        )
+
+    def test_photo_resumes_after_dropped_connection(self):
+        photo = make_photo('office.jpg', (400, 300)).read()
+        token = self.start(purpose='photo', branch=self.branch.pk, filename='office.jpg', size=len(photo)).json()['token']
+
+        # обрыв: заявлено 3000 байт, дошло 1000 (тестовый клиент короткое тело не отправит)
+        upload = write_chunk(ChunkedUpload.objects.get(token=token), 0, BytesIO(photo[:1000]), 3000)
+        self.assertEqual(upload.offset, 1000)
+        self.assertEqual(self.put(token, 3000, photo[3000:]).status_code, 409)
+        self.assertEqual(self.client.get(f'/api/uploads/{token}/')['Upload-Offset'], '1000')
+
+        self.put(token, 1000, photo[1000:2000])
+        response = self.put(token, 2000, photo[2000:])
+        self.assertEqual(response.json()['status'], ChunkedUpload.Status.DONE)
+        self.branch.refresh_from_db()
+        self.assertTrue(self.branch.photo_pending)
+        with default_storage.open(self.branch.photo.name, 'rb') as stored:
+            self.assertEqual(stored.read(), photo)
+        self.assertFalse(os.listdir(default_storage.path('uploads')))
+        self.assertTrue(PhotoJob.objects.filter(branch=self.branch, photo=self.branch.photo.name).exists())
+
+    def test_oversized_and_wrong_type_rejected_early(self):
+        response = self.start(purpose='photo', branch=self.branch.pk, filename='big.jpg', size=6 * 1024 * 1024)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.start(purpose='photo', branch=self.branch.pk, filename='a.exe', size=10).status_code, 415)
+
+        token = self.start(purpose='photo', branch=self.branch.pk, filename='fake.jpg', size=20000).json()['token']
+        response = self.put(token, 0, b'MZ' + b'\x00' * 5000)
+        self.assertEqual(response.status_code, 415)
+        upload = ChunkedUpload.objects.get(token=token)
+        self.assertEqual(upload.status, ChunkedUpload.Status.FAILED)
+        self.assertFalse(os.path.exists(default_storage.path(f'uploads/{token}.part')))
+
+        token = self.start(purpose='photo', branch=self.branch.pk, filename='small.jpg', size=10).json()['token']
+        self.assertEqual(self.put(token, 0, b'\xff\xd8\xff' + b'\x00' * 20).status_code, 413)
+
+    def test_import_file_is_fed_to_pipeline(self):
+        output = StringIO()
+        csv.writer(output).writerows([
+            ['name', 'category', 'duration_days'],
+            ['Выдача справки', 'DOC', '3'],
+            ['Спр', 'Неизвестно', '0'],
+        ])
+        data = output.getvalue().encode('utf-8')
+        token = self.start(purpose='import', import_kind='services', filename='services.csv', size=len(data)).json()['token']
+        self.put(token, 0, data[:10])
+        # последняя часть только ставит импорт в очередь, запрос не ждет его окончания
+        self.assertEqual(self.put(token, 10, data[10:]).json()['status'], ChunkedUpload.Status.QUEUED)
+        self.assertFalse(Service.objects.filter(name='Выдача справки').exists())
+
+        url = f'/api/uploads/{token}/'
+        seen = []
+
+        def import_in_batches(*args, progress, **kwargs):
+            def report(result):
+                progress(result)
+                data = self.client.get(url).json()
+                seen.append((data['status'], data['result']['rows']))
+            return run_import(*args, batch_size=1, progress=report, **kwargs)
+
+        # в TestCase on_commit не срабатывает, задачу выполняем сами
+        with mock.patch('mfc.uploads.run_import', import_in_batches):
+            run_import_job(ChunkedUpload.objects.get(token=token).pk)
+        self.assertEqual(seen, [('IMPORTING', 1), ('IMPORTING', 2)])
+        data = self.client.get(url).json()
+        self.assertEqual(data['status'], ChunkedUpload.Status.DONE)
+        result = data['result']
+        self.assertEqual((result['rows'], result['created'], result['errors_total']), (2, 1, 1))
+        self.assertTrue(Service.objects.filter(name='Выдача справки').exists())
+        self.assertFalse(os.listdir(default_storage.path('uploads')))
+
+        self.assertEqual(self.start(purpose='import', import_kind='nope', filename='a.csv', size=10).status_code, 400)
+        self.client.force_login(User.objects.create_user(username='client'))
+        self.assertEqual(self.client.get(f'/api/uploads/{token}/').status_code, 403)
+
+
+    def test_abandoned_imports_are_picked_up(self):
+        data = b'name,category,duration_days\n\xd0\x9f\xd0\xb0\xd1\x81\xd0\xbf\xd0\xbe\xd1\x80\xd1\x82,DOC,3\n'
+        tokens = [
+            self.start(purpose='import', import_kind='services', filename='s.csv', size=len(data)).json()['token']
+            for _ in range(2)
+        ]
+        for token in tokens:
+            self.put(token, 0, data)
+        interrupted, queued = ChunkedUpload.objects.filter(token__in=tokens).order_by('pk')
+        ChunkedUpload.objects.filter(pk=interrupted.pk).update(status=ChunkedUpload.Status.IMPORTING)
+        ChunkedUpload.objects.update(updated_at=timezone.now() - timedelta(minutes=11))
+
+        call_command('clean_uploads', stdout=StringIO())
+        interrupted.refresh_from_db()
+        queued.refresh_from_db()
+        self.assertEqual(interrupted.status, ChunkedUpload.Status.FAILED)
+        self.assertEqual(queued.status, ChunkedUpload.Status.DONE)
+        self.assertTrue(Service.objects.filter(name='Паспорт').exists())
+        self.assertFalse(os.listdir(default_storage.path('uploads')))
+
+
+class AsyncViewsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.branches = [create_branch(number, is_active=number % 3 != 0) for number in range(1, 24)]
+        self.service = create_service(1)
+        create_service(2, category=Service.Category.SOCIAL)
+        BranchService.objects.create(branch=self.branches[0], service=self.service, is_available=True)
+
+    def test_api_matches_sync_viewsets(self):
+        urls = [
+            '/api/branches/',
+            '/api/branches/?page=2',
+            '/api/branches/?page=3&is_active=true',
+            f'/api/branches/{self.branches[0].pk}/',
+            '/api/services/?category=SOCIAL',
+            f'/api/services/{self.service.pk}/',
+            # эти отдает синхронный viewset
+            '/api/branches/?page=99',
+            '/api/branches/?ordering=-name',
+            '/api/branches/?pagination=cursor',
+            '/api/branches/999999/',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                sync_response = self.client.get(url)
+                async_response = self.client.get(f'/async{url}')
+                self.assertEqual(async_response.status_code, sync_response.status_code)
+                # ссылки next/previous отличаются только префиксом /async
+                content = async_response.content.decode().replace('/async/api/', '/api/')
+                self.assertEqual(json.loads(content), sync_response.json())
+
+    def test_writes_go_to_sync_viewset(self):
+        response = self.client.post('/async/api/services/', {
+            'name': 'Выдача справки', 'category': 'DOC', 'duration_days': 3,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Service.objects.filter(name='Выдача справки').exists())
+
+    def test_pages_match_sync_views(self):
+        response = self.client.get('/async/')
+        self.assertContains(response, self.branches[0].name)
+        self.assertEqual(response['ETag'], self.client.get('/')['ETag'])
+        self.assertEqual(self.client.get('/async/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+        response = self.client.get(f'/async/branches/{self.branches[0].pk}/')
+        self.assertContains(response, self.service.name)
+        self.assertContains(response, 'Редактировать')
+        self.assertEqual(self.client.get('/async/branches/999999/').status_code, 404)
+
+    def test_async_queries_are_sampled(self):
+        with self.settings(MFC_METRICS_SAMPLE_RATE=1):
+            self.client.get('/async/api/branches/')
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+        text = self.client.get('/metrics/').content.decode()
+        self.assertIn('mfc_db_queries_bucket{view="mfc:async_branch_api_list",le="1"} 0', text)
+        self.assertIn('mfc_db_queries_bucket{view="mfc:async_branch_api_list",le="2"} 1', text)
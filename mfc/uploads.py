@@ -0,0 +1,315 @@
+import codecs
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .images import get_max_photo_size
+from .imports import IMPORTERS, run_import
+from .models import Branch, ChunkedUpload
+
+UPLOAD_DIR = 'uploads'
+BLOCK_SIZE = 64 * 1024  # столько байт за раз читаем из запроса и пишем на диск
+HEAD_BYTES = 4096       # начало файла, по которому проверяется его тип
+MAX_REPORTED_ERRORS = 20
+# импорт без движения дольше этого считается брошенным (процесс перезапустили)
+STALE_AFTER = timedelta(minutes=10)
+
+EXTENSIONS = {
+    ChunkedUpload.Purpose.PHOTO: {'.jpg', '.jpeg', '.png', '.webp', '.gif'},
+    ChunkedUpload.Purpose.IMPORT: {'.csv', '.xlsx'},
+}
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class UploadRejected(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class OffsetMismatch(Exception):
+    # часть пришла не с того места: клиент докачивает с upload.offset
+    def __init__(self, offset):
+        super().__init__(offset)
+        self.offset = offset
+
+
+def get_chunk_size():
+    # больше стольких байт в одном запросе не принимаем
+    return getattr(settings, 'MFC_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+
+
+def get_max_size(purpose):
+    if purpose == ChunkedUpload.Purpose.PHOTO:
+        return get_max_photo_size()
+    return getattr(settings, 'MFC_IMPORT_MAX_SIZE', 100 * 1024 * 1024)
+
+
+def get_expire_hours():
+    return getattr(settings, 'MFC_UPLOAD_EXPIRE_HOURS', 24)
+
+
+def get_executor():
+    # как в mfc.export_jobs: пул создается при первом импорте
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'MFC_IMPORT_WORKERS', 1),
+                thread_name_prefix='mfc-import',
+            )
+        return _executor
+
+
+def part_path(upload):
+    return default_storage.path(f'{UPLOAD_DIR}/{upload.token}.part')
+
+
+def extension(upload):
+    return os.path.splitext(upload.filename)[1].lower()
+
+
+def start_upload(user, purpose, filename, size, branch=None, import_kind=''):
+    # размер и расширение проверяем до первого байта
+    upload = ChunkedUpload(
+        user=user, purpose=purpose, filename=filename, size=size, branch=branch, import_kind=import_kind
+    )
+    if purpose == ChunkedUpload.Purpose.IMPORT and import_kind not in IMPORTERS:
+        raise UploadRejected(f'Неизвестный вид импорта: {import_kind}')
+    if extension(upload) not in EXTENSIONS[purpose]:
+        raise UploadRejected(f'Файлы {extension(upload) or "без расширения"} не поддерживаются', 415)
+    max_size = get_max_size(purpose)
+    if size > max_size:
+        raise UploadRejected(f'Файл больше {max_size // (1024 * 1024)} МБ', 413)
+    upload.save()
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return upload
+
+
+def sniff(upload, head):
+    # тип по первым байтам, а не по имени файла; возвращает текст ошибки или ''
+    if upload.purpose == ChunkedUpload.Purpose.PHOTO:
+        if head.startswith((b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a')):
+            return ''
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            return ''
+        return 'Файл не является изображением JPEG, PNG, WebP или GIF'
+    if extension(upload) == '.xlsx':
+        return '' if head.startswith(b'PK\x03\x04') else 'Файл не является книгой XLSX'
+    try:
+        # final=False: начало может оборваться посреди многобайтового символа
+        codecs.getincrementaldecoder('utf-8-sig')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return 'CSV должен быть в кодировке UTF-8'
+    return 'Файл не похож на CSV' if b'\x00' in head else ''
+
+
+def read_head(stream, size):
+    head = b''
+    while len(head) < size:
+        block = stream.read(size - len(head))
+        if not block:
+            break
+        head += block
+    return head
+
+
+def write_chunk(upload, offset, stream, length):
+    # дописывает часть из stream блоками, файл целиком в память не попадает
+    if length > get_chunk_size():
+        raise UploadRejected(f'Часть больше {get_chunk_size()} байт', 413)
+    error = ''
+    with transaction.atomic():
+        # блокировка строки: две части одной загрузки не пишутся одновременно
+        upload = ChunkedUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.status != ChunkedUpload.Status.UPLOADING:
+            raise UploadRejected(f'Загрузка уже завершена: {upload.get_status_display()}', 409)
+        if upload.offset == upload.size:
+            raise UploadRejected('Файл уже получен целиком', 409)
+        if offset != upload.offset:
+            raise OffsetMismatch(upload.offset)
+        if offset + length > upload.size:
+            raise UploadRejected('Часть выходит за объявленный размер файла', 413)
+        written = 0
+        with open(part_path(upload), 'r+b') as output:
+            # смещение в базе — источник правды: хвост оборванной попытки отбрасываем
+            output.seek(offset)
+            output.truncate()
+            if offset == 0:
+                head = read_head(stream, min(length, HEAD_BYTES))
+                error = sniff(upload, head)
+                if not error:
+                    output.write(head)
+                    written = len(head)
+            while not error and written < length:
+                block = stream.read(min(BLOCK_SIZE, length - written))
+                if not block:
+                    # соединение оборвалось: сохраняем то, что успели получить
+                    break
+                output.write(block)
+                written += len(block)
+        if error:
+            upload.status = ChunkedUpload.Status.FAILED
+            upload.error = error
+            upload.save(update_fields=['status', 'error', 'updated_at'])
+        else:
+            upload.offset = offset + written
+            upload.save(update_fields=['offset', 'updated_at'])
+    if error:
+        remove_part(upload)
+        raise UploadRejected(error, 415)
+    return upload
+
+
+def remove_part(upload):
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def fail_upload(upload, error):
+    ChunkedUpload.objects.filter(pk=upload.pk).update(
+        status=ChunkedUpload.Status.FAILED, error=error, updated_at=timezone.now()
+    )
+    remove_part(upload)
+
+
+def attach_photo(upload, path):
+    # файл переносится в branches/ без копирования; дальше его проверяет и
+    # перекодирует фоновая обработка фото (mfc.photo_jobs)
+    filename = get_valid_filename(os.path.basename(upload.filename))
+    with transaction.atomic():
+        branch = Branch.objects.select_for_update().filter(pk=upload.branch_id).first()
+        if branch is None:
+            raise UploadRejected('Отделение не найдено', 404)
+        name = default_storage.get_available_name(f'branches/{filename}')
+        target = default_storage.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        try:
+            branch.photo = name
+            branch.save(update_fields=['photo', 'photo_pending', 'updated_at'])
+        except Exception:
+            default_storage.delete(name)
+            raise
+    return {'branch': branch.pk, 'photo': name}
+
+
+def import_summary(result):
+    return {
+        'rows': result.rows,
+        'created': result.created,
+        'updated': result.updated,
+        'errors_total': len(result.errors),
+        'errors': [
+            {'row': number, 'errors': {field: [str(message) for message in messages] for field, messages in errors.items()}}
+            for number, errors in result.errors[:MAX_REPORTED_ERRORS]
+        ],
+    }
+
+
+def queue_import(upload):
+    # файл большой, импорт идет в фоне; прогресс клиент смотрит через GET загрузки
+    ChunkedUpload.objects.filter(pk=upload.pk).update(
+        status=ChunkedUpload.Status.QUEUED, result={'rows': 0}, updated_at=timezone.now()
+    )
+    transaction.on_commit(lambda: get_executor().submit(run_in_worker, upload.pk))
+
+
+def run_in_worker(upload_id):
+    close_old_connections()
+    try:
+        run_import_job(upload_id)
+    finally:
+        close_old_connections()
+
+
+def run_import_job(upload_id):
+    started = ChunkedUpload.objects.filter(pk=upload_id, status=ChunkedUpload.Status.QUEUED).update(
+        status=ChunkedUpload.Status.IMPORTING, updated_at=timezone.now()
+    )
+    if not started:
+        return
+    upload = ChunkedUpload.objects.get(pk=upload_id)
+
+    def progress(result):
+        # после каждой пачки: сколько строк уже разобрано
+        ChunkedUpload.objects.filter(pk=upload.pk).update(result=import_summary(result), updated_at=timezone.now())
+
+    try:
+        with open(part_path(upload), 'rb') as source:
+            result = run_import(
+                upload.import_kind, source, extension(upload).lstrip('.'), user=upload.user, progress=progress
+            )
+    except Exception as e:
+        fail_upload(upload, f'Не удалось прочитать файл: {e}')
+        return
+    remove_part(upload)
+    ChunkedUpload.objects.filter(pk=upload.pk).update(
+        status=ChunkedUpload.Status.DONE, result=import_summary(result), updated_at=timezone.now()
+    )
+
+
+def complete_upload(upload):
+    # вызывается, когда получен последний байт
+    if upload.purpose == ChunkedUpload.Purpose.IMPORT:
+        queue_import(upload)
+        upload.refresh_from_db()
+        return upload
+    try:
+        result = attach_photo(upload, part_path(upload))
+    except UploadRejected as e:
+        fail_upload(upload, str(e))
+        raise
+    upload.status = ChunkedUpload.Status.DONE
+    upload.result = result
+    upload.save(update_fields=['status', 'result', 'updated_at'])
+    return upload
+
+
+def cancel_upload(upload):
+    cancelled = ChunkedUpload.objects.filter(pk=upload.pk, status=ChunkedUpload.Status.UPLOADING).update(
+        status=ChunkedUpload.Status.CANCELLED, updated_at=timezone.now()
+    )
+    if cancelled:
+        remove_part(upload)
+    return bool(cancelled)
+
+
+def delete_stale_uploads(hours=None):
+    # недокачанные файлы, к которым давно не приходили части
+    hours = get_expire_hours() if hours is None else hours
+    stale = ChunkedUpload.objects.filter(
+        status=ChunkedUpload.Status.UPLOADING, updated_at__lt=timezone.now() - timedelta(hours=hours)
+    )
+    return sum(cancel_upload(upload) for upload in stale.only('pk', 'token'))
+
+
+def run_due_imports():
+    # импорт, который давно не писал прогресс, прервался вместе с процессом;
+    # файлы, пропавшие из очереди пула, импортируются здесь
+    stale = timezone.now() - STALE_AFTER
+    failed = 0
+    abandoned = ChunkedUpload.objects.filter(status=ChunkedUpload.Status.IMPORTING, updated_at__lt=stale)
+    for upload in abandoned.only('pk', 'token'):
+        fail_upload(upload, 'Импорт прервался: процесс остановился')
+        failed += 1
+    done = 0
+    due = ChunkedUpload.objects.filter(status=ChunkedUpload.Status.QUEUED, updated_at__lt=stale).order_by('pk')
+    for upload_id in due.values_list('pk', flat=True):
+        run_import_job(upload_id)
+        done += 1
+    return failed, done
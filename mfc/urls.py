@@ -1,19 +1,40 @@
+from django.conf import settings
 from django.urls import path, include
-from . import views
-from .api import BranchViewSet, ServiceViewSet
+from . import async_views, views
+from .api import AppointmentViewSet, BranchViewSet, ChunkedUploadViewSet, ServiceViewSet
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
 router.register(r'branches', BranchViewSet, basename='branch')
 router.register(r'services', ServiceViewSet, basename='service')
+router.register(r'appointments', AppointmentViewSet, basename='appointment')
+router.register(r'uploads', ChunkedUploadViewSet, basename='upload')
+
+# MFC_ASYNC_VIEWS переключает основные адреса публичных страниц и чтения API на
+# async-версии (mfc.async_views); под /async/ они доступны всегда для сравнения
+ASYNC_VIEWS = getattr(settings, 'MFC_ASYNC_VIEWS', False)
+
+async_api_patterns = [
+    path('api/branches/', async_views.branch_api_list, name='branch-list'),
+    path('api/branches/<int:pk>/', async_views.branch_api_detail, name='branch-detail'),
+    path('api/services/', async_views.service_api_list, name='service-list'),
+    path('api/services/<int:pk>/', async_views.service_api_detail, name='service-detail'),
+]
 
 urlpatterns = [
     # список всех отделений
-    path('', views.branch_list, name='branch_list'),
+    path('', async_views.branch_list if ASYNC_VIEWS else views.branch_list, name='branch_list'),
     
     # детальная информация об отделении
-    path('branches/<int:pk>/', views.branch_detail, name='branch_detail'),
+    path(
+        'branches/<int:pk>/',
+        async_views.branch_detail if ASYNC_VIEWS else views.branch_detail,
+        name='branch_detail'
+    ),
     
+    # загрузка отделения по дням (для сотрудников)
+    path('branches/<int:pk>/stats/', views.branch_stats, name='branch_stats'),
+
     # создание нового отделения
     path('branches/create/', views.branch_create, name='branch_create'),
     
@@ -26,7 +47,19 @@ urlpatterns = [
     # запись на услугу в отделении
     path('branches/<int:branch_pk>/appointment/', views.appointment_create, name='appointment_create'),
 
+    *(async_api_patterns if ASYNC_VIEWS else []),
     path('api/', include(router.urls)),
+
+    # async-версии независимо от MFC_ASYNC_VIEWS
+    path('async/', async_views.branch_list, name='async_branch_list'),
+    path('async/branches/<int:pk>/', async_views.branch_detail, name='async_branch_detail'),
+    path('async/api/branches/', async_views.branch_api_list, name='async_branch_api_list'),
+    path('async/api/branches/<int:pk>/', async_views.branch_api_detail, name='async_branch_api_detail'),
+    path('async/api/services/', async_views.service_api_list, name='async_service_api_list'),
+    path('async/api/services/<int:pk>/', async_views.service_api_detail, name='async_service_api_detail'),
+
+    # метрики запросов в формате Prometheus (для сотрудников)
+    path('metrics/', views.metrics, name='metrics'),
 ]
 
 app_name = 'mfc'
\ No newline at end of file
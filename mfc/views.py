@@ -1,24 +1,47 @@
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db import IntegrityError
 from django.utils import timezone
 from .models import Branch, Service, BranchService, Appointment
-from datetime import datetime
+from .booking import reserve_appointment, SlotUnavailable
+from .cache import get_catalogue_version, get_or_build
+from .daily_stats import get_branch_stats
+from .metrics import registry
+from datetime import datetime, timedelta
+import hmac
 import re
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db.models import Count, Avg
-from math import ceil
 
+def get_branch_rows():
+    # число услуг и средний срок уже посчитаны в колонках отделения
+    return list(Branch.objects.all().order_by('name'))
+
+def can_cache_branch_list(request):
+    # для гостей страница одинаковая, если им не показываются сообщения
+    return not request.user.is_authenticated and not len(messages.get_messages(request))
+
+def branch_list_etag(request):
+    if can_cache_branch_list(request):
+        return f'branch-list-{get_catalogue_version()}'
+    return None
+
+@vary_on_cookie
+@condition(etag_func=branch_list_etag)
 def branch_list(request):
-    branches = Branch.objects.all().order_by('name').annotate(
-        services_count=Count('branch_services', distinct=True),   
-        avg_duration_days=Avg('services__duration_days'), 
-    )
-    for branch in branches:
-        if branch.avg_duration_days:
-            branch.avg_duration_days = ceil(branch.avg_duration_days)
-    
-    return render(request, 'mfc/branch_list.html', {'branches': branches})
+    if not can_cache_branch_list(request):
+        branches = get_or_build('branch_rows', get_branch_rows)
+        return render(request, 'mfc/branch_list.html', {'branches': branches})
+
+    version = get_catalogue_version()
+    html = get_or_build('branch_list_html', lambda: render(request, 'mfc/branch_list.html', {
+        'branches': get_or_build('branch_rows', get_branch_rows, version),
+    }).content.decode(), version)
+    return HttpResponse(html)
 
 def branch_detail(request, pk):
     branch = get_object_or_404(Branch, pk=pk)
@@ -29,6 +52,39 @@ def branch_detail(request, pk):
         'branch': branch,
         'services': services,
     })
+
+def metrics(request):
+    # для Prometheus: сотрудник в сессии или заголовок Authorization: Bearer <MFC_METRICS_TOKEN>
+    token = getattr(settings, 'MFC_METRICS_TOKEN', '')
+    header = request.headers.get('Authorization', '')
+    allowed = request.user.is_staff or (
+        token and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+    )
+    if not allowed:
+        return HttpResponseForbidden('Метрики доступны только сотрудникам')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def branch_stats(request, pk):
+    # загрузка отделения за день: все числа из сводки AppointmentDailyStat
+    branch = get_object_or_404(Branch.objects.only('id', 'name'), pk=pk)
+    try:
+        day = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        day = timezone.localdate()
+    stats = get_branch_stats(branch.pk, day, day)
+    stats = stats[0] if stats else {'total': 0, 'by_status': [], 'by_service': [], 'by_hour': []}
+    busiest = max([row['count'] for row in stats['by_hour']], default=0)
+    for row in stats['by_hour']:
+        row['percent'] = row['count'] * 100 // busiest
+    return render(request, 'mfc/branch_stats.html', {
+        'branch': branch,
+        'day': day,
+        'previous_day': day - timedelta(days=1),
+        'next_day': day + timedelta(days=1),
+        'stats': stats,
+    })
+
 @staff_member_required
 def branch_create(request):
     if request.method == 'POST':
@@ -88,11 +144,16 @@ def branch_create(request):
                     messages.warning(request, "Фото слишком большое (максимум 5MB).")
                 else:
                     branch.photo = photo
-                    branch.save()
+                    branch.save(update_fields=['photo', 'photo_pending', 'updated_at'])
             
             messages.success(request, f'Отделение "{name}" успешно создано!')
             return redirect('mfc:branch_detail', pk=branch.pk)
             
+        except IntegrityError:
+            # то же отделение успели создать параллельно
+            messages.error(request, "Отделение с таким email уже существует")
+            return render(request, 'mfc/branch_form.html', {'form_type': 'create'})
+
         except Exception:
             messages.error(request, 'Произошла ошибка при создании отделения.')
             return render(request, 'mfc/branch_form.html', {'form_type': 'create'})
@@ -129,6 +190,8 @@ def branch_edit(request, pk):
         
         if not email:
             errors.append("Email обязателен для заполнения.")
+        elif Branch.objects.filter(email=email).exclude(pk=branch.pk).exists():
+            errors.append("Отделение с таким email уже существует")
 
         if not work_schedule:
             errors.append("График работы обязателен для заполнения")
@@ -148,22 +211,28 @@ def branch_edit(request, pk):
             branch.work_schedule = work_schedule
             branch.is_active = is_active
             
+            # старый файл удаляет фоновая обработка фото (mfc.photo_jobs)
             if photo_clear and branch.photo:
-                branch.photo.delete(save=False)
                 branch.photo = None
             
             if photo:
                 if photo.size > 5 * 1024 * 1024:
                     messages.warning(request, "Фото слишком большое (максимум 5MB).")
                 else:
-                    if branch.photo:
-                        branch.photo.delete(save=False)
                     branch.photo = photo
             
-            branch.save()
+            # только поля формы: счетчики услуг могли измениться, пока форма была открыта
+            branch.save(update_fields=[
+                'name', 'address', 'phone', 'email', 'work_schedule', 'is_active',
+                'photo', 'photo_pending', 'updated_at',
+            ])
             messages.success(request, f'Отделение "{name}" успешно обновлено!')
             return redirect('mfc:branch_detail', pk=branch.pk)
             
+        except IntegrityError:
+            messages.error(request, "Отделение с таким email уже существует")
+            return render(request, 'mfc/branch_form.html', {'branch': branch, 'form_type': 'edit'})
+
         except Exception:
             messages.error(request, 'Произошла ошибка при обновлении.')
             return render(request, 'mfc/branch_form.html', {'branch': branch, 'form_type': 'edit'})
@@ -181,9 +250,7 @@ def branch_delete(request, pk):
         try:
             branch_name = branch.name
             
-            if branch.photo:
-                branch.photo.delete(save=False)
-            
+            # фото с уменьшенными копиями удаляется в фоне по сигналу post_delete
             branch.delete()
             messages.success(request, f'Отделение "{branch_name}" успешно удалено!')
             return redirect('mfc:branch_list')
@@ -269,13 +336,13 @@ def appointment_create(request, branch_pk):
         
         try:
             service = get_object_or_404(Service, pk=service_id)
-            appointment = Appointment.objects.create(
-                user_profile=request.user.userprofile, 
-                service=service,                        
-                branch=branch,                        
-                date=date_str,                      
-                time=time_str,                         
-                status=Appointment.Status.PENDING       
+            # место в слоте занимается атомарно вместе с созданием записи
+            appointment = reserve_appointment(
+                user_profile=request.user.userprofile,
+                service=service,
+                branch=branch,
+                date=selected_date,
+                value=selected_time,
             )
             
             # показываем пользователю сообщение об успехе
@@ -286,6 +353,16 @@ def appointment_create(request, branch_pk):
             )
             
             return redirect('mfc:branch_detail', pk=branch.pk)
+
+        except SlotUnavailable as e:
+            messages.error(request, f'{e}. Пожалуйста, выберите другое время или дату.')
+            return render(request, 'mfc/appointment_form.html', {
+                'branch': branch,
+                'available_services': available_services,
+                'selected_service': service_id,
+                'selected_date': date_str,
+                'selected_time': time_str,
+            })
             
         except Exception as e:
             messages.error(
@@ -46,8 +46,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mfc.metrics.MetricsMiddleware',
+    'mfc.slow_queries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,8 +56,15 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',
+    'mfc.middleware.HistoryBatchMiddleware',
 ]
 
+if DEBUG:
+    # тулбар умеет только синхронный режим: под ASGI из-за него и async view
+    # выполнялись бы через поток, поэтому вне отладки его в цепочке нет
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+                      'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'mfc_project.urls'
 
 TEMPLATES = [
@@ -85,6 +93,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # ждем освобождения блокировки при одновременной записи на прием
+        'OPTIONS': {
+            'timeout': 20,
+        },
+        # тестовая база в файле: in-memory SQLite не дает писать из нескольких потоков
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -135,11 +151,24 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 os.makedirs(MEDIA_ROOT, exist_ok=True)
 
+# по умолчанию кэш в памяти процесса; при нескольких воркерах нужен общий бэкенд,
+# например MFC_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('MFC_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('MFC_CACHE_LOCATION', 'mfc-default'),
+    }
+}
+
+# сколько секунд хранится закэшированный список отделений
+MFC_CATALOGUE_CACHE_TIMEOUT = 60 * 60
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # номера страниц по умолчанию, курсор по ?pagination=cursor
+    'DEFAULT_PAGINATION_CLASS': 'mfc.pagination.SelectablePagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -151,6 +180,63 @@ REST_FRAMEWORK = {
     ],
 }
 
+# запись на прием: длина слота в минутах и сколько записей принимается
+# на один слот, если для отделения не задана своя вместимость
+MFC_SLOT_MINUTES = 30
+MFC_DEFAULT_SLOT_CAPACITY = 3
+
+# выгрузки больше MFC_EXPORT_BACKGROUND_ROWS строк готовятся в фоне и
+# сохраняются в MFC_EXPORT_DIR (не в MEDIA_ROOT: скачать файл можно только
+# через админку); не больше MFC_EXPORT_JOBS_PER_USER одновременных выгрузок
+# на пользователя
+MFC_EXPORT_BACKGROUND_ROWS = 20000
+MFC_EXPORT_WORKERS = 2
+MFC_EXPORT_JOBS_PER_USER = 2
+MFC_EXPORT_DIR = os.path.join(BASE_DIR, 'exports')
+
+# история изменений: не писать версию, если отслеживаемые поля не изменились
+# (для отдельной модели можно задать BufferedHistoricalRecords(diff_only=True))
+MFC_HISTORY_DIFF_ONLY = False
+
+# compact_history: версии старше стольких дней уходят в архив
+MFC_HISTORY_RETENTION_DAYS = 365
+MFC_HISTORY_ARCHIVE_DIR = os.path.join(BASE_DIR, 'history_archive')
+
+# приблизительный подсчет строк в админке и при ?pagination=approximate:
+# таблицы меньше порога считаются точно, результат COUNT(*) с фильтрами
+# кэшируется на MFC_APPROXIMATE_COUNT_TIMEOUT секунд (refresh_counts пересчитывает
+# и продлевает те, что еще в кэше)
+MFC_APPROXIMATE_COUNT_THRESHOLD = 10000
+MFC_APPROXIMATE_COUNT_TIMEOUT = 5 * 60
+
+# метрики запросов (/metrics/): доля запросов в гистограммах и токен для Prometheus
+MFC_METRICS_SAMPLE_RATE = 0.1
+MFC_METRICS_TOKEN = os.environ.get('MFC_METRICS_TOKEN', '')
+
+# запросы к базе дольше стольких мс попадают в журнал (админка и manage.py slow_queries);
+# None выключает журнал
+MFC_SLOW_QUERY_MS = 100
+
+# фото отделений проверяются и перекодируются в фоне (mfc.photo_jobs): число потоков,
+# попыток на задачу, пауза перед первым повтором (дальше удваивается) и предел размера
+MFC_PHOTO_WORKERS = 2
+MFC_PHOTO_JOB_ATTEMPTS = 3
+MFC_PHOTO_RETRY_SECONDS = 30
+MFC_PHOTO_MAX_SIZE = 5 * 1024 * 1024
+
+# загрузка частями (/api/uploads/): не больше MFC_UPLOAD_CHUNK_SIZE байт в одном
+# запросе, файлы импорта до MFC_IMPORT_MAX_SIZE; недокачанные загрузки удаляет
+# manage.py clean_uploads через MFC_UPLOAD_EXPIRE_HOURS часов без новых частей;
+# полученный файл импортируют MFC_IMPORT_WORKERS фоновых потоков
+MFC_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+MFC_IMPORT_MAX_SIZE = 100 * 1024 * 1024
+MFC_UPLOAD_EXPIRE_HOURS = 24
+MFC_IMPORT_WORKERS = 1
+
+# async-версии списка и карточки отделения и чтения API отделений и услуг на основных
+# адресах (имеет смысл под ASGI, см. mfc_project/asgi.py); под /async/ они доступны всегда
+MFC_ASYNC_VIEWS = os.environ.get('MFC_ASYNC_VIEWS', '') == '1'
+
 LOGIN_URL = '/accounts/login/'  # куда перенаправлять неавторизованных пользователей
 LOGIN_REDIRECT_URL = '/'        # куда перенаправлять после успешного входа
 LOGOUT_REDIRECT_URL = '/' 
@@ -159,6 +245,12 @@ INTERNAL_IPS = [
     '127.0.0.1',
 ]
 
+def show_debug_toolbar(request):
+    # тест-раннер выключает DEBUG, а урлы тулбара подключаются только при DEBUG;
+    # и даже при DEBUG тулбар видят только запросы с INTERNAL_IPS
+    from django.conf import settings
+    return settings.DEBUG and request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS
+
 DEBUG_TOOLBAR_CONFIG = {
-    'SHOW_TOOLBAR_CALLBACK': lambda request: True,
+    'SHOW_TOOLBAR_CALLBACK': show_debug_toolbar,
 }
\ No newline at end of file